@@ -0,0 +1,82 @@
+"""Micro-benchmark ServiceNow callback ingestion on large multi-card bodies.
+
+Compares the current fast path (decode the raw body once, single pass over
+the messages) against the previous one (validate into ServiceNowCallback,
+then rescan the list for Pickers on every message). Debug log serialisation
+is excluded from both, since it is already lazy.
+
+    python benchmarks/callback_ingest.py --messages 500 --repeat 200
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import timeit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+os.environ.setdefault("SERVICENOW_TOKEN", "bench-token")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import chatbot  # noqa: E402
+
+
+def build_body(messages: int) -> bytes:
+    body = []
+    for i in range(messages):
+        if i % 3 == 0:
+            body.append({"uiType": "ActionMsg", "actionType": "System", "message": f"Working on it {i}"})
+        elif i % 3 == 1:
+            body.append({"uiType": "Picker", "label": f"Choose {i}",
+                         "options": [{"label": f"Option {j}", "value": str(j)} for j in range(5)]})
+        else:
+            body.append({"uiType": "OutputCard", "group": "DefaultOutputCard", "templateName": "Card",
+                         "data": json.dumps({"title": f"Result {i}", "fields": [
+                             {"fieldLabel": "Top Result:", "fieldValue": "x" * 200}]})})
+    return json.dumps({"requestId": "bench", "clientSessionId": "bench0", "body": body}).encode()
+
+
+def previous_path(raw: bytes):
+    """The ingestion path before the fast path, kept here for comparison."""
+    # FastAPI decoded the body, then validated it into the model
+    callback = chatbot.ServiceNowCallback(**json.loads(raw))
+    messages = []
+    for msg in callback.body:
+        if msg['uiType'] == 'ActionMsg':
+            messages.append(msg)
+        elif msg['uiType'] == 'OutputCard':
+            messages = [msg]
+        elif msg['uiType'] == 'Picker':
+            if not any(m['uiType'] == 'Picker' for m in messages):
+                messages.append(msg)
+    return messages
+
+
+def fast_path(raw: bytes):
+    callback = chatbot.json_loads(raw)
+    return chatbot.chatbot_api.process_servicenow_callback(callback["requestId"], callback["body"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500, help="Messages per callback body")
+    parser.add_argument("--repeat", type=int, default=200, help="Callbacks per measurement")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("chatbot").setLevel(logging.WARNING)
+    chatbot.chatbot_api.message_store = {}
+    raw = build_body(args.messages)
+    assert previous_path(raw) == fast_path(raw)
+
+    results = {"body_bytes": len(raw), "messages": args.messages, "decoder": chatbot.json_loads.__module__}
+    for name, func in (("previous", previous_path), ("fast", fast_path)):
+        seconds = min(timeit.repeat(lambda: func(raw), number=args.repeat, repeat=5))
+        results[f"{name}_us_per_callback"] = round(seconds / args.repeat * 1e6, 1)
+    results["speedup"] = round(results["previous_us_per_callback"] / results["fast_us_per_callback"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
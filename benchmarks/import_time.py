@@ -0,0 +1,86 @@
+"""Benchmark how long `import chatbot` takes in a fresh interpreter.
+
+Each run imports the app in a new process with `-X importtime` and reports
+the median wall-clock time and the slowest top-level imports. Clients and
+optional integrations are built on first use, so the modules in DEFERRED
+must not be loaded by the import; the script exits non-zero if one is, or if
+the median exceeds --max-seconds.
+
+    python benchmarks/import_time.py --runs 5 --max-seconds 1.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy modules that importing the app must not pull in
+DEFERRED = ("openai", "langsmith", "jinja2")
+
+PROBE = (
+    "import sys, json, chatbot; "
+    f"print(json.dumps([m for m in {DEFERRED!r} if m in sys.modules]))"
+)
+
+
+def import_once():
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "bench-key"), LOG_LEVEL="WARNING")
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - started
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    # importtime lines: "import time: self [us] | cumulative | imported package",
+    # nested two spaces per level; keep the modules chatbot imports directly
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if len(name) - len(name.lstrip()) == 3:
+            top_level[name.strip()] = int(cumulative) / 1e6
+    return elapsed, loaded, top_level
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level imports to list")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Fail if the median import takes longer than this")
+    args = parser.parse_args(argv)
+
+    timings, loaded, top_level = [], set(), {}
+    for _ in range(args.runs):
+        elapsed, run_loaded, run_top = import_once()
+        timings.append(elapsed)
+        loaded.update(run_loaded)
+        for name, seconds in run_top.items():
+            top_level.setdefault(name, []).append(seconds)
+
+    median = statistics.median(timings)
+    slowest = sorted(((statistics.median(v), k) for k, v in top_level.items()), reverse=True)[:args.top]
+    results = {
+        "runs": args.runs,
+        "median_seconds": round(median, 3),
+        "min_seconds": round(min(timings), 3),
+        "slowest_imports": {name: round(seconds, 3) for seconds, name in slowest},
+        "deferred_modules_loaded": sorted(loaded)
+    }
+    print(json.dumps(results, indent=2))
+
+    if loaded:
+        print(f"Importing chatbot loaded deferred modules: {', '.join(sorted(loaded))}", file=sys.stderr)
+        return 1
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"Median import time {median:.3f}s exceeds {args.max_seconds}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,309 @@
+"""Load test the real Bot2Bot app against local ServiceNow and OpenAI stand-ins.
+
+Starts `chatbot:app` under uvicorn in a subprocess, pointed at a fake ServiceNow
+VA endpoint (which calls back into /servicenow/callback after a configurable
+delay) and a fake OpenAI endpoint. Concurrent sessions then go through login,
+chat, callback delivery and poll/acknowledge, and per-stage latencies are
+written as JSON so results can be diffed between releases.
+
+    python benchmarks/load_test.py --sessions 500 --concurrency 100
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def delay(latency: float, jitter: float):
+    await asyncio.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+
+
+def create_fake_servicenow(args, callback_url: str) -> FastAPI:
+    """VA endpoint that acknowledges immediately and answers later via the callback URL."""
+    fake = FastAPI()
+    callback_client = httpx.AsyncClient(timeout=30)
+    tasks = set()
+
+    async def send_callback(payload: dict):
+        await delay(args.callback_delay, args.jitter)
+        body = [
+            {"uiType": "ActionMsg", "actionType": "System", "message": "Please wait"},
+            {
+                "uiType": "OutputCard",
+                "group": "DefaultOutputCard",
+                "templateName": "Card",
+                "data": json.dumps({
+                    "title": "Bench Response",
+                    "fields": [{"fieldLabel": "Top Result:", "fieldValue": f"Echo: {payload['message']['text']}"}]
+                })
+            }
+        ]
+        try:
+            await callback_client.post(callback_url, json={
+                "requestId": payload["requestId"],
+                "clientSessionId": payload["clientSessionId"],
+                "body": body
+            })
+        except httpx.HTTPError as e:
+            print(f"Callback failed: {e}", file=sys.stderr)
+
+    @fake.post("/api/sn_va_as_service/bot/integration")
+    async def integration(request: Request):
+        payload = await request.json()
+        await delay(args.servicenow_latency, args.jitter)
+        task = asyncio.create_task(send_callback(payload))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return {"status": "success"}
+
+    return fake
+
+
+def create_fake_openai(args) -> FastAPI:
+    """Chat completions endpoint returning a canned answer after a delay."""
+    fake = FastAPI()
+
+    @fake.post("/v1/chat/completions")
+    async def completions(request: Request):
+        payload = await request.json()
+        await delay(args.openai_latency, args.jitter)
+        prompt = payload["messages"][-1]["content"]
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"Echo: {prompt}"},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+        }
+
+    return fake
+
+
+async def serve(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+def write_users_file(path: str, count: int, iterations: int):
+    users = {}
+    for i in range(count):
+        password = f"password-{i}"
+        if iterations:
+            salt = os.urandom(16)
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+            users[f"bench-{i}"] = {"password_hash": f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"}
+        else:
+            users[f"bench-{i}"] = {"password": password}
+    with open(path, "w") as f:
+        json.dump(users, f)
+
+
+def start_app(args, port: int, servicenow_port: int, openai_port: int, users_file: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.pop("LANGSMITH_API_KEY", None)
+    env.update({
+        "OPENAI_API_KEY": "bench-key",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "SERVICENOW_INSTANCE": "bench",
+        "SERVICENOW_URL": f"http://127.0.0.1:{servicenow_port}",
+        "SERVICENOW_USERNAME": "bench",
+        "SERVICENOW_PASSWORD": "bench",
+        "SERVICENOW_TOKEN": "bench-token",
+        "USERS_FILE": users_file,
+        "LOG_LEVEL": "WARNING",
+    })
+    # Bench users share accounts across many sessions, so measure capacity rather than the rate limits
+    env.setdefault("RATE_LIMITS", "off")
+    command = [sys.executable, "-m", "uvicorn", "chatbot:app", "--host", "127.0.0.1",
+               "--port", str(port), "--log-level", "warning", "--workers", str(args.workers)]
+    return subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+
+
+async def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("App exited during startup")
+            try:
+                await client.get("/login")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("App did not start in time")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, stage: str, seconds: float):
+        self.latencies.setdefault(stage, []).append(seconds)
+
+    def error(self, stage: str, detail: str):
+        self.errors.setdefault(stage, []).append(detail)
+
+
+async def timed(recorder: Recorder, stage: str, request):
+    started = time.perf_counter()
+    response = await request
+    if response.status_code >= 400:
+        recorder.error(stage, f"HTTP {response.status_code}")
+        response.raise_for_status()
+    recorder.record(stage, time.perf_counter() - started)
+    return response
+
+
+async def run_session(args, base_url: str, index: int, recorder: Recorder):
+    limits = httpx.Limits(max_connections=2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        session_started = time.perf_counter()
+        await timed(recorder, "login", client.post(
+            "/login", json={"username": f"bench-{index % args.users}", "password": f"password-{index % args.users}"}))
+        session_id = uuid.uuid4().hex
+
+        for turn in range(args.turns):
+            message = f"session {index} turn {turn}"
+            response = await timed(recorder, "chat_servicenow", client.post(
+                "/chat", json={"message": message, "session_id": session_id, "use_servicenow": True}))
+            request_id = response.json()["servicenow_response"]["requestId"]
+
+            # Long-poll until the callback has been stored and delivered
+            sent_at = time.perf_counter()
+            body = []
+            while not body and time.perf_counter() - sent_at < args.timeout:
+                response = await timed(recorder, "poll", client.get(f"/poll/{request_id}", params={"wait": 10}))
+                body = response.json()["servicenow_response"]["body"]
+            if not body:
+                recorder.error("callback", f"No callback for {request_id}")
+                continue
+            recorder.record("callback_delivery", time.perf_counter() - sent_at)
+            await timed(recorder, "acknowledge", client.get(f"/poll/{request_id}", params={"acknowledge": "true"}))
+
+            if args.gpt:
+                await timed(recorder, "chat_gpt", client.post(
+                    "/chat", json={"message": message, "session_id": session_id, "use_servicenow": False}))
+
+        recorder.record("session", time.perf_counter() - session_started)
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarise(recorder: Recorder, elapsed: float) -> dict:
+    stages = {}
+    for stage in sorted(set(recorder.latencies) | set(recorder.errors)):
+        values = recorder.latencies.get(stage, [])
+        summary = {"count": len(values), "errors": len(recorder.errors.get(stage, []))}
+        if values:
+            summary.update({
+                "throughput_per_second": round(len(values) / elapsed, 2),
+                "mean_ms": round(statistics.mean(values) * 1000, 2),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                "max_ms": round(max(values) * 1000, 2)
+            })
+        stages[stage] = summary
+    return stages
+
+
+async def main(args) -> dict:
+    app_port, servicenow_port, openai_port = free_port(), free_port(), free_port()
+    base_url = f"http://127.0.0.1:{app_port}"
+    fakes = [
+        await serve(create_fake_servicenow(args, f"{base_url}/servicenow/callback"), servicenow_port),
+        await serve(create_fake_openai(args), openai_port)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        users_file = os.path.join(tmp, "users.json")
+        write_users_file(users_file, args.users, args.password_iterations)
+        process = start_app(args, app_port, servicenow_port, openai_port, users_file)
+        try:
+            await wait_until_ready(base_url, process)
+            recorder = Recorder()
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def bounded(index):
+                async with semaphore:
+                    try:
+                        await run_session(args, base_url, index, recorder)
+                    except Exception as e:
+                        recorder.error("session", f"{type(e).__name__}: {e}")
+
+            started = time.perf_counter()
+            await asyncio.gather(*(bounded(i) for i in range(args.sessions)))
+            elapsed = time.perf_counter() - started
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            for server in fakes:
+                server.should_exit = True
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_seconds": round(elapsed, 3),
+        "sessions_per_second": round(args.sessions / elapsed, 2),
+        "stages": summarise(recorder, elapsed)
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200, help="Total sessions to run")
+    parser.add_argument("--concurrency", type=int, default=50, help="Sessions in flight at once")
+    parser.add_argument("--turns", type=int, default=1, help="ServiceNow messages per session")
+    parser.add_argument("--gpt", action="store_true", help="Also send a GPT message each turn")
+    parser.add_argument("--users", type=int, default=20, help="Distinct bench users to log in as")
+    parser.add_argument("--password-iterations", type=int, default=0,
+                        help="PBKDF2 iterations for bench users (0 stores plaintext passwords)")
+    parser.add_argument("--workers", type=int, default=1, help="Uvicorn workers for the app")
+    parser.add_argument("--servicenow-latency", type=float, default=0.05, help="VA response delay (s)")
+    parser.add_argument("--callback-delay", type=float, default=0.5, help="Delay before the VA calls back (s)")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="Completion delay (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Uniform +/- jitter on all delays (s)")
+    parser.add_argument("--timeout", type=float, default=30, help="Per-request timeout (s)")
+    parser.add_argument("--output", default="bench_output.json", help="Where to write JSON results")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
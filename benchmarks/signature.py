@@ -0,0 +1,70 @@
+"""Micro-benchmark building and signing a ServiceNow VA message.
+
+Compares ServiceNowAPI.build_request (payload serialised once in compact form
+and signed from those bytes with a pre-keyed HMAC) against the previous path
+(serialise, parse, re-serialise compactly, then key a new HMAC per message).
+
+    python benchmarks/signature.py --repeat 100000
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import timeit
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import chatbot  # noqa: E402
+
+TOKEN = "bench-token-0123456789abcdef"
+
+
+def previous_build_request(message, session_id):
+    """The request building path before the fast path, kept here for comparison."""
+    request_id = str(uuid.uuid4())
+    payload = json.dumps({
+        "requestId": request_id,
+        "clientSessionId": session_id[:6] if session_id else "",
+        "nowSessionId": "",
+        "message": {
+            "text": message,
+            "typed": "true",
+            "clientMessageId": f"MSG-{uuid.uuid4().hex[:6]}"
+        },
+        "userId": "beth.anglin"
+    })
+    compact = json.dumps(json.loads(payload), separators=(',', ':'))
+    signature = hmac.new(TOKEN.encode('utf-8'), compact.encode('utf-8'), hashlib.sha1).hexdigest()
+    headers = {'Content-Type': 'application/json', 'x-b2b-signature': signature}
+    return request_id, headers, payload
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100000, help="Messages per measurement")
+    parser.add_argument("--message-length", type=int, default=80, help="Characters per message")
+    args = parser.parse_args(argv)
+
+    api = chatbot.ServiceNowAPI("bench", "user", "pass", TOKEN)
+    message = "x" * args.message_length
+    session_id = uuid.uuid4().hex
+
+    _, headers, payload = api.build_request(message, session_id)
+    assert headers['x-b2b-signature'] == api.generate_signature(payload)
+
+    results = {"message_length": args.message_length}
+    for name, func in (("previous", previous_build_request), ("fast", api.build_request)):
+        seconds = min(timeit.repeat(lambda: func(message, session_id), number=args.repeat, repeat=5))
+        results[f"{name}_us_per_message"] = round(seconds / args.repeat * 1e6, 2)
+    results["speedup"] = round(results["previous_us_per_message"] / results["fast_us_per_message"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,771 @@
-from fastapi import FastAPI, HTTPException, Request, Response, Depends, Cookie, Header, status
+from fastapi import FastAPI, HTTPException, Request, Response, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from pydantic import BaseModel, Field
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
+from starlette.routing import Match, compile_path
+from pydantic import BaseModel, ConfigDict, Field
 import time
 import json
 import os
-import requests
+import httpx
 import logging
-from openai import OpenAI
+import uvicorn
+from uvicorn.importer import import_from_string
+from uvicorn.supervisors.multiprocess import Multiprocess
+from typing import Optional, List, Iterator
 
 # Set up logging first
 from logging import getLogger
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import functools
+import queue
+
+class LazyJSON:
+    """Log argument that is only serialised if the record is actually emitted."""
+
+    __slots__ = ('value', 'indent')
+
+    def __init__(self, value, indent=None):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self):
+        if isinstance(self.value, BaseModel):
+            return self.value.model_dump_json(indent=self.indent)
+        return json.dumps(self.value, indent=self.indent, default=str)
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including any `extra` fields."""
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.RESERVED})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue records without formatting them, leaving that to the listener thread."""
+
+    def prepare(self, record):
+        # QueueHandler.prepare would format the message here, in the request's
+        # thread. Log arguments are read later by the listener instead, so they
+        # must not be mutated after logging.
+        return record
+
+def configure_logging(logger: logging.Logger) -> Optional[QueueListener]:
+    """Configure handlers and per-subsystem levels from LOG_* environment variables.
+
+    LOG_LEVEL sets the base level, LOG_LEVELS overrides subsystems
+    (e.g. "poll=WARNING,servicenow=DEBUG"), LOG_FORMAT=json switches to
+    structured output and LOG_QUEUE=true moves formatting and I/O to a
+    background thread.
+    """
+    handler = logging.StreamHandler()
+    if os.getenv('LOG_FORMAT', 'text') == 'json':
+        handler.setFormatter(JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S'))
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for override in filter(None, os.getenv('LOG_LEVELS', '').split(',')):
+        name, _, level = override.partition('=')
+        logger.getChild(name.strip()).setLevel(level.strip().upper())
+
+    if os.getenv('LOG_QUEUE', 'false').lower() in ('1', 'true', 'yes'):
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(DeferredQueueHandler(log_queue))
+        return listener
+
+    logger.addHandler(handler)
+    return None
+
 logger = getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
-logger.addHandler(handler)
+log_listener = configure_logging(logger)
+# Subsystem loggers, so hot paths can be tuned independently via LOG_LEVELS
+servicenow_logger = logger.getChild("servicenow")
+callback_logger = logger.getChild("callback")
+gpt_logger = logger.getChild("gpt")
+poll_logger = logger.getChild("poll")
 
-# Conditionally import LangSmith
+# LangSmith is only imported when it is first needed, since it is slow to load
 use_langsmith = os.getenv('LANGSMITH_API_KEY') is not None
-if use_langsmith:
+if not use_langsmith:
+    logger.info("LangSmith integration disabled (no API key provided)")
+
+@functools.lru_cache(maxsize=None)
+def load_langsmith():
+    """Return the LangSmith module, or None if it is disabled or not installed."""
+    if not use_langsmith:
+        return None
     try:
-        from langsmith.wrappers import wrap_openai
-        from langsmith import traceable
+        import langsmith
+        import langsmith.wrappers
         logger.info("LangSmith integration enabled")
+        return langsmith
     except ImportError:
-        use_langsmith = False
         logger.warning("LangSmith package not installed, disabling LangSmith integration")
-else:
-    logger.info("LangSmith integration disabled (no API key provided)")
+        return None
+
+# Use orjson to parse hot-path request bodies when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 import uuid
-from typing import Optional, List
 import random
+import math
 from dotenv import load_dotenv
 import hmac
 import hashlib
-import traceback
+import gzip
+import mimetypes
+from contextlib import asynccontextmanager
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import select
+import socket
+import sqlite3
+import unicodedata
+import re
+import threading
+import asyncio
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+# Metrics
+class Metric:
+    """Base for metrics rendered in the Prometheus text exposition format."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+
+    def label_key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def format_labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{label}="{escape_label(value)}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        return []
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.label_key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in items]
+
+class Histogram(Metric):
+    type = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self.values.get(self.label_key(labels))
+        return series[-1] if series else 0
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.values.items()]
+        lines = []
+        for key, series in items:
+            for bound, bucket_count in zip(self.buckets, series):
+                bucket_labels = self.format_labels(key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+            bucket_labels = self.format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {series[-1]}")
+        return lines
+
+class Gauge(Metric):
+    """Gauge whose value is read from a callback at scrape time.
+
+    With labels, the callback returns a list of (labels dict, value) pairs.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        if not self.labels:
+            return [f"{self.name} {self.read()}"]
+        return [f"{self.name}{self.format_labels(self.label_key(labels))} {value}"
+                for labels, value in self.read()]
+
+class CallbackCounter(Gauge):
+    """Counter whose running total is kept elsewhere (e.g. by a store) and read at scrape time."""
+
+    type = "counter"
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        rendered = []
+        for metric in self.metrics:
+            try:
+                rendered.append(metric.render())
+            except Exception as e:
+                logger.error("Error rendering metric %s: %s", metric.name, e)
+        return "\n".join(rendered) + "\n"
+
+metrics = MetricsRegistry()
+HTTP_REQUESTS = metrics.register(Counter(
+    "http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")))
+HTTP_LATENCY = metrics.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route")))
+SERVICENOW_RESPONSES = metrics.register(Counter(
+    "servicenow_responses_total", "ServiceNow VA calls by HTTP status.", ("instance", "status")))
+SERVICENOW_LATENCY = metrics.register(Histogram(
+    "servicenow_request_duration_seconds", "ServiceNow VA send_message_to_va round-trip time.", ("instance",)))
+GPT_LATENCY = metrics.register(Histogram(
+    "gpt_request_duration_seconds", "GPT completion latency.", ("mode",)))
+GPT_TOKENS = metrics.register(Counter(
+    "gpt_tokens_total", "GPT tokens used.", ("type",)))
+CALLBACK_DELIVERY_LAG = metrics.register(Histogram(
+    "servicenow_callback_delivery_seconds", "Time from storing a ServiceNow callback to its first delivery.",
+    ("channel",)))
+
+class MetricsMiddleware:
+    """Record per-route request counts and latency (ASGI, so streamed responses are timed to completion)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # FastAPI records the matched route in the scope, giving a bounded label set
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], route=route_path)
+            HTTP_REQUESTS.inc(method=scope["method"], route=route_path, status=status_code)
+
+# Outbound call resilience
+BACKEND_RETRIES = metrics.register(Counter(
+    "backend_retries_total", "Outbound calls retried after a transient failure.", ("backend",)))
+BACKEND_REJECTED = metrics.register(Counter(
+    "backend_circuit_rejections_total", "Outbound calls refused because the circuit was open.", ("backend",)))
+CIRCUIT_TRANSITIONS = metrics.register(Counter(
+    "backend_circuit_transitions_total", "Circuit breaker state changes.", ("backend", "state")))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is temporarily unavailable")
+        self.name = name
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Fail fast while a backend keeps failing, probing it again after a cool-down.
+
+    Opens after `failure_threshold` consecutive failures. Once `reset_timeout`
+    has passed it goes half-open and lets a single probe through, which either
+    closes the circuit or opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    BACKEND_REJECTED.inc(backend=self.name)
+                    raise CircuitOpenError(self.name, remaining)
+                self.transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self.probing:
+                    BACKEND_REJECTED.inc(backend=self.name)
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            if self.state != self.CLOSED:
+                self.transition(self.CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self.transition(self.OPEN)
+
+    def abandon(self):
+        """Release a half-open probe whose call was cancelled without an outcome."""
+        with self.lock:
+            self.probing = False
+
+    def transition(self, state: str):
+        logger.warning("Circuit for %s is now %s (after %d consecutive failures)", self.name, state, self.failures)
+        self.state = state
+        CIRCUIT_TRANSITIONS.inc(backend=self.name, state=state)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+class RetryPolicy:
+    """Exponential backoff with full jitter."""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4.0):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class Backend:
+    """Retry policy and circuit breaker guarding calls to one outbound dependency.
+
+    `is_failure` decides which errors count against the circuit; `is_retryable`
+    narrows that to errors that are safe to retry (the request was not
+    processed, or the call is idempotent). Anything else means the backend
+    answered, so it counts as a success for the breaker and is raised as-is.
+    """
+
+    def __init__(self, name: str, retry: RetryPolicy, breaker: CircuitBreaker, is_failure, is_retryable=None):
+        self.name = name
+        self.retry = retry
+        self.breaker = breaker
+        self.is_failure = is_failure
+        self.is_retryable = is_retryable or is_failure
+
+    def call(self, func, *args, **kwargs):
+        for attempt in range(self.retry.attempts):
+            self.breaker.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                if not self.should_retry(e, attempt):
+                    raise
+            else:
+                self.breaker.record_success()
+                return result
+            time.sleep(self.retry.backoff(attempt))
+
+    async def acall(self, func, *args, **kwargs):
+        for attempt in range(self.retry.attempts):
+            self.breaker.before_call()
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException as e:
+                if not self.should_retry(e, attempt):
+                    raise
+            else:
+                self.breaker.record_success()
+                return result
+            await asyncio.sleep(self.retry.backoff(attempt))
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        """Record a failed attempt against the breaker and decide whether to try again."""
+        if not isinstance(error, Exception):
+            self.breaker.abandon()
+            return False
+        if not self.is_failure(error):
+            self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        if attempt + 1 < self.retry.attempts and self.is_retryable(error):
+            BACKEND_RETRIES.inc(backend=self.name)
+            logger.warning("Retrying %s after %s (attempt %d of %d)",
+                           self.name, type(error).__name__, attempt + 2, self.retry.attempts)
+            return True
+        return False
+
+def create_backend(name: str, prefix: str, is_failure, is_retryable=None) -> Backend:
+    """Build a Backend from <PREFIX>_RETRY_* and <PREFIX>_CIRCUIT_* settings."""
+    return Backend(
+        name,
+        RetryPolicy(
+            attempts=int(os.getenv(f'{prefix}_RETRY_ATTEMPTS', '3')),
+            base_delay=float(os.getenv(f'{prefix}_RETRY_BASE_DELAY', '0.25')),
+            max_delay=float(os.getenv(f'{prefix}_RETRY_MAX_DELAY', '4'))
+        ),
+        CircuitBreaker(
+            name,
+            failure_threshold=int(os.getenv(f'{prefix}_CIRCUIT_FAILURE_THRESHOLD', '5')),
+            reset_timeout=float(os.getenv(f'{prefix}_CIRCUIT_RESET_SECONDS', '30'))
+        ),
+        is_failure,
+        is_retryable
+    )
+
+# Rate limiting
+RATE_LIMITED = metrics.register(Counter(
+    "http_rate_limited_total", "Requests rejected by the rate limiter.", ("route", "key")))
+
+class TokenBucketLimiter:
+    """Token buckets for one rate, keyed by caller.
+
+    Each key costs one (tokens, updated_at) entry. A bucket left idle long
+    enough to refill completely is indistinguishable from a new one, so idle
+    keys are dropped from the least recently used end as requests arrive.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.idle_seconds = burst / rate
+        self.buckets = OrderedDict()  # key -> (tokens, updated_at), least recently used first
+        self.lock = threading.Lock()
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """Take a token for key. Returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            while self.buckets:
+                oldest, (_, updated_at) = next(iter(self.buckets.items()))
+                if now - updated_at < self.idle_seconds and len(self.buckets) < self.max_keys:
+                    break
+                del self.buckets[oldest]
+
+            tokens, updated_at = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0.0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def __len__(self):
+        return len(self.buckets)
+
+class RateLimitRule:
+    def __init__(self, method: str, path: str, limiters: dict):
+        self.method = method
+        self.path = path
+        self.regex = compile_path(path)[0]
+        self.limiters = limiters  # key kind (user, session or ip) -> TokenBucketLimiter
+
+    def matches(self, scope) -> bool:
+        return scope["method"] == self.method and self.regex.match(scope["path"]) is not None
+
+def parse_rate_limits(spec: str) -> List[RateLimitRule]:
+    """Parse "METHOD /path kind=rate/burst ..." rules separated by commas.
+
+    rate is tokens per second and burst the bucket size; kind is user,
+    session (the login cookie) or ip. Requests without a user or session
+    are keyed by client address instead.
+    """
+    rules = []
+    for entry in spec.split(','):
+        parts = entry.split()
+        if not parts:
+            continue
+        if len(parts) < 2:
+            raise ValueError(f"Rate limit rule {entry.strip()!r} needs a method and a path")
+        method, path, *limits = parts
+        limiters = {}
+        for limit in limits:
+            kind, _, value = limit.partition('=')
+            rate, _, burst = value.partition('/')
+            if kind not in ('user', 'session', 'ip'):
+                raise ValueError(f"Unknown rate limit key {kind!r} in {entry.strip()!r}")
+            try:
+                rate, burst = float(rate), float(burst or rate)
+            except ValueError:
+                raise ValueError(f"Rate limit {limit!r} in {entry.strip()!r} is not rate/burst") from None
+            # A bucket must refill and hold at least one token, or no request could ever pass
+            if not rate > 0 or not burst >= 1:
+                raise ValueError(f"Rate limit {limit!r} in {entry.strip()!r} needs rate > 0 and burst >= 1")
+            limiters[kind] = TokenBucketLimiter(rate, burst)
+        rules.append(RateLimitRule(method.upper(), path, limiters))
+    return rules
+
+DEFAULT_RATE_LIMITS = (
+    "POST /chat user=1/10 session=1/10,"
+    "POST /chat/stream user=1/10 session=1/10,"
+    "GET /poll/{request_id} session=10/30,"
+    "GET /servicenow/responses/{request_id} session=10/30,"
+    "POST /servicenow/responses session=10/30"
+)
+
+class RateLimitMiddleware:
+    """Reject requests over their route's token bucket limits (rate_limits) with 429 and Retry-After."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rule = next((rule for rule in rate_limits if rule.matches(scope)), None)
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        session_id = request.cookies.get("session_id")
+        client_ip = request.client.host if request.client else "unknown"
+        user = await store_call(sessions, get_current_user, request) if 'user' in rule.limiters and session_id else None
+        keys = {
+            'user': f"user:{user.username}" if user else f"ip:{client_ip}",
+            'session': f"session:{session_id}" if session_id else f"ip:{client_ip}",
+            'ip': f"ip:{client_ip}"
+        }
+
+        # Limits are per worker; a caller spread across N workers gets up to N times the rate
+        retry_after = 0.0
+        for kind, limiter in rule.limiters.items():
+            wait = limiter.acquire(keys[kind])
+            if wait:
+                RATE_LIMITED.inc(route=rule.path, key=kind)
+                retry_after = max(retry_after, wait)
+        if retry_after:
+            # Routing has not run yet, so resolve the route for MetricsMiddleware's route label
+            scope["route"] = next((route for route in app.router.routes
+                                   if route.matches(scope)[0] == Match.FULL), None)
+            response = JSONResponse(
+                {"detail": "Too many requests"}, status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+def rate_limit_rules() -> List[RateLimitRule]:
+    spec = os.getenv('RATE_LIMITS', DEFAULT_RATE_LIMITS)
+    return [] if spec.strip().lower() == 'off' else parse_rate_limits(spec)
+
+rate_limits = rate_limit_rules()
+
+# Startup warm-up, readiness and graceful drain
+WARMUP_ENABLED = os.getenv('WARMUP', 'true').lower() == 'true'
+WARMUP_TIMEOUT_SECONDS = float(os.getenv('WARMUP_TIMEOUT_SECONDS', '10'))
+SHUTDOWN_DELAY_SECONDS = float(os.getenv('SHUTDOWN_DELAY_SECONDS', '5'))
+DRAIN_TIMEOUT_SECONDS = float(os.getenv('DRAIN_TIMEOUT_SECONDS', '25'))
+
+class Lifecycle:
+    """Tracks warm-up, readiness and the shutdown deadline for this worker."""
+
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self.drain_deadline = None  # time.monotonic() by which shutdown should finish
+        self.warmup = {}  # component -> "ok", "skipped" or the error
+
+    async def warm_up_component(self, name: str, warm):
+        try:
+            await asyncio.wait_for(warm(), WARMUP_TIMEOUT_SECONDS)
+            self.warmup[name] = "ok"
+        except Exception as e:
+            # Warm-up is best effort; a backend that is down now is handled per request
+            logger.warning("Warm-up of %s failed: %s", name, e or type(e).__name__)
+            self.warmup[name] = f"error: {e or type(e).__name__}"
+
+    def begin_drain(self, timeout: float):
+        """Fail readiness from now on; shutdown should complete within timeout seconds."""
+        if not self.draining:
+            self.draining = True
+            self.drain_deadline = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.drain_deadline - time.monotonic()) if self.drain_deadline else 0.0
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait for relay dialogues, which outlive their HTTP request, until the drain deadline."""
+        self.begin_drain(timeout)
+        if relay_tasks:
+            await asyncio.wait(list(relay_tasks), timeout=self.remaining())
+        return not relay_tasks
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready and not self.draining,
+            "draining": self.draining,
+            "relay_dialogues": len(relay_tasks),
+            "warmup": self.warmup
+        }
+
+lifecycle = Lifecycle()
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that keeps serving, but not ready, for a pre-stop delay after SIGTERM.
+
+    uvicorn closes its sockets and waits for open requests before the lifespan
+    shutdown runs, so readiness has to fail here for load balancers to see it.
+    """
+
+    def __init__(self, config: uvicorn.Config):
+        super().__init__(config)
+        self.stop_at = None
+
+    def app_lifecycle(self) -> Lifecycle:
+        # Workers import the app by name, so under "python chatbot.py" it is not this module's global
+        app = self.config.app
+        if isinstance(app, str):
+            app = import_from_string(app)
+        return app.state.lifecycle
+
+    async def on_tick(self, counter: int) -> bool:
+        should_exit = await super().on_tick(counter)
+        if not should_exit or self.force_exit:
+            return should_exit
+        if self.stop_at is None:
+            logger.info("Shutdown requested; failing readiness for %ss before closing connections",
+                        SHUTDOWN_DELAY_SECONDS)
+            # One budget for the whole shutdown: pre-stop delay, open requests, then relay dialogues
+            self.app_lifecycle().begin_drain(SHUTDOWN_DELAY_SECONDS + DRAIN_TIMEOUT_SECONDS)
+            self.stop_at = time.monotonic() + SHUTDOWN_DELAY_SECONDS
+        return time.monotonic() >= self.stop_at
+
+class DrainingSupervisor(Multiprocess):
+    """Signal every worker before waiting on any, so they all drain in parallel."""
+
+    def shutdown(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        logger.info("Stopping parent process [%d]", self.pid)
+
+async def warm_up():
+    """Load credentials and open connections, then report ready."""
+    await lifecycle.warm_up_component("credentials", lambda: run_in_threadpool(credential_store.reload_if_changed))
+    await lifecycle.warm_up_component("static", lambda: run_in_threadpool(static_assets.scan))
+    if WARMUP_ENABLED:
+        await asyncio.gather(
+            *(lifecycle.warm_up_component(f"servicenow:{name}", api.warm_up)
+              for name, api in servicenow_instances.instances.items()),
+            lifecycle.warm_up_component("openai", lambda: run_in_threadpool(lambda: get_openai_client().models.retrieve(GPT_MODEL)))
+        )
+    else:
+        lifecycle.warmup.update(servicenow="skipped", openai="skipped")
+    lifecycle.ready = True
+    logger.info("Worker ready (warm-up: %s)", lifecycle.warmup)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(sweep_state_stores())
+    # Warm up after the socket is bound, so /health/ready can report 503 meanwhile
+    warmer = asyncio.create_task(warm_up())
+    yield
+
+    # By now uvicorn has stopped accepting connections and finished (or cancelled) open requests
+    warmer.cancel()
+    if not await lifecycle.drain(DRAIN_TIMEOUT_SECONDS):
+        logger.warning("Drain timed out with %d relay dialogues running", len(relay_tasks))
+    sweeper.cancel()
+    for task in list(relay_tasks):
+        task.cancel()
+    for name, store in state_stores().items():
+        try:
+            if hasattr(store, 'close'):
+                store.close()
+        except Exception as e:
+            logger.error("Error closing %s store: %s", name, e)
+    # Close pooled outbound connections on shutdown
+    await servicenow_instances.aclose()
+    if openai_client is not None:
+        await run_in_threadpool(openai_client.close)
+
+app = FastAPI(lifespan=lifespan)
+app.state.lifecycle = lifecycle
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -52,17 +774,701 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize OpenAI client, with optional LangSmith wrapper
-openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-if use_langsmith:
-    client = wrap_openai(openai_client)
-else:
-    client = openai_client
+# Clients and templates are built on first use rather than at import, so
+# workers (and tests) start without loading openai, langsmith or jinja2.
+# The providers are sync, so FastAPI resolves them as dependencies in the
+# threadpool; the lock makes concurrent first calls share one instance.
+openai_client = None  # raw OpenAI client, used for warm-up and shutdown
+client = None  # the same client, wrapped for LangSmith tracing when enabled
+templates = None
+providers_lock = threading.RLock()
+
+def get_openai_client():
+    """Return the shared OpenAI client, creating it on first use."""
+    global openai_client
+    with providers_lock:
+        if openai_client is None:
+            from openai import OpenAI
+            # Retries are left to openai_backend so they share one policy and circuit breaker
+            openai_client = OpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                timeout=httpx.Timeout(
+                    float(os.getenv('OPENAI_TIMEOUT', '60')),
+                    connect=float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+                ),
+                max_retries=0
+            )
+        return openai_client
+
+def get_gpt_client():
+    """Return the client completions are sent through, with the optional LangSmith wrapper."""
+    global client
+    with providers_lock:
+        if client is None:
+            langsmith = load_langsmith()
+            client = langsmith.wrappers.wrap_openai(get_openai_client()) if langsmith else get_openai_client()
+        return client
+
+def get_templates():
+    """Return the page templates, loading Jinja2 on first use."""
+    global templates
+    with providers_lock:
+        if templates is None:
+            from fastapi.templating import Jinja2Templates
+            templates = Jinja2Templates(directory="templates")
+        return templates
+
+# Static assets: content-hashed URLs, precompressed variants and validators
+STATIC_DIRECTORY = os.getenv('STATIC_DIRECTORY', 'static')
+STATIC_MAX_AGE_SECONDS = int(os.getenv('STATIC_MAX_AGE_SECONDS', str(365 * 24 * 3600)))
+# Most preferred first; variants are written next to each file by "python chatbot.py assets"
+STATIC_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+STATIC_MIN_COMPRESS_BYTES = 1024
+STATIC_REFERENCE = re.compile(r'((?:src|href)=["\'])/static/([^"\'?#]+)')
+
+def compress_asset(data: bytes, encoding: str) -> Optional[bytes]:
+    """Compress data for a content coding, or return None if it is unavailable."""
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    try:
+        import brotli
+    except ImportError:
+        return None  # brotli is optional; gzip is always available
+    return brotli.compress(data)
+
+def is_compressible(path: str) -> bool:
+    media_type = mimetypes.guess_type(path)[0] or ""
+    return media_type.startswith("text/") or media_type in (
+        "application/javascript", "application/json", "application/xml", "image/svg+xml"
+    )
+
+def accepted_encodings(header: str) -> set:
+    """Return the content codings an Accept-Encoding header allows (q > 0)."""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding)
+    if "*" in accepted:
+        accepted.update(encoding for encoding, _ in STATIC_ENCODINGS)
+    return accepted
+
+def choose_encoding(available, accept_encoding: str) -> Optional[str]:
+    accepted = accepted_encodings(accept_encoding)
+    return next((encoding for encoding in available if encoding in accepted), None)
+
+def representation_etag(digest: str, encoding: Optional[str]) -> str:
+    # Each encoded representation needs its own validator
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+class StaticAsset:
+    def __init__(self, path: str, full_path: str, digest: str, stat_result: os.stat_result, encodings: tuple):
+        self.path = path
+        self.full_path = full_path
+        self.digest = digest
+        self.version = (stat_result.st_size, stat_result.st_mtime_ns)
+        self.encodings = encodings  # precompressed variants on disk, most preferred first
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        root, ext = os.path.splitext(path)
+        self.hashed_path = f"{root}.{digest}{ext}"
+
+class StaticAssets:
+    """Serve a static directory with content-hashed URLs, precompressed variants and ETags.
+
+    Hashed URLs (styles.<digest>.css) never change content, so they are cached as
+    immutable; plain URLs keep working but are revalidated with their ETag. The
+    index shell is rendered once with hashed references and kept in memory.
+    """
+
+    def __init__(self, directory: str, max_age: int = STATIC_MAX_AGE_SECONDS):
+        self.directory = os.path.realpath(directory)
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.assets = {}  # path -> StaticAsset
+        self.fingerprints = {}  # hashed path -> path
+        self.scanned = False
+        self.index = None  # (index.html version, digest, {encoding: body})
+
+    def resolve_path(self, path: str) -> Optional[str]:
+        full_path = os.path.realpath(os.path.join(self.directory, path))
+        if os.path.commonpath([full_path, self.directory]) != self.directory or not os.path.isfile(full_path):
+            return None
+        return full_path
+
+    def load(self, path: str) -> Optional[StaticAsset]:
+        """Return the asset at path, hashing it if it is new or has changed on disk."""
+        full_path = self.resolve_path(path)
+        if full_path is None:
+            return None
+        stat_result = os.stat(full_path)
+        asset = self.assets.get(path)
+        if asset is not None and asset.version == (stat_result.st_size, stat_result.st_mtime_ns):
+            return asset
+        with open(full_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        encodings = []
+        for encoding, suffix in STATIC_ENCODINGS:
+            # Ignore variants left over from an older version of the file
+            variant = full_path + suffix
+            if os.path.isfile(variant) and os.stat(variant).st_mtime_ns >= stat_result.st_mtime_ns:
+                encodings.append(encoding)
+        asset = StaticAsset(path, full_path, digest, stat_result, tuple(encodings))
+        with self.lock:
+            previous = self.assets.get(path)
+            if previous is not None:
+                self.fingerprints.pop(previous.hashed_path, None)
+            self.assets[path] = asset
+            self.fingerprints[asset.hashed_path] = path
+        return asset
+
+    def paths(self) -> Iterator[str]:
+        suffixes = tuple(suffix for _, suffix in STATIC_ENCODINGS)
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(suffixes):
+                    yield os.path.relpath(os.path.join(root, name), self.directory).replace(os.sep, '/')
+
+    def scan(self) -> int:
+        """Hash every file up front so hashed URLs resolve from the first request."""
+        for path in self.paths():
+            self.load(path)
+        self.scanned = True
+        return len(self.assets)
+
+    def url(self, path: str) -> str:
+        asset = self.load(path)
+        return f"/static/{asset.hashed_path if asset else path}"
+
+    def respond(self, path: str, request: Request) -> Response:
+        if not self.scanned:
+            self.scan()
+        original = self.fingerprints.get(path)
+        asset = self.load(original or path)
+        # A hashed URL for content that has since changed no longer exists
+        if asset is None or (original is not None and asset.hashed_path != path):
+            raise HTTPException(status_code=404, detail="Not Found")
+        encoding = choose_encoding(asset.encodings, request.headers.get("accept-encoding", ""))
+        headers = {
+            "cache-control": f"public, max-age={self.max_age}, immutable" if original else "no-cache",
+            "etag": representation_etag(asset.digest, encoding)
+        }
+        if asset.encodings:
+            headers["vary"] = "Accept-Encoding"
+        if etag_matches(request.headers.get("if-none-match"), headers["etag"]):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["content-encoding"] = encoding
+            return FileResponse(asset.full_path + dict(STATIC_ENCODINGS)[encoding], headers=headers,
+                                media_type=asset.media_type, method=request.method)
+        return FileResponse(asset.full_path, headers=headers, media_type=asset.media_type, method=request.method)
+
+    def render_index(self):
+        """Return (digest, {encoding: body}) for index.html with hashed asset references."""
+        full_path = self.resolve_path("index.html")
+        if full_path is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        stat_result = os.stat(full_path)
+        version = (stat_result.st_size, stat_result.st_mtime_ns)
+        index = self.index
+        if index is not None and index[0] == version:
+            return index[1], index[2]
+        with open(full_path, encoding="utf-8") as f:
+            html = STATIC_REFERENCE.sub(lambda m: m.group(1) + self.url(m.group(2)), f.read())
+        body = html.encode("utf-8")
+        bodies = {None: body}
+        for encoding, _ in STATIC_ENCODINGS:
+            compressed = compress_asset(body, encoding)
+            if compressed is not None and len(compressed) < len(body):
+                bodies[encoding] = compressed
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        self.index = (version, digest, bodies)
+        return digest, bodies
+
+    def index_response(self, request: Request) -> Response:
+        digest, bodies = self.render_index()
+        encoding = choose_encoding([e for e in bodies if e], request.headers.get("accept-encoding", ""))
+        headers = {"cache-control": "no-cache", "etag": representation_etag(digest, encoding),
+                   "vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), headers["etag"]):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["content-encoding"] = encoding
+        return HTMLResponse(bodies[encoding], headers=headers)
+
+def precompress_assets(directory: str) -> dict:
+    """Write .br/.gz variants next to each compressible file; returns counts by encoding."""
+    written = {}
+    for path in StaticAssets(directory).paths():
+        full_path = os.path.join(directory, path)
+        if not is_compressible(full_path) or os.path.getsize(full_path) < STATIC_MIN_COMPRESS_BYTES:
+            continue
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        for encoding, suffix in STATIC_ENCODINGS:
+            compressed = compress_asset(data, encoding)
+            # Only keep variants that actually save bytes
+            if compressed is None or len(compressed) >= len(data):
+                continue
+            with open(full_path + suffix, 'wb') as f:
+                f.write(compressed)
+            written[encoding] = written.get(encoding, 0) + 1
+    return written
+
+static_assets = StaticAssets(STATIC_DIRECTORY)
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def static_file(path: str, request: Request):
+    return await run_in_threadpool(static_assets.respond, path, request)
+
+# Shared state stores
+class StateStore(MutableMapping):
+    """Dict-like map of request/session state that a backend may share between workers."""
+
+    # Whether other workers can see writes, so in-process wake-ups are not enough
+    shared = False
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """Store a value, overriding the store's default TTL for this entry."""
+        self[key] = value
+
+    def sweep(self) -> int:
+        """Drop expired entries; returns how many were removed."""
+        return 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self)}
+
+    def close(self):
+        """Flush and release any backend resources on shutdown."""
+
+class MemoryStore(StateStore):
+    """State kept in this process only, with optional TTL and LRU size bounds."""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()  # key -> (value, expires_at, size), least recently used first
+        self.total_bytes = 0
+        self.expired = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self.lock:
+            value, expires_at, _ = self.data[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expired += 1
+                raise KeyError(key)
+            self.data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        # Only pay for measuring values when a byte cap is configured
+        size = len(json.dumps(value, default=str)) if self.max_bytes else 0
+        with self.lock:
+            if key in self.data:
+                self._remove(key)
+            self.data[key] = (value, expires_at, size)
+            self.total_bytes += size
+            self._evict()
+
+    def __delitem__(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def pop(self, key, *default):
+        """Remove and return a live value in one step, so concurrent readers cannot both take it."""
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None:
+                self._remove(key)
+                if entry[1] is None or entry[1] > time.monotonic():
+                    return entry[0]
+                self.expired += 1
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def _remove(self, key):
+        _, _, size = self.data.pop(key)
+        self.total_bytes -= size
+
+    def _evict(self):
+        while self.data and (
+            (self.max_entries is not None and len(self.data) > self.max_entries) or
+            (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            key = next(iter(self.data))
+            self._remove(key)
+            self.evicted += 1
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, (_, expires_at, _) in self.data.items()
+                       if expires_at is not None and expires_at <= now]
+            for key in expired:
+                self._remove(key)
+            self.expired += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.data),
+            "bytes": self.total_bytes if self.max_bytes else None,
+            "expired": self.expired,
+            "evicted": self.evicted
+        }
+
+class RespConnection:
+    """One socket to a Redis-protocol server."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+
+    def is_stale(self) -> bool:
+        # An idle connection has nothing to read, so readable means the server closed it
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def send(self, args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b"".join(parts))
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode('utf-8')
+        if prefix == b"-":
+            raise RuntimeError(f"Redis error: {rest.decode('utf-8')}")
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply: {line!r}")
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+class RespClient:
+    """Minimal blocking client for servers speaking the Redis protocol (RESP2).
+
+    Connections are pooled, so concurrent callers (threadpool workers, see
+    store_call) each get their own socket instead of queueing on one.
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=5.0, max_connections=20):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.lock = threading.Lock()
+        self.idle = []  # most recently used last
+
+    @classmethod
+    def from_url(cls, url: str, timeout: float = 5.0, max_connections: int = 20) -> "RespClient":
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip('/') or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password, timeout,
+                   max_connections)
+
+    def connect(self) -> RespConnection:
+        connection = RespConnection(socket.create_connection((self.host, self.port), timeout=self.timeout))
+        try:
+            if self.password:
+                connection.send(("AUTH", self.password))
+                connection.read_reply()
+            if self.db:
+                connection.send(("SELECT", self.db))
+                connection.read_reply()
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def checkout(self) -> RespConnection:
+        while True:
+            with self.lock:
+                connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                return self.connect()
+            if not connection.is_stale():
+                return connection
+            connection.close()
+
+    def checkin(self, connection: RespConnection):
+        with self.lock:
+            self.idle.append(connection)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def execute(self, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise ConnectionError("Timed out waiting for a free Redis connection")
+        try:
+            connection = self.checkout()
+            try:
+                try:
+                    connection.send(args)
+                except OSError:
+                    # The command never fully reached the server, so it is safe to send again
+                    connection.close()
+                    connection = self.connect()
+                    connection.send(args)
+                reply = connection.read_reply()
+            except RuntimeError:
+                # An error reply leaves the connection in sync
+                self.checkin(connection)
+                raise
+            except BaseException:
+                # Once a command is written it may have run (e.g. GETDEL), so it is never replayed
+                connection.close()
+                raise
+            self.checkin(connection)
+            return reply
+        finally:
+            self.slots.release()
+
+class RedisStore(StateStore):
+    """State kept in a Redis-protocol server, one key per entry under a namespace."""
+
+    shared = True
+
+    def __init__(self, client: RespClient, namespace: str, encode=None, decode=None,
+                 ttl: Optional[float] = None):
+        self.client = client
+        self.prefix = f"bot2bot:{namespace}:"
+        self.ttl = ttl
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+
+    def __getitem__(self, key):
+        raw = self.client.execute("GET", self.prefix + key)
+        if raw is None:
+            raise KeyError(key)
+        return self.decode(json.loads(raw))
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        # Expiry and memory limits are enforced by the server (EX / maxmemory-policy)
+        ttl = self.ttl if ttl is None else ttl
+        args = ["SET", self.prefix + key, json.dumps(self.encode(value))]
+        if ttl is not None:
+            args += ["PX", int(ttl * 1000)]
+        self.client.execute(*args)
+
+    def __delitem__(self, key):
+        if not self.client.execute("DEL", self.prefix + key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return bool(self.client.execute("EXISTS", self.prefix + key))
 
-# Mount static files and templates
-static_files = StaticFiles(directory="static")
-app.mount("/static", static_files, name="static")
-templates = Jinja2Templates(directory="templates")
+    def __iter__(self):
+        cursor = "0"
+        while True:
+            cursor, keys = self.client.execute("SCAN", cursor, "MATCH", self.prefix + "*", "COUNT", 500)
+            cursor = cursor.decode('utf-8')
+            for key in keys:
+                yield key.decode('utf-8')[len(self.prefix):]
+            if cursor == "0":
+                break
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def pop(self, key, *default):
+        # GETDEL fetches and removes in one round trip, so two workers cannot both claim a value
+        raw = self.client.execute("GETDEL", self.prefix + key)
+        if raw is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return self.decode(json.loads(raw))
+
+    def close(self):
+        self.client.close()
+
+class SqliteStore(StateStore):
+    """State persisted to a local SQLite file, with optional TTL and LRU entry cap."""
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.expired = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self.db.commit()
+        self.last_access = 0.0
+
+    def touch(self, now: float) -> float:
+        # Strictly increasing access times keep LRU order stable within one clock tick
+        self.last_access = max(now, self.last_access + 1e-6)
+        return self.last_access
+
+    def __getitem__(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            if row[1] is not None and row[1] <= now:
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.db.commit()
+                self.expired += 1
+                raise KeyError(key)
+            self.db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (self.touch(now), key))
+            self.db.commit()
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl if ttl is not None else None, self.touch(now))
+            )
+            if self.max_entries is not None:
+                excess = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    self.db.execute(
+                        "DELETE FROM entries WHERE key IN "
+                        "(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)", (excess,)
+                    )
+                    self.evicted += excess
+            self.db.commit()
+
+    def __delitem__(self, key):
+        with self.lock:
+            deleted = self.db.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount
+            self.db.commit()
+        if not deleted:
+            raise KeyError(key)
+
+    def __iter__(self):
+        with self.lock:
+            keys = [row[0] for row in self.db.execute("SELECT key FROM entries")]
+        return iter(keys)
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def sweep(self) -> int:
+        with self.lock:
+            removed = self.db.execute(
+                "DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            ).rowcount
+            self.db.commit()
+        self.expired += removed
+        return removed
+
+    def stats(self) -> dict:
+        return {"entries": len(self), "expired": self.expired, "evicted": self.evicted}
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+state_client = RespClient.from_url(
+    os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+    max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', '20'))
+) if STATE_BACKEND == 'redis' else None
+
+STATE_MAX_ENTRIES = int(os.getenv('STATE_MAX_ENTRIES', '100000'))
+STATE_MAX_BYTES = int(os.getenv('STATE_MAX_BYTES')) if os.getenv('STATE_MAX_BYTES') else None
+STATE_SWEEP_INTERVAL_SECONDS = float(os.getenv('STATE_SWEEP_INTERVAL_SECONDS', '60'))
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', '1800'))
+RESPONSE_TTL_SECONDS = float(os.getenv('RESPONSE_TTL_SECONDS', '600'))
+
+def create_store(namespace: str, encode=None, decode=None, ttl: Optional[float] = None) -> StateStore:
+    """Create a state map on the configured backend (STATE_BACKEND=memory|redis)."""
+    if STATE_BACKEND == 'redis':
+        return RedisStore(state_client, namespace, encode, decode, ttl=ttl)
+    return MemoryStore(ttl=ttl, max_entries=STATE_MAX_ENTRIES, max_bytes=STATE_MAX_BYTES)
+
+async def store_call(store, func, *args):
+    """Run func(*args), which uses store, off the event loop if the store does network I/O."""
+    if getattr(store, 'shared', False):
+        return await run_in_threadpool(func, *args)
+    return func(*args)
 
 # Add these new classes for login
 class LoginRequest(BaseModel):
@@ -71,14 +1477,23 @@ class LoginRequest(BaseModel):
 
 class User(BaseModel):
     username: str
+    # ServiceNow routing, from the user's record in the users file
+    servicenow_instance: Optional[str] = None
+    servicenow_instances: List[str] = []  # instances a session may pick explicitly
+    servicenow_user_id: Optional[str] = None
 
 # Add session management
-sessions = {}
+sessions = create_store(
+    "sessions",
+    encode=lambda user: user.model_dump(),
+    decode=lambda data: User(**data),
+    ttl=SESSION_TTL_SECONDS
+)
 
 def get_current_user(request: Request) -> Optional[User]:
     session_id = request.cookies.get("session_id")
-    if session_id and session_id in sessions:
-        return sessions[session_id]
+    if session_id:
+        return sessions.get(session_id)
     return None
 
 # Update the root route to check for authentication
@@ -86,29 +1501,110 @@ def get_current_user(request: Request) -> Optional[User]:
 async def read_root(request: Request, user: Optional[User] = Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login")
-    return FileResponse("static/index.html")
+    return await run_in_threadpool(static_assets.index_response, request)
 
 # Add login page route
 @app.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request, user: Optional[User] = Depends(get_current_user)):
+async def login_page(
+    request: Request,
+    user: Optional[User] = Depends(get_current_user),
+    templates=Depends(get_templates)
+):
     if user:
         return RedirectResponse(url="/")
     return templates.TemplateResponse("login.html", {"request": request})
 
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '200000'))
+
+def hash_password(password: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    """Return a users.json "password_hash" value for a password."""
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+def verify_password(password: str, record: Optional[dict]) -> bool:
+    """Check a password against a users.json record (hashed or legacy plaintext)."""
+    if record and record.get("password_hash"):
+        try:
+            _, iterations, salt, expected = record["password_hash"].split("$")
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), int(iterations))
+            return hmac.compare_digest(digest.hex(), expected)
+        except (ValueError, TypeError, AttributeError) as e:
+            # A bad record should fail its login, not the request
+            logger.error("Malformed password_hash in users file: %s", e)
+            return False
+    if record and "password" in record:
+        logger.warning("users file has a plaintext \"password\"; plaintext passwords are deprecated, "
+                       "replace it with a \"password_hash\" from hash_password()")
+        return hmac.compare_digest(str(record["password"]).encode('utf-8'), password.encode('utf-8'))
+    # Unknown user: spend the same hashing time so response timing does not reveal valid usernames
+    hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), b"\0" * 16, PASSWORD_HASH_ITERATIONS)
+    return False
+
+class CredentialStore:
+    """Users loaded from a JSON file, reloaded only when the file changes.
+
+    The file is checked for changes at most once every `check_interval` seconds.
+    """
+
+    def __init__(self, path: str, hash_workers: int = 4, check_interval: float = 0):
+        self.path = path
+        self.users = {}
+        self.mtime = None
+        self.check_interval = check_interval
+        self.checked_at = None
+        self.lock = threading.Lock()
+        # Dedicated pool so a login storm cannot starve the threadpool used by GPT calls
+        self.executor = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="password-hash")
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+        mtime = os.stat(self.path).st_mtime_ns
+        self.checked_at = now
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            if mtime != self.mtime:
+                with open(self.path, "r") as f:
+                    self.users = json.load(f)
+                self.mtime = mtime
+                logger.info("Loaded %d users from %s", len(self.users), self.path)
+
+    def get(self, username: str) -> Optional[dict]:
+        self.reload_if_changed()
+        return self.users.get(username)
+
+    async def verify(self, record: Optional[dict], password: str) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, verify_password, password, record)
+
+credential_store = CredentialStore(
+    os.getenv('USERS_FILE', 'users.json'),
+    hash_workers=int(os.getenv('PASSWORD_HASH_WORKERS', '4')),
+    check_interval=float(os.getenv('USERS_RELOAD_SECONDS', '5'))
+)
+
 # Update the login endpoint
 @app.post("/login")
 async def login(login_request: LoginRequest):
     try:
-        with open("users.json", "r") as f:
-            users = json.load(f)
-    except Exception as e:
+        # Checking the users file touches the disk, so keep it off the event loop
+        record = await run_in_threadpool(credential_store.get, login_request.username)
+    except Exception:
         raise HTTPException(status_code=500, detail="Error reading users database")
 
-    if (login_request.username in users and 
-        users[login_request.username]["password"] == login_request.password):
+    if await credential_store.verify(record, login_request.password):
         
         session_id = str(uuid.uuid4())
-        sessions[session_id] = User(username=login_request.username)
+        user = User(
+            username=login_request.username,
+            servicenow_instance=record.get('servicenow_instance'),
+            servicenow_instances=record.get('servicenow_instances', []),
+            servicenow_user_id=record.get('servicenow_user_id')
+        )
+        await store_call(sessions, sessions.__setitem__, session_id, user)
         
         response = JSONResponse(
             content={"message": "Login successful"}
@@ -119,7 +1615,7 @@ async def login(login_request: LoginRequest):
             httponly=True,
             secure=False,  # Set to True in production
             samesite='lax',
-            max_age=1800  # 30 minutes
+            max_age=SESSION_TTL_SECONDS  # 30 minutes by default
         )
         return response
     
@@ -135,184 +1631,414 @@ class ChatMessage(BaseModel):
     message: str
     session_id: str
     use_servicenow: bool = False
+    bypass_cache: bool = False
+    servicenow_instance: Optional[str] = None
+
+class InstanceBusyError(Exception):
+    """Raised when a ServiceNow instance has no free request slot within its queue timeout."""
+
+    def __init__(self, name: str, retry_after: float = 1):
+        super().__init__(f"ServiceNow instance {name} is busy")
+        self.name = name
+        self.retry_after = retry_after
 
 class ServiceNowAPI:
-    def __init__(self, instance_url, username, password, token):
+    # Statuses where ServiceNow refused the request before handling it, so resending is safe
+    RETRYABLE_STATUSES = (429, 503)
+
+    def __init__(self, instance_url, username, password, token,
+                 timeout=30.0, connect_timeout=5.0,
+                 max_connections=100, max_keepalive_connections=20, base_url=None, backend=None,
+                 name="default", user_id=None, max_concurrency=None, queue_timeout=5.0):
+        self.name = name
         self.instance_url = instance_url
+        # Full base URL override, e.g. for a proxy or a local stand-in
+        self.base_url = base_url or f"https://{instance_url}"
         self.username = username
         self.password = password
         self.token = token
+        # Sent as userId when the caller has no ServiceNow identity of its own
+        self.user_id = user_id or "beth.anglin"
+        # Keyed HMAC prototype, copied per message so the key is only processed once
+        self.signer = hmac.new(token.encode('utf-8'), digestmod=hashlib.sha1) if token else None
         self.auth = (username, password)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        # Pooled keep-alive clients, created on first use and shared by all requests
+        self._client = None
+        self._async_client = None
+        self.backend = backend or create_backend(
+            "servicenow" if name == "default" else f"servicenow_{name}", "SERVICENOW",
+            self.is_failure, self.is_retryable
+        )
+        # Caps in-flight async sends so one busy instance cannot take every worker
+        self.slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.queue_timeout = queue_timeout
+
+    async def warm_up(self):
+        """Open a pooled connection (DNS, TCP and TLS) ahead of the first message."""
+        await self.get_async_client().head(self.base_url)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.slots is None:
+            yield
+            return
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise InstanceBusyError(self.name)
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    @property
+    def integration_url(self):
+        return f"{self.base_url}/api/sn_va_as_service/bot/integration"
+
+    def get_client(self) -> httpx.Client:
+        """Return the shared synchronous HTTP client."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.Client(auth=self.auth, timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        """Return the shared asynchronous HTTP client."""
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(auth=self.auth, timeout=self.timeout, limits=self.limits)
+        return self._async_client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        self.close()
+
+    def sign(self, body: bytes) -> str:
+        """HMAC-SHA1 of the exact compact JSON bytes being sent."""
+        if self.signer is None:
+            servicenow_logger.error("Error generating signature: no SERVICENOW_TOKEN configured")
+            raise ValueError("Failed to generate signature.")
+        signer = self.signer.copy()
+        signer.update(body)
+        return signer.hexdigest()
 
     def generate_signature(self, payload):
+        """Sign an arbitrary JSON payload in its compact form."""
         try:
             parsed_payload = json.loads(payload)
             message = json.dumps(parsed_payload, separators=(',', ':'))
-            hash_value = hmac.new(
-                self.token.encode('utf-8'),
-                message.encode('utf-8'),
-                hashlib.sha1
-            ).hexdigest()
-            return hash_value
         except Exception as e:
-            logger.error(f"Error generating signature: {str(e)}")
+            servicenow_logger.error("Error generating signature: %s", e)
             raise ValueError("Failed to generate signature.")
+        return self.sign(message.encode('utf-8'))
+
+    def build_request(self, message, session_id, user_id=None):
+        """Build the request ID, signed headers and payload for a VA message."""
+        request_id = str(uuid.uuid4())
+        client_message_id = f"MSG-{uuid.uuid4().hex[:6]}"
+
+        # Serialised once in the compact form the signature covers, and sent as those bytes
+        payload = json.dumps({
+            "requestId": request_id,
+            "clientSessionId": session_id[:6] if session_id else "",
+            "nowSessionId": "",
+            "message": {
+                "text": message,
+                "typed": "true",
+                "clientMessageId": client_message_id
+            },
+            "userId": user_id or self.user_id
+        }, separators=(',', ':')).encode('utf-8')
+
+        signature = self.sign(payload)
+        headers = {
+            'Content-Type': 'application/json',
+            'x-b2b-signature': signature
+        }
+        return request_id, headers, payload
+
+    @classmethod
+    def is_failure(cls, e):
+        if isinstance(e, httpx.HTTPStatusError):
+            return e.response.status_code >= 500 or e.response.status_code == 429
+        return isinstance(e, httpx.TransportError)
+
+    @classmethod
+    def is_retryable(cls, e):
+        # The VA message is not idempotent, so only retry when it cannot have been processed
+        if isinstance(e, httpx.HTTPStatusError):
+            return e.response.status_code in cls.RETRYABLE_STATUSES
+        return isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+    def check_response(self, response, started):
+        """Record a VA attempt and raise for error statuses so the backend policy sees them."""
+        SERVICENOW_LATENCY.observe(time.perf_counter() - started, instance=self.name)
+        SERVICENOW_RESPONSES.inc(status=response.status_code, instance=self.name)
+        response.raise_for_status()
+        return response
+
+    def post(self, headers, payload):
+        started = time.perf_counter()
+        try:
+            response = self.get_client().post(self.integration_url, headers=headers, content=payload)
+        except httpx.RequestError:
+            SERVICENOW_LATENCY.observe(time.perf_counter() - started, instance=self.name)
+            raise
+        return self.check_response(response, started)
+
+    async def post_async(self, headers, payload):
+        started = time.perf_counter()
+        try:
+            response = await self.get_async_client().post(self.integration_url, headers=headers, content=payload)
+        except httpx.RequestError:
+            SERVICENOW_LATENCY.observe(time.perf_counter() - started, instance=self.name)
+            raise
+        return self.check_response(response, started)
+
+    def handle_response(self, response, request_id, client_session_id=""):
+        """Store any immediate messages from a VA response and return the result."""
+        servicenow_logger.info("ServiceNow response status %s for request %s", response.status_code, request_id)
+
+        # Parse the response
+        try:
+            response_data = response.json()
+            servicenow_logger.debug("ServiceNow Response Data: %s", LazyJSON(response_data, indent=2))
+
+            # Check if we have an immediate response
+            if response_data.get('body'):
+                # Convert the response to our format
+                formatted_messages = []
+                for msg in response_data['body']:
+                    if not isinstance(msg, dict):
+                        continue
+
+                    # Handle different message types
+                    if msg.get('uiType') in ['ActionMsg', 'OutputCard', 'Picker']:
+                        # Pass through known message types unchanged
+                        formatted_messages.append(msg)
+                    else:
+                        # Convert unknown message types to OutputCard format
+                        message_text = msg.get('text') or msg.get('message') or str(msg)
+                        formatted_messages.append({
+                            "uiType": "OutputCard",
+                            "group": "DefaultOutputCard",
+                            "templateName": "Card",
+                            "data": json.dumps({
+                                "title": "ServiceNow Response",
+                                "fields": [
+                                    {
+                                        "fieldLabel": "Top Result:",
+                                        "fieldValue": message_text
+                                    }
+                                ]
+                            })
+                        })
 
-    def send_message_to_va(self, message, session_id):
-        try:
-            request_id = str(uuid.uuid4())
-            client_message_id = f"MSG-{uuid.uuid4().hex[:6]}"
-
-            payload = json.dumps({
-                "requestId": request_id,
-                "clientSessionId": session_id[:6] if session_id else "",
-                "nowSessionId": "",
-                "message": {
-                    "text": message,
-                    "typed": "true",
-                    "clientMessageId": client_message_id
-                },
-                "userId": "beth.anglin"
-            })
-
-            signature = self.generate_signature(payload)
-            headers = {
-                'Content-Type': 'application/json',
-                'x-b2b-signature': signature
-            }
+                # Store the formatted messages
+                if formatted_messages:
+                    servicenow_logger.info("Storing %d immediate messages for request %s",
+                                           len(formatted_messages), request_id)
+                    pending_responses[request_id] = formatted_messages
+                    servicenow_logger.debug("Stored messages: %s", LazyJSON(formatted_messages, indent=2))
+                    response_broker.publish(request_id, formatted_messages, client_session_id)
 
-            logger.info("=== Sending Request to ServiceNow ===")
-            logger.info("Payload: %s", payload)
-            response = requests.post(
-                f"https://{self.instance_url}/api/sn_va_as_service/bot/integration",
-                headers=headers,
-                auth=self.auth,
-                data=payload
-            )
+        except json.JSONDecodeError:
+            servicenow_logger.warning("ServiceNow response was not JSON")
+            servicenow_logger.debug("ServiceNow Raw Response Content: %s", response.text)
 
-            logger.info("ServiceNow Response Status: %s", response.status_code)
-            logger.info("ServiceNow Raw Response Content: %s", response.text)
+        # Return the requestId for async processing
+        return {
+            "status": "success",
+            "requestId": request_id
+        }
 
-            response.raise_for_status()
-            
-            # Parse the response
-            try:
-                response_data = response.json()
-                logger.info("ServiceNow Response Data: %s", json.dumps(response_data, indent=2))
-                
-                # Check if we have an immediate response
-                if response_data.get('body'):
-                    # Convert the response to our format
-                    formatted_messages = []
-                    for msg in response_data['body']:
-                        if not isinstance(msg, dict):
-                            continue
-
-                        # Handle different message types
-                        if msg.get('uiType') in ['ActionMsg', 'OutputCard', 'Picker']:
-                            # Pass through known message types unchanged
-                            formatted_messages.append(msg)
-                        else:
-                            # Convert unknown message types to OutputCard format
-                            message_text = msg.get('text') or msg.get('message') or str(msg)
-                            formatted_messages.append({
-                                "uiType": "OutputCard",
-                                "group": "DefaultOutputCard",
-                                "templateName": "Card",
-                                "data": json.dumps({
-                                    "title": "ServiceNow Response",
-                                    "fields": [
-                                        {
-                                            "fieldLabel": "Top Result:",
-                                            "fieldValue": message_text
-                                        }
-                                    ]
-                                })
-                            })
-                    
-                    # Store the formatted messages
-                    if formatted_messages:
-                        logger.info("Storing %d immediate messages for request %s",
-                                  len(formatted_messages), request_id)
-                        pending_responses[request_id] = formatted_messages
-                        logger.info("Stored messages: %s",
-                                  json.dumps(formatted_messages, indent=2))
-                
-            except json.JSONDecodeError:
-                logger.warning("ServiceNow response was not JSON")
-            
-            # Return the requestId for async processing
+    def handle_error(self, e):
+        if isinstance(e, (CircuitOpenError, InstanceBusyError)):
+            servicenow_logger.warning("Not sending message to ServiceNow VA: %s", e)
             return {
-                "status": "success",
-                "requestId": request_id
+                "status": "error",
+                "error": str(e),
+                "retry_after": e.retry_after
             }
-
-        except requests.exceptions.RequestException as e:
-            logger.error("Error sending message to ServiceNow VA: %s", str(e))
-            if hasattr(e.response, 'text'):
-                logger.error("Error response content: %s", e.response.text)
+        if isinstance(e, httpx.RequestError):
+            # No HTTP response at all (connect failure, timeout, ...)
+            SERVICENOW_RESPONSES.inc(status="error", instance=self.name)
+        if isinstance(e, httpx.HTTPError):
+            servicenow_logger.error("Error sending message to ServiceNow VA: %s", e)
+            error_response = getattr(e, 'response', None)
+            if hasattr(error_response, 'text'):
+                servicenow_logger.error("Error response content: %s", error_response.text)
             return {
                 "status": "error",
                 "error": f"Error communicating with ServiceNow: {str(e)}"
             }
+        servicenow_logger.error("Unexpected error: %s", e, exc_info=True)
+        return {
+            "status": "error",
+            "error": f"Unexpected error: {str(e)}"
+        }
+
+    def send_message_to_va(self, message, session_id, user_id=None):
+        """Blocking variant of send_message_to_va_async for synchronous callers (not slot limited)."""
+        try:
+            request_id, headers, payload = self.build_request(message, session_id, user_id)
+
+            servicenow_logger.info("Sending message to ServiceNow VA for request %s", request_id)
+            servicenow_logger.debug("Payload: %s", payload)
+            response = self.backend.call(self.post, headers, payload)
+            return self.handle_response(response, request_id, session_id[:6] if session_id else "")
         except Exception as e:
-            logger.error("Unexpected error: %s", str(e))
-            return {
-                "status": "error",
-                "error": f"Unexpected error: {str(e)}"
-            }
+            return self.handle_error(e)
 
-servicenow_api = ServiceNowAPI(
-    instance_url=os.getenv('SERVICENOW_INSTANCE'),
-    username=os.getenv('SERVICENOW_USERNAME'),
-    password=os.getenv('SERVICENOW_PASSWORD'),
-    token=os.getenv('SERVICENOW_TOKEN')
-)
+    async def send_message_to_va_async(self, message, session_id, user_id=None):
+        """Send a message to the VA without blocking the event loop."""
+        try:
+            request_id, headers, payload = self.build_request(message, session_id, user_id)
+
+            servicenow_logger.info("Sending message to ServiceNow VA %s for request %s", self.name, request_id)
+            servicenow_logger.debug("Payload: %s", payload)
+            async with self.slot():
+                response = await self.backend.acall(self.post_async, headers, payload)
+            return await store_call(pending_responses, self.handle_response,
+                                    response, request_id, session_id[:6] if session_id else "")
+        except Exception as e:
+            return self.handle_error(e)
+
+class ServiceNowRegistry:
+    """ServiceNow instances by name, each with its own credentials, pool and limits."""
+
+    def __init__(self, instances: dict, default: str):
+        if default not in instances:
+            raise ValueError(f"Default ServiceNow instance {default!r} is not configured")
+        self.instances = instances
+        self.default = default
+
+    @classmethod
+    def from_env(cls) -> 'ServiceNowRegistry':
+        """The SERVICENOW_* instance as "default", plus any from SERVICENOW_INSTANCES_FILE."""
+        instances = {"default": ServiceNowAPI(
+            instance_url=os.getenv('SERVICENOW_INSTANCE'),
+            username=os.getenv('SERVICENOW_USERNAME'),
+            password=os.getenv('SERVICENOW_PASSWORD'),
+            token=os.getenv('SERVICENOW_TOKEN'),
+            timeout=float(os.getenv('SERVICENOW_TIMEOUT', '30')),
+            connect_timeout=float(os.getenv('SERVICENOW_CONNECT_TIMEOUT', '5')),
+            max_connections=int(os.getenv('SERVICENOW_MAX_CONNECTIONS', '100')),
+            max_keepalive_connections=int(os.getenv('SERVICENOW_MAX_KEEPALIVE_CONNECTIONS', '20')),
+            base_url=os.getenv('SERVICENOW_URL'),
+            user_id=os.getenv('SERVICENOW_USER_ID'),
+            max_concurrency=int(os.getenv('SERVICENOW_MAX_CONCURRENCY', '0')) or None
+        )}
+        path = os.getenv('SERVICENOW_INSTANCES_FILE')
+        if path:
+            with open(path) as f:
+                for name, config in json.load(f).items():
+                    instances[name] = cls.create_instance(name, config)
+            logger.info("Loaded ServiceNow instances: %s", ", ".join(sorted(instances)))
+        return cls(instances, os.getenv('SERVICENOW_DEFAULT_INSTANCE', 'default'))
+
+    @staticmethod
+    def create_instance(name: str, config: dict) -> ServiceNowAPI:
+        def secret(key):
+            # Secrets can be given inline or as the name of an environment variable
+            return config.get(key) or (os.getenv(config[f"{key}_env"]) if f"{key}_env" in config else None)
+
+        return ServiceNowAPI(
+            instance_url=config.get('instance'),
+            username=config.get('username'),
+            password=secret('password'),
+            token=secret('token'),
+            timeout=float(config.get('timeout', 30)),
+            connect_timeout=float(config.get('connect_timeout', 5)),
+            max_connections=int(config.get('max_connections', 100)),
+            max_keepalive_connections=int(config.get('max_keepalive_connections', 20)),
+            base_url=config.get('url'),
+            name=name,
+            user_id=config.get('user_id'),
+            max_concurrency=config.get('max_concurrency'),
+            queue_timeout=float(config.get('queue_timeout', 5))
+        )
+
+    def get(self, name: Optional[str] = None) -> ServiceNowAPI:
+        return self.instances[name or self.default]
+
+    def for_user(self, user: User, requested: Optional[str] = None) -> ServiceNowAPI:
+        """Pick the instance for a request: an allowed per-session choice, else the user's, else the default."""
+        if requested:
+            allowed = set(user.servicenow_instances)
+            allowed.add(user.servicenow_instance or self.default)
+            if requested not in self.instances or requested not in allowed:
+                raise HTTPException(status_code=403, detail=f"ServiceNow instance {requested!r} is not available")
+            return self.instances[requested]
+        name = user.servicenow_instance
+        if name and name not in self.instances:
+            servicenow_logger.warning("User %s is assigned unknown instance %s, using default", user.username, name)
+            name = None
+        return self.get(name)
+
+    async def aclose(self):
+        for api in self.instances.values():
+            await api.aclose()
+
+servicenow_instances = ServiceNowRegistry.from_env()
+# The default instance, used where there is no user to route by (batch runs)
+servicenow_api = servicenow_instances.get()
 
 class ChatbotAPI:
     def __init__(self):
-        self.message_store = {}
-        self.logger = getLogger(__name__)
+        self.message_store = create_store("message_store", ttl=RESPONSE_TTL_SECONDS)
+        self.logger = callback_logger
 
     def store_messages(self, request_id: str, messages: List[dict]):
         """Store formatted messages for a request."""
         # For action messages, we want to accumulate them
         if len(messages) == 1 and messages[0].get('uiType') == 'ActionMsg':
-            if request_id not in self.message_store:
-                self.message_store[request_id] = []
-            self.message_store[request_id].append(messages[0])
+            # Write back the whole list so shared backends see the update
+            stored = self.message_store.get(request_id, [])
+            stored.append(messages[0])
         else:
             # For content messages (OutputCard, Picker), replace existing messages
-            self.message_store[request_id] = messages
-        
-        self.logger.info(f"Updated messages for request {request_id}: {json.dumps(self.message_store[request_id], indent=2)}")
-        return self.message_store[request_id]
+            stored = messages
+        self.message_store[request_id] = stored
+
+        self.logger.debug("Updated messages for request %s: %s", request_id, LazyJSON(stored, indent=2))
+        return stored
 
     def get_messages(self, request_id: str) -> List[dict]:
         """Get stored messages for a request."""
         return self.message_store.get(request_id, [])
 
-    def process_servicenow_callback(self, callback_data) -> List[dict]:
-        """Process a callback from ServiceNow and return formatted messages."""
-        request_id = callback_data.requestId  # Access Pydantic model field directly
+    def process_servicenow_callback(self, request_id: str, body) -> List[dict]:
+        """Process the decoded body of a ServiceNow callback and return formatted messages."""
+        if isinstance(body, dict):
+            body = [body]
         messages = []
+        has_picker = False
 
-        for msg in callback_data.body:  # Access body field directly
-            self.logger.info(f"Processing message: {json.dumps(msg, indent=2)}")
-            
-            # Convert to dict to ensure consistent access
-            msg_dict = msg if isinstance(msg, dict) else msg.dict()
-            
-            if msg_dict['uiType'] == 'ActionMsg':
-                messages.append(msg_dict)
-            elif msg_dict['uiType'] == 'OutputCard':
+        # Single pass over the messages, keeping the decoded dicts as-is
+        for msg in body or ():
+            ui_type = msg.get('uiType') if isinstance(msg, dict) else None
+            if ui_type == 'ActionMsg':
+                messages.append(msg)
+            elif ui_type == 'OutputCard':
                 # Clear previous messages when we get content
-                messages = [msg_dict]
-            elif msg_dict['uiType'] == 'Picker':
-                if not any(m['uiType'] == 'Picker' for m in messages):
-                    messages.append(msg_dict)
+                messages = [msg]
+                has_picker = False
+            elif ui_type == 'Picker' and not has_picker:
+                messages.append(msg)
+                has_picker = True
 
-        self.logger.info(f"Added {len(messages)} formatted messages")
+        self.logger.info("Added %d formatted messages", len(messages))
         return self.store_messages(request_id, messages)
 
 chatbot_api = ChatbotAPI()
@@ -323,71 +2049,400 @@ class ServiceNowCallback(BaseModel):
     clientSessionId: str | None = None
     message: dict | None = None
 
-    class Config:
-        extra = "allow"
+    model_config = ConfigDict(extra="allow")
+
+@app.post("/servicenow/callback", openapi_extra={"requestBody": {
+    "content": {"application/json": {"schema": ServiceNowCallback.model_json_schema()}},
+    "required": True
+}})
+async def servicenow_callback(request: Request):
+    """Handle callbacks from ServiceNow.
 
-@app.post("/servicenow/callback")
-async def servicenow_callback(callback: ServiceNowCallback):
-    """Handle callbacks from ServiceNow."""
+    The raw body is decoded once and handed straight to the message processor;
+    ServiceNowCallback only documents the expected shape.
+    """
     try:
-        logger.info("=== ServiceNow Callback Received ===")
-        logger.info(f"Raw callback body: {callback.model_dump_json()}")
-        logger.info(f"Parsed callback body: {json.dumps(json.loads(callback.model_dump_json()), indent=2)}")
-        logger.info(f"Callback object: {callback}")
-        
-        logger.info(f"Processing callback for requestId: {callback.requestId}")
-        formatted_messages = chatbot_api.process_servicenow_callback(callback)
-        logger.info(f"Formatted messages: {json.dumps(formatted_messages, indent=2)}")
-        
+        callback = json_loads(await request.body())
+        if not isinstance(callback, dict):
+            raise ValueError("Callback body must be a JSON object")
+        request_id = callback.get('requestId')
+        callback_logger.info("ServiceNow callback received for request %s", request_id)
+        callback_logger.debug("Callback body: %s", LazyJSON(callback, indent=2))
+
+        formatted_messages = await store_call(chatbot_api.message_store, chatbot_api.process_servicenow_callback,
+                                              request_id, callback.get('body'))
+        callback_logger.debug("Formatted messages: %s", LazyJSON(formatted_messages, indent=2))
+
         # Store the formatted messages
         if formatted_messages:
-            logger.info(f"Storing {len(formatted_messages)} formatted messages for request {callback.requestId}")
-            pending_responses[callback.requestId] = formatted_messages
-            logger.info(f"Stored messages: {json.dumps(formatted_messages, indent=2)}")
-        
+            callback_logger.info("Storing %d formatted messages for request %s",
+                                 len(formatted_messages), request_id)
+            await store_call(pending_responses, pending_responses.__setitem__, request_id, formatted_messages)
+            if request_id not in callback_stored_at:
+                callback_stored_at[request_id] = time.monotonic()
+            response_broker.publish(request_id, formatted_messages, callback.get('clientSessionId'))
+
         return {"status": "success"}
     except Exception as e:
-        logger.error(f"Error processing ServiceNow callback: {str(e)}")
-        logger.error(traceback.format_exc())
+        callback_logger.error("Error processing ServiceNow callback: %s", e, exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
 
 # Define a no-op decorator for when LangSmith is not available
 def no_op_traceable(func):
     return func
 
+def lazy_traceable(func):
+    """Trace with LangSmith, importing it on the first call rather than at import."""
+    traced = None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        nonlocal traced
+        if traced is None:
+            langsmith = load_langsmith()
+            traced = langsmith.traceable(func) if langsmith else func
+        return traced(*args, **kwargs)
+    return wrapper
+
 # Use the appropriate decorator based on LangSmith availability
-traceable_decorator = traceable if use_langsmith else no_op_traceable
+traceable_decorator = lazy_traceable if use_langsmith else no_op_traceable
+
+GPT_MODEL = "gpt-4"
+GPT_SYSTEM_PROMPT = "You are a helpful assistant."
+
+def build_gpt_messages(
+    message: str,
+    history: Optional[List[dict]] = None,
+    system_prompt: Optional[str] = None
+) -> List[dict]:
+    return [
+        {"role": "system", "content": system_prompt or GPT_SYSTEM_PROMPT},
+        *(history or []),
+        {"role": "user", "content": message}
+    ]
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token plus per-message overhead)."""
+    return len(text) // 4 + 4
+
+class ConversationMemory:
+    """Per-session chat history kept as a bounded ring of (user, assistant) turns.
+
+    The context sent to the model is assembled newest turn first until the
+    token budget is spent; older turns are folded into a short system note
+    listing what the user asked earlier.
+    """
+
+    SUMMARY_QUESTION_CHARS = 80
+
+    def __init__(self, store: StateStore, max_turns: int, token_budget: int, summary_budget: int):
+        self.store = store
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+
+    def turns(self, key: str) -> List[list]:
+        return self.store.get(key) or []
+
+    def append(self, key: str, message: str, response: str):
+        turns = self.turns(key)
+        turns.append([message, response])
+        self.store[key] = turns[-self.max_turns:]
+
+    def clear(self, key: str):
+        self.store.pop(key, None)
+
+    def context(self, key: str, message: str) -> List[dict]:
+        """Prior turns (and a summary of dropped ones) that fit beside `message`."""
+        turns = self.turns(key)
+        budget = self.token_budget - estimate_tokens(GPT_SYSTEM_PROMPT) - estimate_tokens(message)
+        kept = []
+        for index in range(len(turns) - 1, -1, -1):
+            question, answer = turns[index]
+            cost = estimate_tokens(question) + estimate_tokens(answer)
+            if cost > budget:
+                break
+            budget -= cost
+            kept.append([
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer}
+            ])
+        else:
+            index = -1
+
+        history = [entry for pair in reversed(kept) for entry in pair]
+        summary = self.summarise(turns[:index + 1], min(budget, self.summary_budget))
+        return ([{"role": "system", "content": summary}] if summary else []) + history
+
+    def summarise(self, dropped: List[list], budget: int) -> str:
+        lines = []
+        for question, _ in reversed(dropped):
+            line = "- " + question[:self.SUMMARY_QUESTION_CHARS]
+            if estimate_tokens("\n".join(lines + [line])) > budget:
+                break
+            lines.append(line)
+        if not lines:
+            return ""
+        return "Earlier in this conversation the user asked:\n" + "\n".join(reversed(lines))
+
+conversation_memory = ConversationMemory(
+    create_store("conversations", ttl=SESSION_TTL_SECONDS),
+    max_turns=int(os.getenv('CONVERSATION_MAX_TURNS', '20')),
+    token_budget=int(os.getenv('GPT_CONTEXT_TOKENS', '3000')),
+    summary_budget=int(os.getenv('GPT_SUMMARY_TOKENS', '200'))
+)
+
+def conversation_key(user: User, session_id: str) -> str:
+    # Scoped by user so one account can't read another's history by guessing a session id
+    return f"{user.username}:{session_id}"
+
+def is_openai_failure(e):
+    import openai  # already loaded once a client exists
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code >= 500 or e.status_code == 429
+    return isinstance(e, openai.APIConnectionError)  # includes timeouts
+
+# Completions have no side effects, so every transient failure is retried
+openai_backend = create_backend("openai", "OPENAI", is_openai_failure)
+
+def gpt_error(e: Exception) -> HTTPException:
+    """Map a failed completion to 503 when the backend is degraded, 500 otherwise."""
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail=f"GPT API error: {str(e)}",
+                             headers={"Retry-After": str(math.ceil(e.retry_after))})
+    if is_openai_failure(e):
+        return HTTPException(status_code=503, detail=f"GPT API error: {str(e)}",
+                             headers={"Retry-After": "1"})
+    return HTTPException(status_code=500, detail=f"GPT API error: {str(e)}")
 
 @traceable_decorator
-def get_gpt_response(message: str) -> str:
+def get_gpt_response(
+    message: str,
+    history: Optional[List[dict]] = None,
+    system_prompt: Optional[str] = None,
+    gpt_client=None
+) -> str:
+    started = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": message}
-            ]
+        response = openai_backend.call(
+            (gpt_client or get_gpt_client()).chat.completions.create,
+            model=GPT_MODEL,
+            messages=build_gpt_messages(message, history, system_prompt)
         )
+        record_gpt_usage(getattr(response, 'usage', None))
         return response.choices[0].message.content
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"GPT API error: {str(e)}")
+        raise gpt_error(e)
+    finally:
+        GPT_LATENCY.observe(time.perf_counter() - started, mode="complete")
+
+@traceable_decorator
+def stream_gpt_response(message: str, history: Optional[List[dict]] = None, gpt_client=None) -> Iterator[str]:
+    """Yield content deltas from a streamed completion as they arrive."""
+    started = time.perf_counter()
+    try:
+        # Only opening the stream is retried; a failure mid-stream is reported to the caller
+        stream = openai_backend.call(
+            (gpt_client or get_gpt_client()).chat.completions.create,
+            model=GPT_MODEL,
+            messages=build_gpt_messages(message, history),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            # With include_usage the final chunk carries token counts and no choices
+            record_gpt_usage(getattr(chunk, 'usage', None))
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        raise gpt_error(e)
+    finally:
+        GPT_LATENCY.observe(time.perf_counter() - started, mode="stream")
+
+def record_gpt_usage(usage):
+    prompt_tokens = getattr(usage, 'prompt_tokens', None)
+    completion_tokens = getattr(usage, 'completion_tokens', None)
+    if isinstance(prompt_tokens, int):
+        GPT_TOKENS.inc(prompt_tokens, type="prompt")
+    if isinstance(completion_tokens, int):
+        GPT_TOKENS.inc(completion_tokens, type="completion")
+
+class CompletionLimiter:
+    """Bound concurrent GPT calls, handing free slots to waiting users round-robin."""
+
+    def __init__(self, max_concurrency: int, max_queue_depth: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.waiters = OrderedDict()  # user key -> deque of futures
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "waiting_users": len(self.waiters),
+            "rejected": self.rejected,
+            "max_concurrency": self.max_concurrency,
+            "max_queue_depth": self.max_queue_depth
+        }
+
+    async def acquire(self, key: str):
+        if self.active < self.max_concurrency and not self.queued:
+            self.active += 1
+            return
+
+        if self.queued >= self.max_queue_depth:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many GPT requests in progress, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(key, deque()).append(waiter)
+        self.queued += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just before we were cancelled
+                self.release()
+            else:
+                self._discard(key, waiter)
+            raise
+
+    def release(self):
+        self.active -= 1
+        while self.waiters and self.active < self.max_concurrency:
+            # Serve the user at the head of the rotation, then move them to the back
+            key, waiting = self.waiters.popitem(last=False)
+            waiter = waiting.popleft()
+            self.queued -= 1
+            if waiting:
+                self.waiters[key] = waiting
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    def _discard(self, key: str, waiter):
+        waiting = self.waiters.get(key)
+        if waiting is None or waiter not in waiting:
+            return
+        waiting.remove(waiter)
+        self.queued -= 1
+        if not waiting:
+            del self.waiters[key]
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+gpt_limiter = CompletionLimiter(
+    max_concurrency=int(os.getenv('GPT_MAX_CONCURRENCY', '8')),
+    max_queue_depth=int(os.getenv('GPT_MAX_QUEUE_DEPTH', '100'))
+)
+
+GPT_CACHE_HITS = metrics.register(Counter(
+    "gpt_cache_requests_total", "GPT completion cache lookups.", ("result",)))
+
+class CompletionCache:
+    """Cache of GPT answers keyed on the normalised prompt, model and system prompt."""
+
+    PUNCTUATION = re.compile(r"^[\s\W_]+|[\s\W_]+$")
+    WHITESPACE = re.compile(r"\s+")
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    @classmethod
+    def normalise(cls, message: str) -> str:
+        # Treat prompts that differ only in case, spacing or surrounding punctuation as the same question
+        text = unicodedata.normalize("NFKC", message).casefold()
+        return cls.PUNCTUATION.sub("", cls.WHITESPACE.sub(" ", text))
+
+    def key(self, message: str) -> str:
+        material = json.dumps([GPT_MODEL, GPT_SYSTEM_PROMPT, self.normalise(message)])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, message: str) -> Optional[str]:
+        response = self.store.get(self.key(message))
+        GPT_CACHE_HITS.inc(result="hit" if response is not None else "miss")
+        return response
+
+    def set(self, message: str, response: str):
+        self.store[self.key(message)] = response
+
+def create_completion_cache() -> Optional[CompletionCache]:
+    """Build the completion cache from GPT_CACHE=off|memory|disk."""
+    backend = os.getenv('GPT_CACHE', 'off')
+    ttl = float(os.getenv('GPT_CACHE_TTL_SECONDS', '86400'))
+    max_entries = int(os.getenv('GPT_CACHE_MAX_ENTRIES', '10000'))
+    if backend == 'memory':
+        return CompletionCache(MemoryStore(ttl=ttl, max_entries=max_entries))
+    if backend == 'disk':
+        path = os.getenv('GPT_CACHE_PATH', 'gpt_cache.sqlite3')
+        return CompletionCache(SqliteStore(path, ttl=ttl, max_entries=max_entries))
+    return None
+
+completion_cache = create_completion_cache()
+
+async def get_gpt_response_async(
+    message: str,
+    user_key: str = "",
+    use_cache: bool = True,
+    history: Optional[List[dict]] = None,
+    system_prompt: Optional[str] = None,
+    gpt_client=None
+) -> str:
+    """Run get_gpt_response off the event loop, queued fairly per user.
+
+    Routes pass the client from Depends(get_gpt_client); background callers
+    (relay, batch) leave it to the provider.
+    """
+    # Follow-up answers depend on the conversation so only first turns are cached
+    cache = completion_cache if use_cache and not history and not system_prompt else None
+    if cache is not None:
+        cached = await run_in_threadpool(cache.get, message)
+        if cached is not None:
+            return cached
+
+    # The shared (optionally LangSmith-wrapped) client is thread-safe, so we
+    # reuse it from the threadpool rather than keeping a second async client.
+    async with gpt_limiter.slot(user_key):
+        response = await run_in_threadpool(get_gpt_response, message, history, system_prompt, gpt_client)
+
+    if cache is not None and response:
+        await run_in_threadpool(cache.set, message, response)
+    return response
 
 @app.post("/chat")
 async def chat(
     request: ChatMessage,
-    user: Optional[User] = Depends(get_current_user)
+    user: Optional[User] = Depends(get_current_user),
+    gpt_client=Depends(get_gpt_client)
 ):
     """Handle chat messages from the frontend."""
-    logger.info(f"Received chat request: {request}")
+    logger.info("Received chat request for session %s (use_servicenow=%s)",
+                request.session_id, request.use_servicenow)
+    logger.debug("Chat message: %s", request.message)
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     try:
         if request.use_servicenow:
             # Send to ServiceNow
-            logger.info("Using ServiceNow API")
-            response = servicenow_api.send_message_to_va(request.message, request.session_id)
-            logger.info("ServiceNow API Response: %s", response)
+            instance = servicenow_instances.for_user(user, request.servicenow_instance)
+            response = await instance.send_message_to_va_async(
+                request.message, request.session_id, user.servicenow_user_id or user.username
+            )
+            servicenow_logger.info("ServiceNow API Response: %s", response)
             
             if response.get("status") == "success":
                 return {
@@ -397,99 +2452,581 @@ async def chat(
                     }
                 }
             else:
-                logger.error("ServiceNow API Error: %s", response.get("error"))
+                servicenow_logger.error("ServiceNow API Error: %s", response.get("error"))
+                if "retry_after" in response:
+                    raise HTTPException(
+                        status_code=503,
+                        detail=f"ServiceNow API Error: {response['error']}",
+                        headers={"Retry-After": str(math.ceil(response["retry_after"]))}
+                    )
                 raise HTTPException(
                     status_code=500,
                     detail=f"ServiceNow API Error: {response.get('error', 'Unknown error')}"
                 )
         else:
             # Use GPT
-            logger.info("Using GPT API")
-            response = get_gpt_response(request.message)
-            logger.info("GPT Response: %s", response)
+            key = conversation_key(user, request.session_id)
+            history = await store_call(conversation_memory.store, conversation_memory.context, key, request.message)
+            response = await get_gpt_response_async(
+                request.message, user.username, use_cache=not request.bypass_cache, history=history,
+                gpt_client=gpt_client
+            )
+            gpt_logger.debug("GPT Response: %s", response)
+            await store_call(conversation_memory.store, conversation_memory.append, key, request.message, response)
             return {"response": response}
-            
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Error in chat endpoint: %s", str(e), exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-pending_responses = {}
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatMessage,
+    user: Optional[User] = Depends(get_current_user),
+    gpt_client=Depends(get_gpt_client)
+):
+    """Stream a GPT response as Server-Sent Events.
+
+    Emits a "delta" event per content chunk, then "done" with the full text.
+    Failures after the stream has started are reported as an "error" event.
+    """
+    logger.info("Received streaming chat request for session %s", request.session_id)
+    logger.debug("Chat message: %s", request.message)
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if request.use_servicenow:
+        raise HTTPException(status_code=400, detail="Streaming is only available for GPT responses")
+
+    key = conversation_key(user, request.session_id)
+    history = await store_call(conversation_memory.store, conversation_memory.context, key, request.message)
+    cache = None if request.bypass_cache or history else completion_cache
+
+    async def stream():
+        parts = []
+        try:
+            cached = await run_in_threadpool(cache.get, request.message) if cache is not None else None
+            if cached is not None:
+                # A cached answer is sent as a single delta
+                await store_call(conversation_memory.store, conversation_memory.append, key, request.message, cached)
+                yield format_sse({"delta": cached}, "delta")
+                yield format_sse({"response": cached}, "done")
+                return
+
+            async with gpt_limiter.slot(user.username):
+                async for delta in iterate_in_threadpool(stream_gpt_response(request.message, history, gpt_client)):
+                    parts.append(delta)
+                    yield format_sse({"delta": delta}, "delta")
+            response = "".join(parts)
+            if cache is not None and response:
+                await run_in_threadpool(cache.set, request.message, response)
+            await store_call(conversation_memory.store, conversation_memory.append, key, request.message, response)
+            yield format_sse({"response": response}, "done")
+        except HTTPException as e:
+            gpt_logger.error("Error streaming GPT response: %s", e.detail)
+            yield format_sse({"status": e.status_code, "detail": e.detail}, "error")
+        except Exception as e:
+            gpt_logger.error("Error streaming GPT response: %s", e, exc_info=True)
+            yield format_sse({"status": 500, "detail": str(e)}, "error")
+
+    return event_stream_response(stream())
+
+pending_responses = create_store("pending_responses", ttl=RESPONSE_TTL_SECONDS)
+
+# When each callback was stored in this process, for measuring delivery lag
+callback_stored_at = MemoryStore(ttl=RESPONSE_TTL_SECONDS, max_entries=STATE_MAX_ENTRIES)
+
+def record_delivery(request_id: str, channel: str):
+    """Observe callback-to-first-delivery lag the first time a request's callback is delivered."""
+    stored_at = callback_stored_at.pop(request_id, None)
+    if stored_at is not None:
+        CALLBACK_DELIVERY_LAG.observe(time.monotonic() - stored_at, channel=channel)
+
+# Message types the frontend treats as a complete answer
+CONTENT_UI_TYPES = ('OutputCard', 'Picker')
+
+def has_content(messages: List[dict]) -> bool:
+    return any(isinstance(msg, dict) and msg.get('uiType') in CONTENT_UI_TYPES for msg in messages)
+
+class ResponseBroker:
+    """Push stored ServiceNow responses to subscribers keyed by request or chat session."""
+
+    def __init__(self, max_queued_events: int = 100):
+        self.max_queued_events = max_queued_events
+        self.subscribers = {}  # topic -> {queue: loop}
+
+    def subscribe(self, topic: str) -> asyncio.Queue:
+        subscriber = asyncio.Queue(maxsize=self.max_queued_events)
+        self.subscribers.setdefault(topic, {})[subscriber] = asyncio.get_running_loop()
+        return subscriber
+
+    def unsubscribe(self, topic: str, subscriber: asyncio.Queue):
+        queues = self.subscribers.get(topic)
+        if queues is None:
+            return
+        queues.pop(subscriber, None)
+        if not queues:
+            del self.subscribers[topic]
+
+    def publish(self, request_id: str, messages: List[dict], client_session_id: Optional[str] = None):
+        event = {"requestId": request_id, "servicenow_response": {"body": messages}}
+        topics = [f"request:{request_id}"]
+        if client_session_id:
+            topics.append(f"session:{client_session_id}")
+        for topic in topics:
+            for subscriber, loop in list(self.subscribers.get(topic, {}).items()):
+                # Callers may run in the threadpool, so always hop onto the subscriber's loop
+                loop.call_soon_threadsafe(self._deliver, subscriber, event)
+
+    @staticmethod
+    def _deliver(subscriber: asyncio.Queue, event: dict):
+        if subscriber.full():
+            # Drop the oldest update rather than blocking the publisher
+            subscriber.get_nowait()
+        subscriber.put_nowait(event)
+
+response_broker = ResponseBroker()
+
+SSE_KEEPALIVE_SECONDS = 15
+# How often waiters re-read a shared store for callbacks handled by other workers
+STORE_RECHECK_SECONDS = 1
+SSE_MAX_TIMEOUT_SECONDS = 300
+
+def format_sse(event: dict, name: str = "servicenow_response") -> str:
+    return f"event: {name}\ndata: {json.dumps(event)}\n\n"
+
+def take_responses(request_ids: List[str], acknowledge: List[str]) -> dict:
+    """Read stored responses for request_ids and remove those in acknowledge.
+
+    An ID that is both read and acknowledged is taken with a single atomic pop,
+    so a callback stored between the read and the removal cannot be lost. Only
+    IDs with stored messages appear in the result.
+    """
+    acknowledged = set(acknowledge)
+    responses = {}
+    for request_id in request_ids:
+        if request_id in acknowledged:
+            response_data = pending_responses.pop(request_id, None)
+        else:
+            response_data = pending_responses.get(request_id)
+        if response_data:
+            poll_logger.debug("Returning %d messages for %s: %s",
+                              len(response_data), request_id, LazyJSON(response_data, indent=2))
+            responses[request_id] = response_data
+            record_delivery(request_id, "poll")
+    for request_id in acknowledged.difference(request_ids):
+        pending_responses.pop(request_id, None)
+    if acknowledged:
+        poll_logger.info("Acknowledged and removed responses for %d requests", len(acknowledged))
+    return responses
+
+async def single_response(request_id: str, acknowledge: bool) -> dict:
+    """Response shape of the single-ID poll routes, served by take_responses."""
+    try:
+        responses = await store_call(pending_responses, take_responses,
+                                     [request_id], [request_id] if acknowledge else [])
+    except Exception as e:
+        poll_logger.error("Error getting responses: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"servicenow_response": {"body": responses.get(request_id, [])}}
 
 @app.get("/servicenow/responses/{request_id}")
 async def get_servicenow_responses(request_id: str, acknowledge: bool = False, user: Optional[User] = Depends(get_current_user)):
-    """Get responses for a specific request ID."""
-    logger.info("=== Get ServiceNow Responses ===")
-    logger.info("Request ID: %s", request_id)
-    logger.info("Acknowledge: %s", acknowledge)
-    logger.info("User: %s", user)
+    """Get responses for a specific request ID.
+
+    With acknowledge the response is returned and removed in one step.
+    """
+    poll_logger.debug("Responses requested for %s (acknowledge=%s, user=%s)", request_id, acknowledge, user)
 
     if not user:
-        logger.error("Authentication failed")
+        poll_logger.warning("Authentication failed polling for %s", request_id)
         raise HTTPException(status_code=401, detail="Authentication required")
 
-    try:
-        if request_id not in pending_responses:
-            logger.info("No responses found for request ID")
-            return {"servicenow_response": {"body": []}}
+    return await single_response(request_id, acknowledge)
+
+MAX_POLL_BATCH_SIZE = 100
 
-        response_data = pending_responses[request_id]
-        logger.info("Found response data: %s", json.dumps(response_data, indent=2))
+class ResponseBatchRequest(BaseModel):
+    request_ids: List[str] = Field(default_factory=list, max_length=MAX_POLL_BATCH_SIZE)
+    acknowledge: List[str] = Field(default_factory=list, max_length=MAX_POLL_BATCH_SIZE)
 
-        if acknowledge:
-            logger.info("Acknowledging and removing response")
-            pending_responses.pop(request_id)
-            return {"servicenow_response": {"body": []}}
+@app.post("/servicenow/responses")
+async def get_servicenow_responses_batch(batch: ResponseBatchRequest, user: Optional[User] = Depends(get_current_user)):
+    """Get responses for several request IDs and acknowledge any of them in one round trip.
 
-        if not response_data:
-            logger.info("Response data is empty")
-            return {"servicenow_response": {"body": []}}
+    Only requests with stored messages appear in "responses". IDs listed in
+    both request_ids and acknowledge are fetched and removed atomically.
+    """
+    poll_logger.debug("Responses requested for %d requests (acknowledging %d, user=%s)",
+                      len(batch.request_ids), len(batch.acknowledge), user)
 
-        logger.info("Returning response with %d messages", len(response_data))
-        logger.info("Response body: %s", json.dumps(response_data, indent=2))
-        return {"servicenow_response": {"body": response_data}}
+    if not user:
+        poll_logger.warning("Authentication failed polling for %d requests", len(batch.request_ids))
+        raise HTTPException(status_code=401, detail="Authentication required")
 
+    try:
+        return {"responses": await store_call(pending_responses, take_responses,
+                                              batch.request_ids, batch.acknowledge)}
     except Exception as e:
-        logger.error("Error getting responses: %s", str(e))
-        logger.error("Stack trace: %s", traceback.format_exc())
+        poll_logger.error("Error getting responses: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+LONG_POLL_MAX_WAIT_SECONDS = 60
+
+async def wait_for_response(request_id: str, timeout: float):
+    """Park until a response for request_id is stored or the timeout expires."""
+    # Subscribe before checking the store so a callback landing in between is not missed
+    topic = f"request:{request_id}"
+    subscriber = response_broker.subscribe(topic)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while not await store_call(pending_responses, pending_responses.get, request_id):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if getattr(pending_responses, 'shared', False):
+                # The callback may be stored by another worker, which cannot wake us
+                remaining = min(remaining, STORE_RECHECK_SECONDS)
+            try:
+                await asyncio.wait_for(subscriber.get(), remaining)
+                break
+            except asyncio.TimeoutError:
+                continue
+    finally:
+        response_broker.unsubscribe(topic, subscriber)
+
 @app.get("/poll/{request_id}")
-async def poll_request(request_id: str, acknowledge: bool = False, user: Optional[User] = Depends(get_current_user)):
-    """Get responses for a specific request ID."""
-    logger.info("=== Poll Request ===")
-    logger.info("Request ID: %s", request_id)
-    logger.info("Acknowledge: %s", acknowledge)
-    logger.info("User: %s", user)
+async def poll_request(request_id: str, acknowledge: bool = False, wait: float = 0, user: Optional[User] = Depends(get_current_user)):
+    """Get responses for a specific request ID.
+
+    With wait > 0 the request long-polls: it returns as soon as a response is
+    stored, or with an empty body after wait seconds. With acknowledge the
+    response is returned and removed in one step.
+    """
+    poll_logger.debug("Responses requested for %s (acknowledge=%s, user=%s)", request_id, acknowledge, user)
 
     if not user:
-        logger.error("Authentication failed")
+        poll_logger.warning("Authentication failed polling for %s", request_id)
         raise HTTPException(status_code=401, detail="Authentication required")
 
+    if wait > 0:
+        await wait_for_response(request_id, min(wait, LONG_POLL_MAX_WAIT_SECONDS))
+    return await single_response(request_id, acknowledge)
+
+async def stream_servicenow_events(request: Request, request_id: str, acknowledge: bool, timeout: float):
+    """Yield SSE frames for a request until timeout, disconnect or delivered content.
+
+    Whatever is already stored is sent first, and a shared store is re-read
+    periodically since its callback may land on another worker.
+    """
+    topic = f"request:{request_id}"
+    subscriber = response_broker.subscribe(topic)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    next_keepalive = loop.time() + SSE_KEEPALIVE_SECONDS
+    recheck = getattr(pending_responses, 'shared', False)
+    last_body = None
     try:
-        if request_id not in pending_responses:
-            logger.info("No responses found for request ID")
-            return {"servicenow_response": {"body": []}}
+        stored = await store_call(pending_responses, pending_responses.get, request_id)
+        event = {"requestId": request_id, "servicenow_response": {"body": stored}} if stored else None
+        while True:
+            if event is None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                wait = min(remaining, next_keepalive - loop.time())
+                if recheck:
+                    wait = min(wait, STORE_RECHECK_SECONDS)
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), max(wait, 0))
+                except asyncio.TimeoutError:
+                    stored = await store_call(pending_responses, pending_responses.get, request_id) if recheck else None
+                    if stored and stored != last_body:
+                        event = {"requestId": request_id, "servicenow_response": {"body": stored}}
+                    elif loop.time() >= next_keepalive:
+                        if await request.is_disconnected():
+                            break
+                        next_keepalive = loop.time() + SSE_KEEPALIVE_SECONDS
+                        yield ": keep-alive\n\n"
+                    continue
+
+            body = event["servicenow_response"]["body"]
+            last_body = body
+            yield format_sse(event)
+            record_delivery(event["requestId"], "push")
+            if has_content(body):
+                if acknowledge:
+                    await store_call(pending_responses, pending_responses.pop, event["requestId"], None)
+                break
+            event = None
+    finally:
+        response_broker.unsubscribe(topic, subscriber)
+
+def event_stream_response(stream) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        response_data = pending_responses[request_id]
-        logger.info("Found response data: %s", json.dumps(response_data, indent=2))
+@app.get("/servicenow/events/{request_id}")
+async def servicenow_request_events(
+    request: Request,
+    request_id: str,
+    acknowledge: bool = False,
+    timeout: float = 30,
+    user: Optional[User] = Depends(get_current_user)
+):
+    """Stream responses for a request ID as Server-Sent Events.
+
+    Anything already stored is sent first; the stream ends once an answer
+    (OutputCard or Picker) has been delivered or the timeout expires.
+    """
+    if not user:
+        raise HTTPException(status_code=401, detail="Authentication required")
 
-        if acknowledge:
-            logger.info("Acknowledging and removing response")
-            pending_responses.pop(request_id)
-            return {"servicenow_response": {"body": []}}
+    return event_stream_response(stream_servicenow_events(
+        request, request_id, acknowledge, timeout=min(timeout, SSE_MAX_TIMEOUT_SECONDS)
+    ))
 
-        if not response_data:
-            logger.info("Response data is empty")
-            return {"servicenow_response": {"body": []}}
+# Bot-to-bot relay: a GPT agent converses with the ServiceNow VA unattended
+RELAY_SYSTEM_PROMPT = (
+    "You are an employee chatting with your company's IT service desk virtual agent. "
+    "Your goal: {goal}\n"
+    "Reply with only the next message you would type. When picking from a list, reply with "
+    "the option label. When the goal is met or cannot be met, reply with exactly {done}."
+)
+RELAY_DONE = "DONE"
+RELAY_MAX_TURNS = int(os.getenv('RELAY_MAX_TURNS', '10'))
+RELAY_TURN_TIMEOUT_SECONDS = float(os.getenv('RELAY_TURN_TIMEOUT_SECONDS', '60'))
+RELAY_TIMEOUT_SECONDS = float(os.getenv('RELAY_TIMEOUT_SECONDS', '600'))
+RELAY_MAX_DIALOGUES = int(os.getenv('RELAY_MAX_DIALOGUES', '100'))
+RELAY_RETENTION_SECONDS = float(os.getenv('RELAY_RETENTION_SECONDS', '600'))  # keep finished transcripts
 
-        logger.info("Returning response with %d messages", len(response_data))
-        logger.info("Response body: %s", json.dumps(response_data, indent=2))
-        return {"servicenow_response": {"body": response_data}}
+RELAY_TURN_LATENCY = metrics.register(Histogram(
+    "relay_turn_duration_seconds", "Relay turn latency by speaker.", ("speaker",)))
+RELAY_OUTCOMES = metrics.register(Counter(
+    "relay_dialogues_total", "Finished relay dialogues by outcome.", ("status",)))
 
-    except Exception as e:
-        logger.error("Error getting responses: %s", str(e))
-        logger.error("Stack trace: %s", traceback.format_exc())
-        raise HTTPException(status_code=500, detail=str(e))
+def render_va_messages(messages: List[dict]) -> str:
+    """Flatten VA messages into the plain text a person would read in the chat window."""
+    lines = []
+    for msg in messages:
+        if not isinstance(msg, dict):
+            continue
+        if msg.get('uiType') == 'OutputCard':
+            try:
+                data = json.loads(msg.get('data') or '{}')
+            except (TypeError, json.JSONDecodeError):
+                data = {}
+            lines.extend(
+                f"{field.get('fieldLabel', '')} {field.get('fieldValue', '')}".strip()
+                for field in data.get('fields', [])
+            )
+        elif msg.get('uiType') == 'Picker':
+            lines.append(msg.get('label', ''))
+            lines.extend(f"{i}. {opt.get('label', '')}" for i, opt in enumerate(msg.get('options', []), 1))
+        elif msg.get('message') or msg.get('text'):
+            lines.append(msg.get('message') or msg.get('text'))
+    return "\n".join(line for line in lines if line)
+
+class RelayRequest(BaseModel):
+    goal: str
+    opening_message: Optional[str] = None
+    servicenow_instance: Optional[str] = None  # defaults to the user's assigned instance
+    # Clients may lower the configured limits but not raise them
+    max_turns: int = Field(RELAY_MAX_TURNS, ge=1, le=RELAY_MAX_TURNS)
+    turn_timeout: float = Field(RELAY_TURN_TIMEOUT_SECONDS, gt=0, le=RELAY_TURN_TIMEOUT_SECONDS)
+    timeout: float = Field(RELAY_TIMEOUT_SECONDS, gt=0, le=RELAY_TIMEOUT_SECONDS)
+
+class BotRelay:
+    """Drive one GPT <-> ServiceNow VA dialogue.
+
+    VA replies arrive through response_broker (pushed by the callback handler),
+    so a waiting dialogue costs a parked coroutine rather than a poll loop and
+    one worker can hold many of them.
+    """
+
+    def __init__(self, relay_id: str, request: RelayRequest, user_key: str = "",
+                 instance: Optional[ServiceNowAPI] = None, user_id: Optional[str] = None,
+                 store: Optional[StateStore] = None):
+        self.relay_id = relay_id
+        self.request = request
+        self.user_key = user_key
+        # Routed like /chat for a logged-in user; batch runs use the default instance
+        self.instance = instance
+        self.user_id = user_id
+        # Where GET /relay finds the dialogue; saved again on each turn to refresh its TTL
+        self.store = store
+        # ServiceNow keys callbacks by the first 6 characters of the session id
+        self.session_id = uuid.uuid4().hex
+        self.status = "running"
+        self.error = None
+        self.transcript = []
+        self.history = []
+
+    def snapshot(self) -> dict:
+        return {
+            "relay_id": self.relay_id,
+            "goal": self.request.goal,
+            "status": self.status,
+            "error": self.error,
+            "turns": len([entry for entry in self.transcript if entry["speaker"] == "servicenow"]),
+            "transcript": self.transcript
+        }
+
+    async def save(self):
+        """Publish the current snapshot for GET /relay, which may be served by another worker."""
+        if self.store is not None:
+            await store_call(self.store, self.store.__setitem__, self.relay_id,
+                             {**self.snapshot(), "user_key": self.user_key})
+
+    async def record(self, speaker: str, text: str, started: float, **extra):
+        elapsed = time.perf_counter() - started
+        RELAY_TURN_LATENCY.observe(elapsed, speaker=speaker)
+        self.transcript.append({"speaker": speaker, "text": text, "latency_ms": round(elapsed * 1000, 1), **extra})
+        await self.save()
+
+    async def run(self) -> dict:
+        try:
+            await asyncio.wait_for(self.converse(), self.request.timeout)
+        except asyncio.TimeoutError:
+            self.status = "timeout"
+        except HTTPException as e:
+            self.status, self.error = "error", e.detail
+        except Exception as e:
+            logger.error("Relay %s failed: %s", self.relay_id, e, exc_info=True)
+            self.status, self.error = "error", str(e)
+        RELAY_OUTCOMES.inc(status=self.status)
+        await self.save()
+        return self.snapshot()
+
+    async def converse(self):
+        topic = f"session:{self.session_id[:6]}"
+        subscriber = response_broker.subscribe(topic)
+        try:
+            message = self.request.opening_message or await self.reply(None)
+            turns = 0
+            # GPT may finish on the reply to the last allowed turn, so check before the limit
+            while message.strip().upper() != RELAY_DONE:
+                if turns >= self.request.max_turns:
+                    self.status = "max_turns"
+                    return
+                va_text = await self.send(subscriber, message)
+                if va_text is None:
+                    self.status = "timeout"
+                    return
+                message = await self.reply(va_text)
+                turns += 1
+            self.status = "completed"
+        finally:
+            response_broker.unsubscribe(topic, subscriber)
+
+    async def reply(self, va_text: Optional[str]) -> str:
+        started = time.perf_counter()
+        prompt = va_text or "(The virtual agent is waiting for your first message.)"
+        response = await get_gpt_response_async(
+            prompt, self.user_key, use_cache=False, history=self.history,
+            system_prompt=RELAY_SYSTEM_PROMPT.format(goal=self.request.goal, done=RELAY_DONE)
+        )
+        self.history += [{"role": "user", "content": prompt}, {"role": "assistant", "content": response}]
+        await self.record("gpt", response, started)
+        return response
+
+    async def send(self, subscriber: asyncio.Queue, message: str) -> Optional[str]:
+        """Send one message to the VA and wait for its content reply."""
+        started = time.perf_counter()
+        request_id, messages = await send_va_turn(
+            subscriber, message, self.session_id, self.request.turn_timeout, channel="relay",
+            instance=self.instance, user_id=self.user_id
+        )
+        if not has_content(messages):
+            return None
+        text = render_va_messages(messages)
+        await self.record("servicenow", text, started, request_id=request_id)
+        return text
+
+async def wait_for_va_content(subscriber: asyncio.Queue, request_id: str, timeout: float) -> List[dict]:
+    """Wait on a session subscription until request_id has content, or the timeout expires."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # Immediate replies are stored before we start listening
+    messages = await store_call(pending_responses, pending_responses.get, request_id) or []
+    while not has_content(messages):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        if getattr(pending_responses, 'shared', False):
+            # Callbacks handled by another worker only show up in the shared store
+            remaining = min(remaining, STORE_RECHECK_SECONDS)
+        try:
+            event = await asyncio.wait_for(subscriber.get(), remaining)
+            if event["requestId"] == request_id:
+                messages = event["servicenow_response"]["body"]
+        except asyncio.TimeoutError:
+            messages = await store_call(pending_responses, pending_responses.get, request_id) or messages
+    return messages
+
+async def send_va_turn(subscriber: asyncio.Queue, message: str, session_id: str, timeout: float, channel: str,
+                       instance: Optional[ServiceNowAPI] = None, user_id: Optional[str] = None):
+    """Send a message to the VA and consume its reply.
+
+    `subscriber` must already be subscribed to the session's topic. Returns the
+    request ID and the reply messages, which have no content on timeout.
+    Without an instance the default one is used, as for batch runs.
+    """
+    api = instance or servicenow_api
+    result = await api.send_message_to_va_async(message, session_id, user_id)
+    if result.get("status") != "success":
+        raise HTTPException(status_code=502, detail=result.get("error", "ServiceNow error"))
+    request_id = result["requestId"]
+
+    messages = await wait_for_va_content(subscriber, request_id, timeout)
+    await store_call(pending_responses, pending_responses.pop, request_id, None)
+    if has_content(messages):
+        record_delivery(request_id, channel)
+    return request_id, messages
+
+# Snapshots by relay ID, shared between workers. Entries outlive the longest dialogue, and each
+# turn re-saves its entry, so retention counts from the last turn
+relay_dialogues = create_store("relay", ttl=RELAY_TIMEOUT_SECONDS + RELAY_RETENTION_SECONDS)
+relay_tasks = set()
+
+@app.post("/relay")
+async def start_relay(
+    request: RelayRequest,
+    user: Optional[User] = Depends(get_current_user)
+):
+    """Start a GPT <-> ServiceNow VA dialogue in the background."""
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if len(relay_tasks) >= RELAY_MAX_DIALOGUES:
+        raise HTTPException(status_code=503, detail="Too many relay dialogues running",
+                            headers={"Retry-After": "5"})
+
+    instance = servicenow_instances.for_user(user, request.servicenow_instance)
+    relay = BotRelay(str(uuid.uuid4()), request, user.username,
+                     instance=instance, user_id=user.servicenow_user_id or user.username,
+                     store=relay_dialogues)
+    await relay.save()
+    task = asyncio.create_task(relay.run())
+    relay_tasks.add(task)
+    task.add_done_callback(relay_tasks.discard)
+    return {"relay_id": relay.relay_id, "status": relay.status}
+
+@app.get("/relay/{relay_id}")
+async def get_relay(
+    relay_id: str,
+    user: Optional[User] = Depends(get_current_user)
+):
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    snapshot = await store_call(relay_dialogues, relay_dialogues.get, relay_id)
+    if snapshot is None or snapshot.get("user_key") != user.username:
+        raise HTTPException(status_code=404, detail="Relay not found")
+    return {key: value for key, value in snapshot.items() if key != "user_key"}
 
 @app.get("/debug/pending_responses")
 async def debug_pending_responses(
@@ -498,12 +3035,317 @@ async def debug_pending_responses(
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    logger.info("Current pending_responses: %s", json.dumps(pending_responses, indent=2))
+    stored = await store_call(pending_responses, dict, pending_responses)
+    logger.debug("Current pending_responses: %s", LazyJSON(stored, indent=2))
     return {
+        "pending_responses": stored,
+        "count": len(stored)
+    }
+
+def state_stores() -> dict:
+    stores = {
+        "sessions": sessions,
         "pending_responses": pending_responses,
-        "count": len(pending_responses)
+        "message_store": chatbot_api.message_store,
+        "conversations": conversation_memory.store,
+        "relay_dialogues": relay_dialogues,
+        "callback_stored_at": callback_stored_at
+    }
+    if completion_cache is not None:
+        stores["gpt_cache"] = completion_cache.store
+    return stores
+
+async def sweep_state_stores():
+    """Periodically drop expired entries so abandoned conversations do not pile up."""
+    while True:
+        await asyncio.sleep(STATE_SWEEP_INTERVAL_SECONDS)
+        for name, store in state_stores().items():
+            try:
+                removed = await run_in_threadpool(store.sweep) if hasattr(store, 'sweep') else 0
+                if removed:
+                    logger.info("Expired %d entries from %s", removed, name)
+            except Exception as e:
+                logger.error("Error sweeping %s: %s", name, str(e))
+
+metrics.register(Gauge("pending_responses_entries", "Requests with undelivered ServiceNow responses.",
+                       lambda: len(pending_responses)))
+metrics.register(Gauge("sessions_entries", "Logged-in sessions.", lambda: len(sessions)))
+
+def store_totals(attribute: str):
+    """Read a running total (expired or evicted) from every store that keeps one.
+
+    Redis enforces expiry itself, so shared stores have no totals to report.
+    """
+    return lambda: [({"store": name}, getattr(store, attribute))
+                    for name, store in state_stores().items() if hasattr(store, attribute)]
+
+metrics.register(CallbackCounter("state_store_expired_total", "State entries dropped after their TTL.",
+                                 store_totals("expired"), ("store",)))
+metrics.register(CallbackCounter("state_store_evictions_total", "State entries evicted by size bounds.",
+                                 store_totals("evicted"), ("store",)))
+CIRCUIT_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+# Backend names include operator-chosen instance names, so they go in a label rather than the metric name
+metrics.register(Gauge(
+    "backend_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open).",
+    lambda: [({"backend": backend.name}, CIRCUIT_STATE_VALUES[backend.breaker.state])
+             for backend in [api.backend for api in servicenow_instances.instances.values()] + [openai_backend]],
+    ("backend",)))
+metrics.register(Gauge("gpt_active_requests", "GPT calls in progress.", lambda: gpt_limiter.active))
+metrics.register(Gauge("gpt_queued_requests", "GPT calls waiting for a slot.", lambda: gpt_limiter.queued))
+metrics.register(Gauge("gpt_rejected_requests", "GPT calls rejected because the queue was full.",
+                       lambda: gpt_limiter.rejected))
+
+@app.get("/metrics")
+async def metrics_endpoint(authorization: Optional[str] = Header(None)):
+    """Expose metrics in the Prometheus text format (bearer token required if METRICS_TOKEN is set)."""
+    token = os.getenv('METRICS_TOKEN')
+    if token and not hmac.compare_digest(authorization or "", f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    # Store sizes may need a round trip to a shared backend
+    body = await run_in_threadpool(metrics.render)
+    return Response(content=body, media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/state")
+async def debug_state(
+    user: Optional[User] = Depends(get_current_user)
+):
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    return {
+        name: store.stats() if hasattr(store, 'stats') else {"entries": len(store)}
+        for name, store in state_stores().items()
+    }
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness: the worker's event loop is responding."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: warm-up has finished and the worker is not draining."""
+    status_code = 200 if lifecycle.ready and not lifecycle.draining else 503
+    return JSONResponse(lifecycle.status(), status_code=status_code)
+
+@app.get("/debug/backends")
+async def debug_backends(
+    user: Optional[User] = Depends(get_current_user)
+):
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    return {
+        backend.name: backend.breaker.stats()
+        for backend in [api.backend for api in servicenow_instances.instances.values()] + [openai_backend]
     }
 
+@app.get("/debug/gpt_queue")
+async def debug_gpt_queue(
+    user: Optional[User] = Depends(get_current_user)
+):
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    return gpt_limiter.stats()
+
+# Batch runner: replay scripted conversations in-process
+class BatchConversation(BaseModel):
+    """One line of a batch input file."""
+    id: Optional[str] = None
+    mode: str = "servicenow"  # servicenow, gpt or relay
+    turns: List[str] = []
+    goal: Optional[str] = None  # relay mode only
+    max_turns: int = RELAY_MAX_TURNS  # relay mode only
+
+def read_batch_conversations(path: str) -> Iterator[tuple]:
+    """Yield (line_number, conversation or error) one line at a time."""
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, BatchConversation(**json.loads(line))
+            except Exception as e:
+                yield line_number, e
+
+async def run_batch_conversation(conversation: BatchConversation, turn_timeout: float, user_key: str) -> dict:
+    started = time.perf_counter()
+    result = {"id": conversation.id, "mode": conversation.mode, "status": "ok", "turns": []}
+    try:
+        if conversation.mode == "relay":
+            request = RelayRequest(goal=conversation.goal or "", max_turns=conversation.max_turns,
+                                   turn_timeout=min(turn_timeout, RELAY_TURN_TIMEOUT_SECONDS))
+            relay = await BotRelay(str(uuid.uuid4()), request, user_key).run()
+            result.update(status=relay["status"], error=relay["error"], turns=relay["transcript"])
+        elif conversation.mode == "gpt":
+            history = []
+            for message in conversation.turns:
+                turn_started = time.perf_counter()
+                response = await get_gpt_response_async(message, user_key, history=history)
+                history += [{"role": "user", "content": message}, {"role": "assistant", "content": response}]
+                result["turns"].append({"message": message, "response": response,
+                                        "latency_ms": round((time.perf_counter() - turn_started) * 1000, 1)})
+        elif conversation.mode == "servicenow":
+            session_id = uuid.uuid4().hex
+            topic = f"session:{session_id[:6]}"
+            subscriber = response_broker.subscribe(topic)
+            try:
+                for message in conversation.turns:
+                    turn_started = time.perf_counter()
+                    request_id, messages = await send_va_turn(subscriber, message, session_id, turn_timeout, "batch")
+                    result["turns"].append({
+                        "message": message,
+                        "request_id": request_id,
+                        "response": render_va_messages(messages),
+                        "messages": messages,
+                        "latency_ms": round((time.perf_counter() - turn_started) * 1000, 1)
+                    })
+                    if not has_content(messages):
+                        result["status"] = "timeout"
+                        break
+            finally:
+                response_broker.unsubscribe(topic, subscriber)
+        else:
+            raise ValueError(f"Unknown mode {conversation.mode!r}")
+    except HTTPException as e:
+        result.update(status="error", error=e.detail)
+    except Exception as e:
+        result.update(status="error", error=str(e))
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+# Not serve's default port, so a batch can run next to a local server
+BATCH_CALLBACK_PORT = 8001
+
+def callback_app() -> FastAPI:
+    """An app serving only the ServiceNow callback route, for the batch runner.
+
+    Batch runs have no logins, so the rest of the API (and its lifespan
+    warm-up) is not exposed while they listen for callbacks.
+    """
+    callbacks = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+    callbacks.add_api_route("/servicenow/callback", servicenow_callback, methods=["POST"])
+    return callbacks
+
+async def run_batch(input_path: str, output_path: str, parallelism: int = 10,
+                    turn_timeout: float = RELAY_TURN_TIMEOUT_SECONDS, callback_port: int = 0,
+                    callback_host: str = "127.0.0.1") -> dict:
+    """Run every conversation in input_path, appending results to output_path as they finish.
+
+    Input is read lazily through a bounded queue, so memory use depends on
+    `parallelism` rather than on the size of the input file. With
+    `callback_port` set the callback route is served on that port so
+    ServiceNow callbacks reach this process.
+    """
+    server = None
+    if callback_port:
+        server = uvicorn.Server(uvicorn.Config(callback_app(), host=callback_host, port=callback_port,
+                                               log_level="warning", lifespan="off"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            if server_task.done():
+                raise RuntimeError(f"Could not serve callbacks on {callback_host}:{callback_port}")
+            await asyncio.sleep(0.05)
+        logger.info("Listening for ServiceNow callbacks on %s:%d", callback_host, callback_port)
+
+    work = asyncio.Queue(maxsize=parallelism * 2)
+    totals = {}
+
+    async def worker(output):
+        while True:
+            item = await work.get()
+            if item is None:
+                return
+            line_number, conversation = item
+            if isinstance(conversation, Exception):
+                result = {"id": None, "line": line_number, "status": "error", "error": f"Invalid input: {conversation}"}
+            else:
+                result = await run_batch_conversation(conversation, turn_timeout, "batch")
+                result["line"] = line_number
+            totals[result["status"]] = totals.get(result["status"], 0) + 1
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    try:
+        with open(output_path, "w") as output:
+            workers = [asyncio.create_task(worker(output)) for _ in range(parallelism)]
+            for item in read_batch_conversations(input_path):
+                await work.put(item)
+            for _ in workers:
+                await work.put(None)
+            await asyncio.gather(*workers)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await server_task
+    return totals
+
+def worker_app_path() -> str:
+    """Import path for the app in spawned workers.
+
+    A spawned worker first re-runs the parent's __main__ as "__mp_main__".
+    Under "python chatbot.py" that is this file, so the app is taken from
+    there; importing "chatbot:app" would execute the module (stores, loggers,
+    clients) a second time in every worker.
+    """
+    return "__mp_main__:app" if __name__ == "__main__" else f"{__name__}:app"
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bot2Bot server and batch conversation runner.")
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help="Run the web app (default)")
+    serve.add_argument("--host", default=os.getenv('HOST', '0.0.0.0'))
+    serve.add_argument("--port", type=int, default=int(os.getenv('PORT', '8000')))
+    serve.add_argument("--workers", type=int, default=int(os.getenv('WEB_CONCURRENCY', '1')),
+                       help="Worker processes (default WEB_CONCURRENCY or 1)")
+    assets = commands.add_parser("assets", help="Precompress static files (run at build time)")
+    assets.add_argument("--directory", default=STATIC_DIRECTORY)
+    batch = commands.add_parser("batch", help="Replay scripted conversations from a JSONL file")
+    batch.add_argument("input", help="JSONL file, one conversation per line")
+    batch.add_argument("--output", default="batch_results.jsonl", help="JSONL file for results")
+    batch.add_argument("--parallelism", type=int, default=10, help="Conversations in flight at once")
+    batch.add_argument("--turn-timeout", type=float, default=RELAY_TURN_TIMEOUT_SECONDS,
+                       help="Seconds to wait for each VA reply")
+    batch.add_argument("--callback-port", type=int, default=BATCH_CALLBACK_PORT,
+                       help=f"Port to receive ServiceNow callbacks on (default {BATCH_CALLBACK_PORT}, "
+                            "kept apart from serve's 8000; 0 to only use immediate replies)")
+    batch.add_argument("--callback-host", default="127.0.0.1",
+                       help="Interface for the callback listener (0.0.0.0 to accept callbacks directly)")
+    args = parser.parse_args(argv)
+
+    if args.command == "assets":
+        print(json.dumps(precompress_assets(args.directory)))
+        return 0
+
+    if args.command == "batch":
+        totals = asyncio.run(run_batch(args.input, args.output, args.parallelism,
+                                       args.turn_timeout, args.callback_port, args.callback_host))
+        print(json.dumps(totals))
+        return 0 if set(totals) <= {"ok", "completed"} else 1
+
+    if args.command is None:
+        args = parser.parse_args(["serve"])
+    if args.workers > 1 and not state_stores()["sessions"].shared:
+        logger.warning("Running %d workers with in-memory state: sessions and responses are per worker. "
+                       "Set STATE_BACKEND=redis to share them.", args.workers)
+    # Workers are started by importing the app, so pass it by name when there is more than one
+    config = uvicorn.Config(
+        worker_app_path() if args.workers > 1 else app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=int(DRAIN_TIMEOUT_SECONDS)
+    )
+    server = DrainingServer(config)
+    if args.workers > 1:
+        DrainingSupervisor(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+    return 0
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    raise SystemExit(main())
@@ -27,7 +27,7 @@ const ChatContainer = ({ toggleSidebar, isMobile }) => {
   useEffect(() => {
     return () => {
       if (pollIntervalRef.current) {
-        clearInterval(pollIntervalRef.current);
+        clearTimeout(pollIntervalRef.current);
       }
       setIsPolling(false);
     };
@@ -157,6 +157,197 @@ const ChatContainer = ({ toggleSidebar, isMobile }) => {
     }
   }, [processMessages]);
 
+  // One poller shared by every outstanding ServiceNow request. Each round trip
+  // fetches all pending IDs and acknowledges the ones whose content has been
+  // processed, so nothing is removed before the user has seen it; the delay
+  // doubles while nothing arrives and resets as soon as something does.
+  const POLL_MIN_DELAY = 500;
+  const POLL_MAX_DELAY = 8000;
+  const POLL_TIMEOUT = 30000;
+  const pollerRef = useRef({
+    pending: new Map(),  // requestId -> { deadline, seen }
+    rendered: new Set(),  // requestIds with processed content, acknowledged on the next poll
+    delay: POLL_MIN_DELAY,
+    inFlight: false
+  });
+
+  const schedulePoll = (delay) => {
+    // The next poll is only scheduled once the previous one has finished
+    if (pollerRef.current.inFlight) return;
+    clearTimeout(pollIntervalRef.current);
+    pollIntervalRef.current = setTimeout(pollPendingResponses, delay);
+  };
+
+  const pollPendingResponses = async () => {
+    const poller = pollerRef.current;
+    const requestIds = [...poller.pending.keys()];
+    const acknowledge = [...poller.rendered];
+    if (requestIds.length === 0 && acknowledge.length === 0) return;
+
+    poller.inFlight = true;
+    setIsPolling(true);
+    let received = false;
+    try {
+      console.log('Polling for requests:', requestIds);
+      const pollResponse = await fetch('/servicenow/responses', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        credentials: 'include',
+        // Unacknowledged bodies keep accumulating; `seen` skips what is already shown
+        body: JSON.stringify({ request_ids: requestIds, acknowledge })
+      });
+
+      if (!pollResponse.ok) {
+        throw new Error(`Poll failed: ${pollResponse.status}`);
+      }
+
+      const pollData = await pollResponse.json();
+      console.log('Poll response data:', pollData);
+      // Only forget acknowledgements the server has received; a failed poll retries them
+      acknowledge.forEach((requestId) => poller.rendered.delete(requestId));
+
+      Object.entries(pollData.responses || {}).forEach(([requestId, body]) => {
+        const entry = poller.pending.get(requestId);
+        if (!entry) return;
+        received = true;
+
+        // Callbacks accumulate, so only process messages not shown yet
+        const unseen = body.filter((msg) => !entry.seen.has(JSON.stringify(msg)));
+        unseen.forEach((msg) => entry.seen.add(JSON.stringify(msg)));
+        if (unseen.length > 0 && processMessages(unseen)) {
+          console.log('Content received for request:', requestId);
+          poller.pending.delete(requestId);
+          poller.rendered.add(requestId);
+          setIsLoading(false);
+        }
+      });
+    } catch (error) {
+      console.error('Error during polling:', error);
+    } finally {
+      poller.inFlight = false;
+    }
+
+    const now = Date.now();
+    poller.pending.forEach((entry, requestId) => {
+      if (now >= entry.deadline) {
+        console.log('Polling timed out for request:', requestId);
+        poller.pending.delete(requestId);
+        setIsLoading(false);
+        addMessage("I'm sorry, but I didn't receive a response in time. Please try again.", 'bot-message system-message');
+      }
+    });
+
+    poller.delay = received ? POLL_MIN_DELAY : Math.min(poller.delay * 2, POLL_MAX_DELAY);
+    if (poller.pending.size > 0 || poller.rendered.size > 0) {
+      schedulePoll(poller.delay);
+    } else {
+      setIsPolling(false);
+    }
+  };
+
+  const pollForResponses = (requestId) => {
+    console.log('Starting polling for request:', requestId);
+    const poller = pollerRef.current;
+    poller.pending.set(requestId, { deadline: Date.now() + POLL_TIMEOUT, seen: new Set() });
+    poller.delay = POLL_MIN_DELAY;
+    schedulePoll(0);
+  };
+
+  // Prefer the server push channel, falling back to polling if it is unavailable
+  const listenForResponses = (requestId) => {
+    if (!window.EventSource) {
+      pollForResponses(requestId);
+      return;
+    }
+
+    console.log('Listening for responses to request:', requestId);
+    const source = new EventSource(`/servicenow/events/${requestId}?acknowledge=true`, { withCredentials: true });
+    let answered = false;
+
+    source.addEventListener('servicenow_response', (event) => {
+      const data = JSON.parse(event.data);
+      console.log('Pushed response data:', data);
+      const messages = data?.servicenow_response?.body || [];
+      if (messages.length > 0 && processMessages(messages)) {
+        console.log('Content received, closing push channel');
+        answered = true;
+        source.close();
+        setIsLoading(false);
+      }
+    });
+
+    source.onerror = () => {
+      // The server closes the stream after an answer or its timeout
+      source.close();
+      if (!answered) {
+        console.log('Push channel closed, falling back to polling');
+        pollForResponses(requestId);
+      }
+    };
+  };
+
+  // Stream a GPT answer into a single bot message as deltas arrive
+  const streamGptResponse = async (message) => {
+    const response = await fetch('/chat/stream', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        message,
+        session_id: sessionId.current
+      }),
+      credentials: 'include'
+    });
+
+    console.log('Chat stream response:', response);
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let started = false;
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Server-Sent Events are separated by a blank line
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        const lines = block.split('\n');
+        const eventName = (lines.find(line => line.startsWith('event: ')) || '').slice('event: '.length);
+        const dataLine = lines.find(line => line.startsWith('data: '));
+        if (!eventName || !dataLine) continue;
+        const data = JSON.parse(dataLine.slice('data: '.length));
+
+        if (eventName === 'delta') {
+          if (!started) {
+            started = true;
+            setIsLoading(false);
+            addMessage(data.delta, 'bot-message');
+          } else {
+            // Append to the bot message started by the first delta
+            setMessages(prev => {
+              const last = prev[prev.length - 1];
+              return [...prev.slice(0, -1), { ...last, text: last.text + data.delta }];
+            });
+          }
+        } else if (eventName === 'error') {
+          throw new Error(data.detail || 'Unknown error occurred');
+        }
+      }
+    }
+  };
+
   const handleSendMessage = async (message) => {
     if (!message.trim()) return;
 
@@ -165,6 +356,12 @@ const ChatContainer = ({ toggleSidebar, isMobile }) => {
       addMessage(message, 'user-message');
       setIsLoading(true);
 
+      // GPT answers are streamed token by token
+      if (!isServiceNow && window.ReadableStream && window.TextDecoder) {
+        await streamGptResponse(message);
+        return;
+      }
+
       const response = await fetch('/chat', {
         method: 'POST',
         headers: {
@@ -191,55 +388,7 @@ const ChatContainer = ({ toggleSidebar, isMobile }) => {
       console.log('ServiceNow request ID:', requestId);
 
       if (requestId) {
-        console.log('Starting polling for request:', requestId);
-        let pollCount = 0;
-        const maxPolls = 30; // Maximum number of polling attempts
-        
-        const pollInterval = setInterval(async () => {
-          try {
-            console.log(`Polling attempt ${pollCount + 1} for request ${requestId}`);
-            const pollResponse = await fetch(`/servicenow/responses/${requestId}`, {
-              method: 'GET',
-              credentials: 'include'
-            });
-
-            console.log('Poll response:', pollResponse);
-            if (!pollResponse.ok) {
-              console.error('Poll request failed:', pollResponse.status);
-              throw new Error(`Poll failed: ${pollResponse.status}`);
-            }
-
-            const pollData = await pollResponse.json();
-            console.log('Poll response data:', pollData);
-
-            // Extract messages from the servicenow_response
-            const messages = pollData?.servicenow_response?.body || [];
-            console.log('ServiceNow messages:', messages);
-
-            if (messages.length > 0) {
-              console.log('Processing messages from poll:', messages);
-              const hasContent = processMessages(messages);
-              if (hasContent) {
-                console.log('Content received, stopping polling');
-                clearInterval(pollInterval);
-                setIsLoading(false);
-              }
-            }
-
-            pollCount++;
-            if (pollCount >= maxPolls) {
-              console.log(`Reached maximum poll attempts (${maxPolls})`);
-              clearInterval(pollInterval);
-              setIsLoading(false);
-              addMessage("I'm sorry, but I didn't receive a response in time. Please try again.", 'bot-message system-message');
-            }
-          } catch (error) {
-            console.error('Error during polling:', error);
-            clearInterval(pollInterval);
-            setIsLoading(false);
-            addMessage('An error occurred while getting the response. Please try again.', 'bot-message system-message');
-          }
-        }, 1000);
+        listenForResponses(requestId);
       } else {
         console.log('No ServiceNow request ID found in response');
         if (data.response) {
@@ -117,6 +117,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 addDebugMessage('Chat URL:', chatUrl);
             }
 
+            // GPT answers are streamed token by token
+            if (!useServiceNow && window.ReadableStream && window.TextDecoder) {
+                await streamGptResponse(`${origin}/chat/stream`, requestPayload);
+                scrollToBottom();
+                return;
+            }
+
             // Make the request to the chat endpoint
             const response = await fetch(chatUrl, {
                 method: 'POST',
@@ -150,155 +157,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (data.servicenow_response && data.servicenow_response.requestId) {
                     const requestId = data.servicenow_response.requestId;
                     
-                    if (isDebug) {
-                        addDebugMessage('Starting polling for request:', requestId);
-                    }
-                    
-                    // Start polling for responses
-                    let attempts = 0;
-                    const maxAttempts = 30; // 30 seconds timeout
-                    
-                    const pollInterval = setInterval(async () => {
-                        try {
-                            if (attempts >= maxAttempts) {
-                                clearInterval(pollInterval);
-                                addMessage('No more responses from ServiceNow', 'bot-message system-message');
-                                if (isDebug) {
-                                    addDebugMessage('Polling timed out after', maxAttempts, 'attempts');
-                                }
-                                return;
-                            }
-                            
-                            attempts++;
-                            if (isDebug) {
-                                addDebugMessage(`Polling attempt ${attempts}/${maxAttempts} for request ${requestId}`);
-                            }
-
-                            // Get the current URL's origin
-                            const pollUrl = `${origin}/servicenow/responses/${requestId}`;
-                            
-                            if (isDebug) {
-                                addDebugMessage('Polling URL:', pollUrl);
-                            }
-
-                            const pollResponse = await fetch(pollUrl, {
-                                method: 'GET',
-                                headers: {
-                                    'Content-Type': 'application/json',
-                                },
-                                credentials: 'include'  // Include cookies for authentication
-                            });
-                            
-                            if (!pollResponse.ok) {
-                                if (isDebug) {
-                                    addDebugMessage('Poll request failed:', {
-                                        status: pollResponse.status,
-                                        statusText: pollResponse.statusText
-                                    });
-                                }
-                                throw new Error(`Poll failed: ${pollResponse.status} ${pollResponse.statusText}`);
-                            }
-                            
-                            const pollData = await pollResponse.json();
-                            if (isDebug) {
-                                addDebugMessage('Poll Response:', pollData);
-                            }
-                            
-                            if (pollData.servicenow_response && pollData.servicenow_response.body) {
-                                const messages = pollData.servicenow_response.body;
-                                if (isDebug) {
-                                    addDebugMessage('Processing messages:', messages);
-                                }
-                                
-                                let hasContent = false;
-                                
-                                for (const item of messages) {
-                                    if (item.uiType === 'OutputCard') {
-                                        hasContent = true;
-                                        try {
-                                            const cardData = JSON.parse(item.data);
-                                            if (isDebug) {
-                                                addDebugMessage('Card data:', cardData);
-                                            }
-                                            
-                                            // Process each field
-                                            for (const field of cardData.fields) {
-                                                if (field.fieldLabel === 'Top Result:') {
-                                                    // Remove the "Top Result:" prefix if present
-                                                    const messageText = field.fieldValue.replace(/^Top Result:\s*/i, '');
-                                                    addMessage(messageText, 'bot-message');
-                                                    if (isDebug) {
-                                                        addDebugMessage('Added top result message:', messageText);
-                                                    }
-                                                } else if (field.fieldLabel.includes('KB')) {
-                                                    // Format the link as a clickable button
-                                                    const linkMessage = `Learn more: ${field.fieldValue}`;
-                                                    addMessage(linkMessage, 'bot-message link-message');
-                                                    if (isDebug) {
-                                                        addDebugMessage('Added link message:', linkMessage);
-                                                    }
-                                                }
-                                            }
-                                        } catch (e) {
-                                            console.error('Failed to parse card data:', e);
-                                            if (isDebug) {
-                                                addDebugMessage('Failed to parse card data:', e);
-                                                addDebugMessage('Raw card data:', item.data);
-                                            }
-                                            addMessage('Error: Failed to parse response', 'bot-message error-message');
-                                        }
-                                    } else if (item.uiType === 'Picker') {
-                                        hasContent = true;
-                                        // Format picker options as a list
-                                        const pickerMessage = `${item.label}\n${item.options.map((opt, i) => `${i + 1}. ${opt.label}`).join('\n')}`;
-                                        addMessage(pickerMessage, 'bot-message picker-message');
-                                        if (isDebug) {
-                                            addDebugMessage('Added picker message:', pickerMessage);
-                                        }
-                                    }
-                                }
-                                
-                                if (hasContent) {
-                                    // Acknowledge the messages
-                                    try {
-                                        const ackResponse = await fetch(`${pollUrl}?acknowledge=true`, {
-                                            method: 'GET',
-                                            headers: {
-                                                'Content-Type': 'application/json',
-                                            },
-                                            credentials: 'include'
-                                        });
-                                        
-                                        if (!ackResponse.ok) {
-                                            if (isDebug) {
-                                                addDebugMessage('Failed to acknowledge messages:', {
-                                                    status: ackResponse.status,
-                                                    statusText: ackResponse.statusText
-                                                });
-                                            }
-                                        } else if (isDebug) {
-                                            addDebugMessage('Successfully acknowledged messages');
-                                        }
-                                    } catch (e) {
-                                        if (isDebug) {
-                                            addDebugMessage('Error acknowledging messages:', e);
-                                        }
-                                    }
-                                    
-                                    clearInterval(pollInterval);
-                                    if (isDebug) {
-                                        addDebugMessage('Polling completed successfully');
-                                    }
-                                    return;
-                                }
-                            }
-                        } catch (e) {
-                            console.error('Error during polling:', e);
-                            if (isDebug) {
-                                addDebugMessage('Error during polling:', e);
-                            }
-                        }
-                    }, 1000);
+                    listenForResponses(requestId, origin);
                 } else {
                     if (isDebug) {
                         addDebugMessage('No requestId in response:', data);
@@ -326,6 +185,268 @@ document.addEventListener('DOMContentLoaded', function() {
         scrollToBottom();
     }
 
+    // Stream a GPT answer into a single bot message as deltas arrive
+    async function streamGptResponse(streamUrl, requestPayload) {
+        const response = await fetch(streamUrl, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            credentials: 'include',  // Include cookies for authentication
+            body: JSON.stringify(requestPayload)
+        });
+
+        if (!response.ok) {
+            throw new Error(await response.text() || 'Unknown error occurred');
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+        let messageContent = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Server-Sent Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                const eventLine = block.split('\n').find(line => line.startsWith('event: '));
+                const dataLine = block.split('\n').find(line => line.startsWith('data: '));
+                if (!eventLine || !dataLine) continue;
+
+                const eventName = eventLine.slice('event: '.length);
+                const data = tryParseJson(dataLine.slice('data: '.length)) || {};
+
+                if (eventName === 'delta') {
+                    text += data.delta;
+                    if (messageContent) {
+                        messageContent.textContent = text;
+                        scrollToBottom();
+                    } else {
+                        messageContent = addMessage(text, 'bot-message');
+                    }
+                } else if (eventName === 'error') {
+                    throw new Error(data.detail || 'Unknown error occurred');
+                } else if (eventName === 'done' && isDebug) {
+                    addDebugMessage('Response Payload:', data);
+                }
+            }
+        }
+    }
+
+    // Render ServiceNow messages; returns true if an answer (card or picker) was shown
+    function renderServiceNowMessages(messages) {
+        if (isDebug) {
+            addDebugMessage('Processing messages:', messages);
+        }
+
+        let hasContent = false;
+
+        for (const item of messages) {
+            if (item.uiType === 'OutputCard') {
+                hasContent = true;
+                try {
+                    const cardData = JSON.parse(item.data);
+                    if (isDebug) {
+                        addDebugMessage('Card data:', cardData);
+                    }
+
+                    // Process each field
+                    for (const field of cardData.fields) {
+                        if (field.fieldLabel === 'Top Result:') {
+                            // Remove the "Top Result:" prefix if present
+                            const messageText = field.fieldValue.replace(/^Top Result:\s*/i, '');
+                            addMessage(messageText, 'bot-message');
+                            if (isDebug) {
+                                addDebugMessage('Added top result message:', messageText);
+                            }
+                        } else if (field.fieldLabel.includes('KB')) {
+                            // Format the link as a clickable button
+                            const linkMessage = `Learn more: ${field.fieldValue}`;
+                            addMessage(linkMessage, 'bot-message link-message');
+                            if (isDebug) {
+                                addDebugMessage('Added link message:', linkMessage);
+                            }
+                        }
+                    }
+                } catch (e) {
+                    console.error('Failed to parse card data:', e);
+                    if (isDebug) {
+                        addDebugMessage('Failed to parse card data:', e);
+                        addDebugMessage('Raw card data:', item.data);
+                    }
+                    addMessage('Error: Failed to parse response', 'bot-message error-message');
+                }
+            } else if (item.uiType === 'Picker') {
+                hasContent = true;
+                // Format picker options as a list
+                const pickerMessage = `${item.label}\n${item.options.map((opt, i) => `${i + 1}. ${opt.label}`).join('\n')}`;
+                addMessage(pickerMessage, 'bot-message picker-message');
+                if (isDebug) {
+                    addDebugMessage('Added picker message:', pickerMessage);
+                }
+            }
+        }
+
+        return hasContent;
+    }
+
+    // Prefer the server push channel, falling back to polling if it is unavailable
+    function listenForResponses(requestId, origin) {
+        if (!window.EventSource) {
+            pollForResponses(requestId, origin);
+            return;
+        }
+
+        if (isDebug) {
+            addDebugMessage('Listening for responses to request:', requestId);
+        }
+
+        const eventsUrl = `${origin}/servicenow/events/${requestId}?acknowledge=true`;
+        const source = new EventSource(eventsUrl, { withCredentials: true });
+        let answered = false;
+
+        source.addEventListener('servicenow_response', (event) => {
+            const data = tryParseJson(event.data);
+            if (isDebug) {
+                addDebugMessage('Pushed Response:', data);
+            }
+            if (data && data.servicenow_response && data.servicenow_response.body) {
+                if (renderServiceNowMessages(data.servicenow_response.body)) {
+                    answered = true;
+                    source.close();
+                    scrollToBottom();
+                }
+            }
+        });
+
+        source.onerror = () => {
+            // The server closes the stream after an answer or its timeout
+            source.close();
+            if (!answered) {
+                if (isDebug) {
+                    addDebugMessage('Push channel closed, falling back to polling');
+                }
+                pollForResponses(requestId, origin);
+            }
+        };
+    }
+
+    // One poller shared by every outstanding ServiceNow request. Each round trip
+    // fetches all pending IDs and acknowledges the ones whose content has been
+    // rendered, so nothing is removed before the user has seen it; the delay
+    // doubles while nothing arrives and resets as soon as something does.
+    const POLL_MIN_DELAY = 500;
+    const POLL_MAX_DELAY = 8000;
+    const POLL_TIMEOUT = 30000;
+    const poller = {
+        pending: new Map(),  // requestId -> { deadline, seen }
+        rendered: new Set(),  // requestIds with rendered content, acknowledged on the next poll
+        delay: POLL_MIN_DELAY,
+        timer: null,
+        inFlight: false,
+        origin: window.location.origin
+    };
+
+    function pollForResponses(requestId, origin) {
+        if (isDebug) {
+            addDebugMessage('Starting polling for request:', requestId);
+        }
+        poller.origin = origin;
+        poller.pending.set(requestId, { deadline: Date.now() + POLL_TIMEOUT, seen: new Set() });
+        poller.delay = POLL_MIN_DELAY;
+        schedulePoll(0);
+    }
+
+    function schedulePoll(delay) {
+        // The next poll is only scheduled once the previous one has finished
+        if (poller.inFlight) return;
+        clearTimeout(poller.timer);
+        poller.timer = setTimeout(pollPendingResponses, delay);
+    }
+
+    async function pollPendingResponses() {
+        const requestIds = [...poller.pending.keys()];
+        const acknowledge = [...poller.rendered];
+        if (requestIds.length === 0 && acknowledge.length === 0) return;
+
+        poller.inFlight = true;
+        let received = false;
+        try {
+            if (isDebug) {
+                addDebugMessage('Polling for requests:', requestIds);
+            }
+            const pollResponse = await fetch(`${poller.origin}/servicenow/responses`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                credentials: 'include',  // Include cookies for authentication
+                // Unacknowledged bodies keep accumulating; `seen` skips what is already shown
+                body: JSON.stringify({ request_ids: requestIds, acknowledge })
+            });
+
+            if (!pollResponse.ok) {
+                throw new Error(`Poll failed: ${pollResponse.status} ${pollResponse.statusText}`);
+            }
+
+            const pollData = await pollResponse.json();
+            if (isDebug) {
+                addDebugMessage('Poll Response:', pollData);
+            }
+            // Only forget acknowledgements the server has received; a failed poll retries them
+            acknowledge.forEach((requestId) => poller.rendered.delete(requestId));
+
+            for (const [requestId, body] of Object.entries(pollData.responses || {})) {
+                const entry = poller.pending.get(requestId);
+                if (!entry) continue;
+                received = true;
+
+                // Callbacks accumulate, so only render messages not shown yet
+                const unseen = body.filter((message) => !entry.seen.has(JSON.stringify(message)));
+                unseen.forEach((message) => entry.seen.add(JSON.stringify(message)));
+                if (unseen.length > 0 && renderServiceNowMessages(unseen)) {
+                    poller.pending.delete(requestId);
+                    poller.rendered.add(requestId);
+                    if (isDebug) {
+                        addDebugMessage('Polling completed for request:', requestId);
+                    }
+                }
+            }
+            scrollToBottom();
+        } catch (e) {
+            console.error('Error during polling:', e);
+            if (isDebug) {
+                addDebugMessage('Error during polling:', e);
+            }
+        } finally {
+            poller.inFlight = false;
+        }
+
+        const now = Date.now();
+        for (const [requestId, entry] of poller.pending) {
+            if (now >= entry.deadline) {
+                poller.pending.delete(requestId);
+                addMessage('No more responses from ServiceNow', 'bot-message system-message');
+                if (isDebug) {
+                    addDebugMessage('Polling timed out for request:', requestId);
+                }
+            }
+        }
+
+        poller.delay = received ? POLL_MIN_DELAY : Math.min(poller.delay * 2, POLL_MAX_DELAY);
+        if (poller.pending.size > 0 || poller.rendered.size > 0) {
+            schedulePoll(poller.delay);
+        }
+    }
+
     function addDebugMessage(label, data = '') {
         if (!isDebug) return;
 
@@ -410,6 +531,8 @@ document.addEventListener('DOMContentLoaded', function() {
         if (isDebug) {
             addDebugMessage('Message added successfully');
         }
+
+        return messageContent;
     }
 
     function scrollToBottom() {
@@ -1,13 +1,24 @@
 import pytest
 import pytest_asyncio
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi import Request, Response
-from fastapi.responses import RedirectResponse, FileResponse
+from fastapi.responses import RedirectResponse
 import json
 import uuid
+import time
 import os
 import asyncio
 import httpx
+import uvicorn
+import fnmatch
+import socketserver
+import threading
+import logging
+import hmac
+import hashlib
+import subprocess
+import inspect
+import sys
 
 # Set mock environment variables
 os.environ['OPENAI_API_KEY'] = 'test-key'
@@ -17,7 +28,15 @@ os.environ['SERVICENOW_PASSWORD'] = 'test-password'
 os.environ['SERVICENOW_TOKEN'] = 'test-token'
 
 # Import after setting mock environment variables
-from chatbot import app, get_gpt_response, ServiceNowAPI, ChatbotAPI, get_current_user
+import chatbot
+from chatbot import (
+    app, get_gpt_response, ServiceNowAPI, ChatbotAPI, CompletionLimiter, get_current_user,
+    MemoryStore, RedisStore, RespClient, CredentialStore, hash_password, verify_password,
+    LazyJSON, JsonFormatter, configure_logging, SqliteStore, CompletionCache, ConversationMemory,
+    Backend, RetryPolicy, CircuitBreaker, CircuitOpenError, ServiceNowRegistry, User,
+    StaticAssets, precompress_assets
+)
+import openai
 
 # Configure pytest-asyncio
 pytest.asyncio_fixture_loop_scope = "function"
@@ -74,8 +93,11 @@ def mock_langsmith():
         yield
 
 @pytest.fixture(autouse=True)
-def mock_responses(mock_sessions):
+def mock_responses(mock_sessions, tmp_path):
     sessions, _ = mock_sessions
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    (static_dir / "index.html").write_text("mocked index.html content")
     
     def mock_redirect_init(*args, **kwargs):
         if len(args) > 0 and isinstance(args[0], str):
@@ -113,7 +135,7 @@ def mock_responses(mock_sessions):
     with patch('fastapi.responses.FileResponse', side_effect=mock_file_init) as mock_file, \
          patch('fastapi.responses.RedirectResponse', side_effect=mock_redirect_init) as mock_redirect, \
          patch('chatbot.RedirectResponse', side_effect=mock_redirect_init), \
-         patch('chatbot.FileResponse', side_effect=mock_file_init), \
+         patch('chatbot.static_assets', StaticAssets(str(static_dir))), \
          patch('fastapi.security.HTTPBasic', return_value=mock_security), \
          patch('fastapi.security.HTTPBasicCredentials', return_value=MagicMock()), \
          patch('fastapi.security.HTTPBearer', return_value=mock_security), \
@@ -125,25 +147,23 @@ def mock_sessions():
     sessions = {}
     pending = {}
     with patch('chatbot.sessions', sessions), \
-         patch('chatbot.pending_responses', pending):
+         patch('chatbot.pending_responses', pending), \
+         patch.object(chatbot.conversation_memory, 'store', {}), \
+         patch('chatbot.rate_limits', []):
         yield sessions, pending
 
 @pytest.fixture
-def mock_users():
+def mock_users(tmp_path):
     test_users = {
         "test@example.com": {
             "password": "test_password",
             "name": "Test User"
         }
     }
-    with patch('builtins.open', create=True) as mock_file:
-        # Create a mock file object with the test users
-        mock_content = json.dumps(test_users)
-        mock_file.return_value.__enter__.return_value.read.return_value = mock_content
-        
-        # Also patch json.load to return the test users directly
-        with patch('json.load', return_value=test_users):
-            yield test_users
+    users_file = tmp_path / "users.json"
+    users_file.write_text(json.dumps(test_users))
+    with patch('chatbot.credential_store', CredentialStore(str(users_file))):
+        yield test_users
 
 @pytest.fixture
 def mock_openai():
@@ -161,18 +181,89 @@ def mock_openai():
 
 @pytest.fixture
 def mock_servicenow():
-    with patch.object(ServiceNowAPI, 'send_message_to_va') as mock:
-        mock.return_value = {
-            "status": "success",
-            "requestId": str(uuid.uuid4())
-        }
+    result = {
+        "status": "success",
+        "requestId": str(uuid.uuid4())
+    }
+    with patch.object(ServiceNowAPI, 'send_message_to_va', return_value=result), \
+         patch.object(ServiceNowAPI, 'send_message_to_va_async', new_callable=AsyncMock) as mock:
+        mock.return_value = result
         yield mock
 
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Serve the subset of Redis commands used by RedisStore from a dict."""
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2])
+            command = args[0].decode().upper()
+            self.server.commands.append(command)
+            if command == "GETDEL" and self.server.drop_after.get("GETDEL"):
+                # Execute, then lose the connection before replying
+                data.pop(args[1], None)
+                return
+            if command == "GET":
+                reply = data.get(args[1])
+            elif command == "GETDEL":
+                reply = data.pop(args[1], None)
+            elif command == "SET":
+                data[args[1]] = args[2]
+                reply = "OK"
+            elif command in ("DEL", "EXISTS"):
+                reply = int(args[1] in data)
+                if command == "DEL":
+                    data.pop(args[1], None)
+            elif command == "SCAN":
+                pattern = args[3].decode()
+                reply = [b"0", [key for key in data if fnmatch.fnmatch(key.decode(), pattern)]]
+            else:
+                reply = "OK"
+            self.wfile.write(self.encode(reply))
+            if self.server.drop_after.get(command):
+                return  # server closes the now idle connection
+
+    def encode(self, reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, str):
+            return f"+{reply}\r\n".encode()
+        if isinstance(reply, int):
+            return f":{reply}\r\n".encode()
+        if isinstance(reply, bytes):
+            return b"$%d\r\n%s\r\n" % (len(reply), reply)
+        return f"*{len(reply)}\r\n".encode() + b"".join(self.encode(item) for item in reply)
+
+@pytest.fixture
+def fake_redis():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data = {}
+    server.commands = []
+    server.drop_after = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = RespClient.from_url(f"redis://127.0.0.1:{server.server_address[1]}/0")
+    client.server = server
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
 @pytest.fixture(autouse=True)
 def mock_user():
     with patch('chatbot.User') as mock_user_class:
         mock_user = MagicMock()
         mock_user.username = "test@example.com"
+        mock_user.servicenow_instance = None
+        mock_user.servicenow_instances = []
+        mock_user.servicenow_user_id = None
         mock_user_class.return_value = mock_user
         mock_user_class.model_validate = lambda x: mock_user
         yield mock_user_class
@@ -203,6 +294,65 @@ async def test_home_route_authenticated(authenticated_client):
     assert response.status_code == 200
     assert response.headers["content-type"] == "text/html; charset=utf-8"
 
+@pytest.mark.asyncio
+async def test_static_assets_hashed_precompressed_and_revalidated(client, tmp_path):
+    """Test hashed URLs are immutable, variants follow Accept-Encoding and ETags give 304"""
+    static_dir = tmp_path / "assets"
+    static_dir.mkdir()
+    script = "console.log('bot2bot');\n" * 200
+    (static_dir / "script.js").write_text(script)
+    (static_dir / "openai.png").write_bytes(b"\x89PNG" + b"\x00" * 2000)
+    assert precompress_assets(str(static_dir)).get("gzip") == 1
+    assert not (static_dir / "openai.png.gz").exists()
+
+    assets = StaticAssets(str(static_dir))
+    with patch('chatbot.static_assets', assets):
+        hashed_url = assets.url("script.js")
+        assert hashed_url != "/static/script.js"
+
+        response = await client.get(hashed_url, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.text == script  # httpx decodes the gzip body
+
+        response = await client.get("/static/script.js", headers={"Accept-Encoding": "gzip;q=0, identity"})
+        assert response.headers["cache-control"] == "no-cache"
+        assert "content-encoding" not in response.headers
+        etag = response.headers["etag"]
+
+        response = await client.get("/static/script.js", headers={"Accept-Encoding": "identity",
+                                                                    "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+        (tmp_path / "secret.txt").write_text("outside the static directory")
+        assert assets.load("../secret.txt") is None
+        assert (await client.get("/static/script.000000000000.js")).status_code == 404
+
+@pytest.mark.asyncio
+async def test_index_shell_references_hashed_assets(authenticated_client, tmp_path):
+    """Test the cached index shell points at hashed assets and is served compressed"""
+    static_dir = tmp_path / "shell"
+    static_dir.mkdir()
+    (static_dir / "styles.css").write_text("body { margin: 0; }")
+    (static_dir / "index.html").write_text(
+        '<link rel="stylesheet" href="/static/styles.css">' + "<p>chat</p>" * 200)
+
+    assets = StaticAssets(str(static_dir))
+    with patch('chatbot.static_assets', assets):
+        response = await authenticated_client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["cache-control"] == "no-cache"
+        assert f'href="{assets.url("styles.css")}"' in response.text
+        assert "/static/styles.css" not in response.text
+
+        response = await authenticated_client.get("/", headers={"Accept-Encoding": "gzip",
+                                                                "If-None-Match": response.headers["etag"]})
+        assert response.status_code == 304
+
 @pytest.mark.asyncio
 async def test_logout(authenticated_client, mock_sessions):
     """Test logout functionality"""
@@ -266,6 +416,72 @@ async def test_login_failure(client):
     )
     assert response.status_code == 401
 
+@pytest.mark.asyncio
+async def test_login_hashed_password_and_reload(client, tmp_path):
+    """Test hashed credentials and that edits to the users file are picked up"""
+    users_file = tmp_path / "users.json"
+    users_file.write_text(json.dumps({"hashed": {"password_hash": hash_password("secret", iterations=1000)}}))
+    store = CredentialStore(str(users_file))
+
+    with patch('chatbot.credential_store', store):
+        response = await client.post("/login", json={"username": "hashed", "password": "secret"})
+        assert response.status_code == 200
+        response = await client.post("/login", json={"username": "hashed", "password": "wrong"})
+        assert response.status_code == 401
+
+        users_file.write_text(json.dumps({"hashed": {"password": "rotated"}}))
+        os.utime(users_file, ns=(0, store.mtime + 1_000_000_000))
+        response = await client.post("/login", json={"username": "hashed", "password": "rotated"})
+        assert response.status_code == 200
+
+@pytest.mark.asyncio
+async def test_login_malformed_password_hash_is_rejected(client, tmp_path):
+    """Test a corrupt password_hash fails the login with 401 rather than a server error"""
+    users_file = tmp_path / "users.json"
+    users_file.write_text(json.dumps({
+        "zero": {"password_hash": "pbkdf2_sha256$0$00$00"},
+        "badhex": {"password_hash": "pbkdf2_sha256$1000$zz$00"},
+        "short": {"password_hash": "pbkdf2_sha256$1000"}
+    }))
+    with patch('chatbot.credential_store', CredentialStore(str(users_file))):
+        for username in ("zero", "badhex", "short"):
+            response = await client.post("/login", json={"username": username, "password": "secret"})
+            assert response.status_code == 401
+
+def test_credential_store_caches_users(tmp_path):
+    """Test that the users file is parsed once while unchanged"""
+    users_file = tmp_path / "users.json"
+    users_file.write_text(json.dumps({"admin": {"password": "admin123"}}))
+    store = CredentialStore(str(users_file))
+
+    with patch('chatbot.json.load', wraps=json.load) as mock_load:
+        assert store.get("admin") == {"password": "admin123"}
+        assert store.get("missing") is None
+        assert mock_load.call_count == 1
+    assert not verify_password("anything", None)
+
+def test_credential_store_throttles_file_checks(tmp_path, caplog):
+    """Test the users file is stat'ed at most once per check interval and plaintext logs a deprecation"""
+    users_file = tmp_path / "users.json"
+    users_file.write_text(json.dumps({"admin": {"password": "admin123"}}))
+    store = CredentialStore(str(users_file), check_interval=60)
+
+    with patch('chatbot.os.stat', wraps=os.stat) as mock_stat:
+        for _ in range(3):
+            record = store.get("admin")
+        assert mock_stat.call_count == 1
+    with caplog.at_level(logging.WARNING, logger="chatbot"):
+        assert verify_password("admin123", record)
+    assert "deprecated" in caplog.text
+
+def test_shipped_users_file_is_hashed():
+    """Test the default users.json has no plaintext passwords"""
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "users.json")
+    with open(path) as f:
+        users = json.load(f)
+    assert all("password" not in record and record.get("password_hash") for record in users.values())
+    assert verify_password("admin123", users["admin"])
+
 @pytest.mark.asyncio
 async def test_chat_gpt(authenticated_client, mock_openai):
     """Test chat with GPT"""
@@ -276,6 +492,36 @@ async def test_chat_gpt(authenticated_client, mock_openai):
     assert response.status_code == 200
     assert response.json()["response"] == "Test GPT response"
 
+@pytest.mark.asyncio
+async def test_chat_stream_gpt(authenticated_client):
+    """Test that GPT deltas are streamed as Server-Sent Events"""
+    chunks = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+        for text in ["Hel", "lo", None, "!"]
+    ]
+    mock_client = MagicMock()
+    mock_client.chat.completions.create.return_value = iter(chunks)
+
+    with patch('chatbot.client', mock_client):
+        response = await authenticated_client.post(
+            "/chat/stream",
+            json={"message": "test message", "session_id": "test-session"}
+        )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert mock_client.chat.completions.create.call_args.kwargs["stream"] is True
+
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in response.text.strip().split("\n\n")
+    ]
+    assert events == [
+        ("delta", {"delta": "Hel"}),
+        ("delta", {"delta": "lo"}),
+        ("delta", {"delta": "!"}),
+        ("done", {"response": "Hello!"})
+    ]
+
 @pytest.mark.asyncio
 async def test_chat_servicenow(authenticated_client, mock_servicenow):
     """Test chat with ServiceNow"""
@@ -287,6 +533,448 @@ async def test_chat_servicenow(authenticated_client, mock_servicenow):
     assert "servicenow_response" in response.json()
     assert "requestId" in response.json()["servicenow_response"]
 
+@pytest.mark.asyncio
+async def test_servicenow_async_client_reuses_pool(mock_sessions):
+    """Test that the async ServiceNow client is shared across calls"""
+    _, pending_responses = mock_sessions
+    seen = []
+
+    def handler(request):
+        seen.append(json.loads(request.content))
+        return httpx.Response(200, json={"body": [{"uiType": "ActionMsg", "message": "Please wait"}]})
+
+    api = ServiceNowAPI("test-instance", "user", "pass", "token")
+    api._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    pooled_client = api.get_async_client()
+
+    first = await api.send_message_to_va_async("hello", "session-1")
+    second = await api.send_message_to_va_async("again", "session-1")
+
+    assert first["status"] == "success"
+    assert second["status"] == "success"
+    assert api.get_async_client() is pooled_client
+    assert [payload["message"]["text"] for payload in seen] == ["hello", "again"]
+    assert first["requestId"] in pending_responses
+    await api.aclose()
+
+@pytest.mark.asyncio
+async def test_servicenow_async_client_error():
+    """Test that ServiceNow HTTP errors are reported rather than raised"""
+    api = ServiceNowAPI("test-instance", "user", "pass", "token")
+    api._async_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(503, text="unavailable"))
+    )
+
+    result = await api.send_message_to_va_async("hello", "session-1")
+    assert result["status"] == "error"
+    assert "Error communicating with ServiceNow" in result["error"]
+    await api.aclose()
+
+def test_servicenow_signature_covers_sent_bytes():
+    """Test the signature is the HMAC of the exact body and matches generate_signature"""
+    api = ServiceNowAPI("test-instance", "user", "pass", "token")
+    request_id, headers, payload = api.build_request("héllo", "session-1")
+
+    assert json.loads(payload)["requestId"] == request_id
+    assert b" " not in payload
+    expected = hmac.new(b"token", payload, hashlib.sha1).hexdigest()
+    assert headers["x-b2b-signature"] == expected
+    assert api.generate_signature(json.dumps(json.loads(payload), indent=2)) == expected
+
+def test_servicenow_registry_routing(tmp_path, monkeypatch):
+    """Test instances are loaded from file and chosen per user and per session"""
+    instances_file = tmp_path / "instances.json"
+    instances_file.write_text(json.dumps({
+        "hr": {"instance": "acme-hr", "username": "u", "token_env": "HR_TOKEN", "max_concurrency": 5},
+        "it": {"url": "http://it.local", "username": "u", "token": "it-token", "user_id": "svc.it"}
+    }))
+    monkeypatch.setenv("SERVICENOW_INSTANCES_FILE", str(instances_file))
+    monkeypatch.setenv("HR_TOKEN", "hr-token")
+    registry = ServiceNowRegistry.from_env()
+
+    assert registry.get("hr").integration_url.startswith("https://acme-hr/")
+    assert registry.get("hr").token == "hr-token"
+    assert registry.get("it").integration_url.startswith("http://it.local/")
+
+    hr_user = User(username="ann", servicenow_instance="hr", servicenow_instances=["it"])
+    assert registry.for_user(hr_user).name == "hr"
+    assert registry.for_user(hr_user, "it").name == "it"
+    assert registry.for_user(User(username="bob")).name == "default"
+    with pytest.raises(chatbot.HTTPException) as error:
+        registry.for_user(User(username="bob"), "hr")
+    assert error.value.status_code == 403
+
+    _, _, payload = registry.get("it").build_request("hi", "session-1")
+    assert json.loads(payload)["userId"] == "svc.it"
+    _, _, payload = registry.get("it").build_request("hi", "session-1", "ann")
+    assert json.loads(payload)["userId"] == "ann"
+
+@pytest.mark.asyncio
+async def test_servicenow_instance_concurrency_limit():
+    """Test a saturated instance reports busy instead of queueing forever"""
+    release = asyncio.Event()
+
+    async def slow_handler(request):
+        await release.wait()
+        return httpx.Response(200, json={})
+
+    api = ServiceNowAPI("test-instance", "user", "pass", "token", max_concurrency=1, queue_timeout=0.05)
+    api._async_client = httpx.AsyncClient(transport=httpx.MockTransport(slow_handler))
+    first = asyncio.create_task(api.send_message_to_va_async("hello", "session-1"))
+    await asyncio.sleep(0.01)
+
+    busy = await api.send_message_to_va_async("hello", "session-1")
+    assert busy["status"] == "error"
+    assert busy["retry_after"] > 0
+
+    release.set()
+    assert (await first)["status"] == "success"
+    await api.aclose()
+
+@pytest.mark.asyncio
+async def test_servicenow_retries_and_opens_circuit():
+    """Test refused VA calls are retried, and repeated failures fail fast"""
+    statuses = [503, 200, 502, 502]
+    api = ServiceNowAPI("test-instance", "user", "pass", "token", backend=Backend(
+        "servicenow", RetryPolicy(attempts=2, base_delay=0), CircuitBreaker("servicenow", failure_threshold=2),
+        ServiceNowAPI.is_failure, ServiceNowAPI.is_retryable
+    ))
+    api._async_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(statuses.pop(0), json={}))
+    )
+
+    assert (await api.send_message_to_va_async("hello", "session-1"))["status"] == "success"
+    # 502 may have been processed, so it is not resent, but it counts towards the circuit
+    assert (await api.send_message_to_va_async("hello", "session-1"))["status"] == "error"
+    assert statuses == [502]
+    assert (await api.send_message_to_va_async("hello", "session-1"))["status"] == "error"
+    assert api.backend.breaker.state == CircuitBreaker.OPEN
+
+    result = await api.send_message_to_va_async("hello", "session-1")
+    assert result["retry_after"] > 0
+    assert statuses == []
+    await api.aclose()
+
+def test_circuit_breaker_half_open_probe():
+    """Test a single probe is let through after the cool-down"""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=-1)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_gpt_retries_transient_errors():
+    """Test 429s are retried and reported as 503 once retries run out"""
+    rate_limit = openai.RateLimitError(
+        "Rate limited", response=httpx.Response(429, request=httpx.Request("POST", "http://test")), body=None
+    )
+
+    mock_response = MagicMock(choices=[MagicMock(message=MagicMock(content="Recovered"))])
+    mock_client = MagicMock()
+    backend = Backend("openai", RetryPolicy(attempts=2, base_delay=0), CircuitBreaker("openai"),
+                      chatbot.is_openai_failure)
+
+    with patch('chatbot.client', mock_client), patch('chatbot.openai_backend', backend):
+        mock_client.chat.completions.create.side_effect = [rate_limit, mock_response]
+        assert get_gpt_response("hello") == "Recovered"
+
+        mock_client.chat.completions.create.side_effect = rate_limit
+        with pytest.raises(chatbot.HTTPException) as error:
+            get_gpt_response("hello")
+    assert error.value.status_code == 503
+    assert mock_client.chat.completions.create.call_count == 4
+
+@pytest.mark.asyncio
+async def test_completion_limiter_round_robin():
+    """Test that queued GPT calls are served fairly across users"""
+    limiter = CompletionLimiter(max_concurrency=1, max_queue_depth=10)
+    order = []
+    release = asyncio.Event()
+
+    async def run(user, label):
+        async with limiter.slot(user):
+            order.append(label)
+            await release.wait()
+
+    holder = asyncio.create_task(run("alice", "a0"))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(run("alice", f"a{i}")) for i in range(1, 4)]
+    tasks.append(asyncio.create_task(run("bob", "b1")))
+    await asyncio.sleep(0)
+    assert limiter.stats()["queued"] == 4
+
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    assert order == ["a0", "a1", "b1", "a2", "a3"]
+    assert limiter.stats()["active"] == 0
+    assert limiter.stats()["queued"] == 0
+
+@pytest.mark.asyncio
+async def test_completion_limiter_backpressure():
+    """Test that a full GPT queue rejects with 503 instead of waiting"""
+    from fastapi import HTTPException
+    limiter = CompletionLimiter(max_concurrency=1, max_queue_depth=1)
+    await limiter.acquire("alice")
+    waiter = asyncio.create_task(limiter.acquire("bob"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await limiter.acquire("carol")
+    assert exc_info.value.status_code == 503
+    assert limiter.stats()["rejected"] == 1
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert limiter.stats()["queued"] == 0
+    limiter.release()
+    assert limiter.stats()["active"] == 0
+
+def test_redis_store(fake_redis):
+    """Test the Redis-protocol store against a local stand-in server"""
+    store = RedisStore(fake_redis, "pending_responses")
+    other_worker = RedisStore(RespClient(fake_redis.host, fake_redis.port), "pending_responses")
+    messages = [{"uiType": "OutputCard", "data": "{}"}]
+
+    store["req-1"] = messages
+    store["req-2"] = []
+    assert other_worker["req-1"] == messages
+    assert "req-1" in other_worker
+    assert sorted(other_worker) == ["req-1", "req-2"]
+    assert len(store) == 2
+
+    assert other_worker.pop("req-1") == messages
+    assert store.pop("req-1", None) is None
+    assert store.get("req-1") is None
+    del store["req-2"]
+    assert len(store) == 0
+    with pytest.raises(KeyError):
+        del store["req-2"]
+
+def test_resp_client_never_replays_written_commands(fake_redis):
+    """Test a dropped GETDEL is not resent, while stale idle connections are replaced"""
+    server = fake_redis.server
+    store = RedisStore(fake_redis, "pending_responses")
+    server.drop_after["SET"] = True
+    store["req-1"] = ["first"]
+    time.sleep(0.05)  # let the server close the idle connection
+    server.drop_after.clear()
+    store["req-2"] = ["second"]  # goes out on a fresh connection
+    assert store["req-2"] == ["second"]
+
+    server.drop_after["GETDEL"] = True
+    server.commands.clear()
+    with pytest.raises(ConnectionError):
+        store.pop("req-1")
+    assert server.commands == ["GETDEL"]
+
+def test_redis_store_encodes_values(fake_redis):
+    """Test that stores can round-trip non-JSON values such as sessions"""
+    store = RedisStore(fake_redis, "sessions", encode=lambda pair: list(pair), decode=tuple)
+    store["session"] = ("a", 1)
+    assert store["session"] == ("a", 1)
+
+def test_memory_store():
+    """Test the in-process store behaves like a dict"""
+    store = MemoryStore()
+    store["a"] = [1]
+    assert store.get("a") == [1]
+    assert store.pop("a") == [1]
+    assert "a" not in store
+
+def test_memory_store_ttl_and_sweep():
+    """Test that entries expire lazily and through the sweeper"""
+    store = MemoryStore(ttl=60)
+    store["old"] = [1]
+    store.set("short", [2], ttl=-1)
+    store.set("shorter", [3], ttl=-1)
+
+    assert "short" not in store
+    assert store.sweep() == 1
+    assert list(store) == ["old"]
+    assert store.stats()["expired"] == 2
+
+@pytest.mark.asyncio
+async def test_debug_state_reports_every_store(authenticated_client):
+    """Test every bounded store is registered, so it is swept and reported"""
+    with patch('chatbot.callback_stored_at', MemoryStore(ttl=60)) as stored_at:
+        stored_at["r1"] = 1.0
+        response = await authenticated_client.get("/debug/state")
+    assert response.status_code == 200
+    state = response.json()
+    assert {"sessions", "pending_responses", "relay_dialogues", "callback_stored_at"} <= set(state)
+    assert state["callback_stored_at"]["entries"] == 1
+
+def test_memory_store_lru_bounds():
+    """Test that entry and byte caps evict least recently used entries"""
+    store = MemoryStore(max_entries=2)
+    store["a"] = 1
+    store["b"] = 2
+    store["a"]  # touch a so b becomes least recently used
+    store["c"] = 3
+    assert sorted(store) == ["a", "c"]
+    assert store.stats()["evicted"] == 1
+
+    sized = MemoryStore(max_bytes=15)
+    sized["a"] = "x" * 8
+    sized["b"] = "y" * 8
+    assert list(sized) == ["b"]
+    assert sized.stats()["bytes"] == 10
+
+def test_sqlite_store_ttl_and_lru(tmp_path):
+    """Test the on-disk store expires and evicts like the memory store"""
+    store = SqliteStore(str(tmp_path / "cache.sqlite3"), ttl=60, max_entries=2)
+    store["a"] = {"x": 1}
+    store["b"] = 2
+    store["a"]  # touch a so b becomes least recently used
+    store["c"] = 3
+    assert sorted(store) == ["a", "c"]
+    assert store["a"] == {"x": 1}
+
+    store.set("short", 4, ttl=-1)
+    assert "short" not in store
+    assert store.stats()["expired"] == 1
+    assert store.stats()["evicted"] == 2
+
+    reopened = SqliteStore(str(tmp_path / "cache.sqlite3"))
+    assert reopened.get("a") == {"x": 1}
+
+def test_completion_cache_normalises_prompts():
+    """Test that trivially different prompts share a cache entry"""
+    cache = CompletionCache(MemoryStore())
+    cache.set("How do I reset my password?", "Use the portal")
+    assert cache.get("  how do i   RESET my password ") == "Use the portal"
+    assert cache.get("How do I reset my PIN?") is None
+
+@pytest.mark.asyncio
+async def test_chat_gpt_uses_cache(authenticated_client):
+    """Test repeated prompts are answered from the cache unless bypassed"""
+    with patch('chatbot.completion_cache', CompletionCache(MemoryStore())), \
+         patch('chatbot.get_gpt_response', return_value="Test GPT response") as mock_gpt:
+        for session_id, message in [("first", "Reset password?"), ("second", "reset password")]:
+            response = await authenticated_client.post(
+                "/chat", json={"message": message, "session_id": session_id}
+            )
+            assert response.json()["response"] == "Test GPT response"
+        assert mock_gpt.call_count == 1
+
+        await authenticated_client.post(
+            "/chat", json={"message": "reset password", "session_id": "third", "bypass_cache": True}
+        )
+        assert mock_gpt.call_count == 2
+
+@pytest.mark.asyncio
+async def test_chat_gpt_sends_conversation_history(authenticated_client):
+    """Test follow-up messages carry earlier turns from the same session only"""
+    with patch('chatbot.get_gpt_response', side_effect=["First answer", "Second answer", "Other"]) as mock_gpt:
+        for session_id, message in [("s1", "First question"), ("s1", "Follow up"), ("s2", "New chat")]:
+            await authenticated_client.post("/chat", json={"message": message, "session_id": session_id})
+
+    assert mock_gpt.call_args_list[0].args[1] == []
+    assert mock_gpt.call_args_list[1].args[1] == [
+        {"role": "user", "content": "First question"},
+        {"role": "assistant", "content": "First answer"}
+    ]
+    assert mock_gpt.call_args_list[2].args[1] == []
+
+def test_conversation_memory_budget():
+    """Test old turns are dropped from the ring and summarised outside the budget"""
+    memory = ConversationMemory({}, max_turns=3, token_budget=70, summary_budget=30)
+    for i in range(5):
+        memory.append("key", f"question {i}", "a" * 40)
+    assert [turn[0] for turn in memory.turns("key")] == ["question 2", "question 3", "question 4"]
+
+    context = memory.context("key", "next")
+    assert context[0]["role"] == "system"
+    assert "question 2" in context[0]["content"]
+    assert [m["content"] for m in context[1:]] == ["question 3", "a" * 40, "question 4", "a" * 40]
+
+def test_import_defers_heavy_clients():
+    """Test importing the app does not load openai, langsmith or jinja2"""
+    probe = ("import sys, chatbot; "
+             "print(','.join(m for m in ('openai', 'langsmith', 'jinja2') if m in sys.modules))")
+    env = dict(os.environ, OPENAI_API_KEY="test-key", LANGSMITH_API_KEY="test-langsmith-key")
+    result = subprocess.run([sys.executable, "-c", probe], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
+
+def test_gpt_client_is_built_once_on_first_use():
+    """Test the GPT client provider creates the client once, even for concurrent first calls"""
+    def slow_client(**kwargs):
+        time.sleep(0.05)
+        return MagicMock()
+
+    with patch('chatbot.openai_client', None), patch('chatbot.client', None), \
+         patch('chatbot.load_langsmith', return_value=None), \
+         patch('openai.OpenAI', side_effect=slow_client) as mock_openai:
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(chatbot.get_gpt_client())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert mock_openai.call_count == 1
+        assert all(gpt_client is chatbot.openai_client for gpt_client in clients)
+
+@pytest.mark.asyncio
+async def test_chat_uses_injected_gpt_client(authenticated_client):
+    """Test /chat sends completions through the client from Depends(get_gpt_client)"""
+    injected = MagicMock()
+    injected.chat.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content="Injected"))], usage=None)
+    app.dependency_overrides[chatbot.get_gpt_client] = lambda: injected
+    try:
+        response = await authenticated_client.post(
+            "/chat",
+            json={"message": "hi", "session_id": "test-session", "use_servicenow": False, "bypass_cache": True}
+        )
+    finally:
+        del app.dependency_overrides[chatbot.get_gpt_client]
+    assert response.json()["response"] == "Injected"
+    injected.chat.completions.create.assert_called_once()
+
+def test_lazy_json_only_serialises_when_emitted():
+    """Test that disabled log lines never serialise their payload"""
+    payload = MagicMock()
+    test_logger = logging.getLogger("chatbot.test_lazy")
+    test_logger.setLevel(logging.INFO)
+    with patch('chatbot.json.dumps') as mock_dumps:
+        test_logger.debug("Payload: %s", LazyJSON(payload))
+        mock_dumps.assert_not_called()
+    assert str(LazyJSON({"a": 1})) == '{"a": 1}'
+
+def test_structured_logging_configuration():
+    """Test JSON formatting and per-subsystem levels"""
+    test_logger = logging.getLogger("bot2bot_logging_test")
+    with patch.dict(os.environ, {"LOG_FORMAT": "json", "LOG_LEVELS": "poll=WARNING"}):
+        configure_logging(test_logger)
+    assert test_logger.getChild("poll").level == logging.WARNING
+    assert not test_logger.getChild("poll").isEnabledFor(logging.INFO)
+
+    record = test_logger.makeRecord(test_logger.name, logging.INFO, __file__, 1,
+                                    "Stored %d messages", (2,), None, extra={"request_id": "abc"})
+    entry = json.loads(test_logger.handlers[0].format(record))
+    assert entry["message"] == "Stored 2 messages"
+    assert entry["request_id"] == "abc"
+    assert entry["level"] == "INFO"
+
+    formatter = test_logger.handlers[0].formatter
+    assert isinstance(formatter, JsonFormatter)
+    try:
+        raise ValueError("bad callback")
+    except ValueError:
+        record = test_logger.makeRecord(test_logger.name, logging.ERROR, __file__, 1,
+                                        "Callback failed", (), sys.exc_info())
+    entry = json.loads(formatter.format(record))
+    assert entry["level"] == "ERROR"
+    assert "ValueError: bad callback" in entry["exc_info"]
+    test_logger.handlers.clear()
+
 def test_chatbot_api():
     """Test ChatbotAPI class"""
     api = ChatbotAPI()
@@ -344,6 +1032,28 @@ async def test_servicenow_callback(authenticated_client, mock_sessions):
     assert response.json()["status"] == "success"
     assert request_id in pending_responses
 
+@pytest.mark.asyncio
+async def test_servicenow_callback_message_selection(authenticated_client, mock_sessions):
+    """Test the last card wins and only the first picker after it is kept"""
+    _, pending_responses = mock_sessions
+    request_id = str(uuid.uuid4())
+    body = [
+        {"uiType": "Picker", "label": "stale"},
+        {"uiType": "OutputCard", "data": "{}"},
+        {"uiType": "Picker", "label": "first"},
+        {"uiType": "ActionMsg", "message": "wait"},
+        {"uiType": "Picker", "label": "second"},
+        "not a message"
+    ]
+    response = await authenticated_client.post(
+        "/servicenow/callback", json={"requestId": request_id, "body": body}
+    )
+    assert response.status_code == 200
+    assert pending_responses[request_id] == body[1:4]
+
+    response = await authenticated_client.post("/servicenow/callback", content=b"[1, 2]")
+    assert response.status_code == 400
+
 @pytest.mark.asyncio
 async def test_get_servicenow_responses(authenticated_client, mock_sessions):
     """Test getting ServiceNow responses"""
@@ -369,6 +1079,46 @@ async def test_get_servicenow_responses(authenticated_client, mock_sessions):
     assert "servicenow_response" in response.json()
     assert request_id not in pending_responses
 
+@pytest.mark.asyncio
+async def test_get_servicenow_responses_batch(authenticated_client, mock_sessions):
+    """Test several requests are fetched and acknowledged in one call"""
+    _, pending_responses = mock_sessions
+    pending_responses["a"] = [{"uiType": "OutputCard", "data": "{}"}]
+    pending_responses["b"] = [{"uiType": "ActionMsg", "message": "Please wait"}]
+
+    response = await authenticated_client.post("/servicenow/responses", json={
+        "request_ids": ["a", "b", "missing"],
+        "acknowledge": ["a"]
+    })
+    assert response.status_code == 200
+    assert response.json()["responses"] == {"a": [{"uiType": "OutputCard", "data": "{}"}],
+                                            "b": [{"uiType": "ActionMsg", "message": "Please wait"}]}
+    assert list(pending_responses) == ["b"]
+
+    response = await authenticated_client.post("/servicenow/responses", json={"request_ids": ["x"] * 101})
+    assert response.status_code == 422
+
+@pytest.mark.asyncio
+async def test_acknowledge_takes_response(authenticated_client, mock_sessions):
+    """Test both single-ID routes return the body when acknowledging and remove it"""
+    _, pending_responses = mock_sessions
+    for route in ("/poll", "/servicenow/responses"):
+        pending_responses["a"] = [{"uiType": "OutputCard", "data": "{}"}]
+        response = await authenticated_client.get(f"{route}/a", params={"acknowledge": "true"})
+        assert response.json()["servicenow_response"]["body"] == [{"uiType": "OutputCard", "data": "{}"}]
+        assert "a" not in pending_responses
+
+def test_memory_store_pop_is_atomic_and_respects_ttl():
+    """Test pop removes live values in one step and treats expired ones as missing"""
+    store = MemoryStore()
+    store["a"] = [1]
+    store.set("old", [2], ttl=-1)
+    assert store.pop("a") == [1]
+    assert store.pop("old", None) is None
+    assert store.stats()["expired"] == 1
+    with pytest.raises(KeyError):
+        store.pop("a")
+
 @pytest.mark.asyncio
 async def test_poll_request(authenticated_client, mock_sessions):
     """Test polling endpoint"""
@@ -387,6 +1137,364 @@ async def test_poll_request(authenticated_client, mock_sessions):
     assert "servicenow_response" in response.json()
     assert response.json()["servicenow_response"]["body"] == test_response
 
+@pytest.mark.asyncio
+async def test_long_poll_returns_when_callback_arrives(authenticated_client):
+    """Test that a long poll returns as soon as the callback is stored"""
+    request_id = str(uuid.uuid4())
+    poll = asyncio.create_task(authenticated_client.get(f"/poll/{request_id}?wait=5"))
+    for _ in range(100):
+        if chatbot.response_broker.subscribers:
+            break
+        await asyncio.sleep(0.01)
+
+    test_response = [{"uiType": "OutputCard", "data": json.dumps({"test": "data"})}]
+    await authenticated_client.post("/servicenow/callback", json={
+        "requestId": request_id,
+        "body": test_response
+    })
+
+    response = await asyncio.wait_for(poll, timeout=2)
+    assert response.status_code == 200
+    assert response.json()["servicenow_response"]["body"] == test_response
+
+@pytest.mark.asyncio
+async def test_long_poll_times_out_empty(authenticated_client):
+    """Test that a long poll with no callback returns an empty body after the wait"""
+    response = await authenticated_client.get(f"/poll/{uuid.uuid4()}?wait=0.05")
+    assert response.status_code == 200
+    assert response.json() == {"servicenow_response": {"body": []}}
+    assert not chatbot.response_broker.subscribers
+
+@pytest.mark.asyncio
+async def test_servicenow_events_sends_stored_response(authenticated_client, mock_sessions):
+    """Test that the SSE stream delivers an already stored response and acknowledges it"""
+    _, pending_responses = mock_sessions
+    request_id = str(uuid.uuid4())
+    test_response = [{
+        "uiType": "OutputCard",
+        "data": json.dumps({"test": "data"})
+    }]
+    pending_responses[request_id] = test_response
+
+    response = await authenticated_client.get(f"/servicenow/events/{request_id}?acknowledge=true")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    data_lines = [line for line in response.text.splitlines() if line.startswith("data: ")]
+    assert len(data_lines) == 1
+    event = json.loads(data_lines[0][len("data: "):])
+    assert event["requestId"] == request_id
+    assert event["servicenow_response"]["body"] == test_response
+    assert request_id not in pending_responses
+
+@pytest.mark.asyncio
+async def test_servicenow_events_pushes_callback(authenticated_client):
+    """Test that a callback is pushed to an open SSE stream"""
+    request_id = str(uuid.uuid4())
+    stream = asyncio.create_task(
+        authenticated_client.get(f"/servicenow/events/{request_id}?timeout=5")
+    )
+    for _ in range(100):
+        if chatbot.response_broker.subscribers:
+            break
+        await asyncio.sleep(0.01)
+
+    callback = await authenticated_client.post("/servicenow/callback", json={
+        "requestId": request_id,
+        "clientSessionId": "abc123",
+        "body": [{"uiType": "Picker", "label": "Choose", "options": []}]
+    })
+    assert callback.status_code == 200
+
+    response = await asyncio.wait_for(stream, timeout=5)
+    assert response.status_code == 200
+    assert '"uiType": "Picker"' in response.text
+    assert not chatbot.response_broker.subscribers
+
+@pytest.mark.asyncio
+async def test_relay_dialogue(authenticated_client, mock_sessions, fake_redis):
+    """Test GPT and the VA converse until GPT reports the goal is done"""
+    _, pending_responses = mock_sessions
+    # Snapshots go through a shared store, so any worker can answer GET /relay
+    other_worker = RedisStore(RespClient(fake_redis.host, fake_redis.port), "relay")
+    sent = []
+    user_ids = set()
+
+    async def fake_send(message, session_id, user_id=None):
+        request_id = str(uuid.uuid4())
+        sent.append(message)
+        user_ids.add(user_id)
+        picker = {"uiType": "Picker", "label": "Which system?", "options": [{"label": "Email"}, {"label": "VPN"}]}
+        # Deliver the reply the way the callback endpoint does, after the send has returned
+        asyncio.get_running_loop().call_later(0.01, lambda: (
+            pending_responses.__setitem__(request_id, [picker]),
+            chatbot.response_broker.publish(request_id, [picker], session_id[:6])
+        ))
+        return {"status": "success", "requestId": request_id}
+
+    with patch.object(chatbot.servicenow_api, 'send_message_to_va_async', side_effect=fake_send), \
+         patch('chatbot.get_gpt_response', side_effect=["Reset my password", "VPN", "DONE"]) as mock_gpt, \
+         patch('chatbot.relay_dialogues', RedisStore(fake_redis, "relay")):
+        response = await authenticated_client.post("/relay", json={"goal": "Reset a VPN password"})
+        assert response.status_code == 200
+        await asyncio.gather(*chatbot.relay_tasks)
+
+    with patch('chatbot.relay_dialogues', other_worker):
+        relay = (await authenticated_client.get(f"/relay/{response.json()['relay_id']}")).json()
+    assert relay["status"] == "completed"
+    assert sent == ["Reset my password", "VPN"]
+    assert user_ids == {"test@example.com"}  # the logged-in user, as for /chat
+    assert [entry["speaker"] for entry in relay["transcript"]] == ["gpt", "servicenow", "gpt", "servicenow", "gpt"]
+    assert relay["transcript"][1]["text"] == "Which system?\n1. Email\n2. VPN"
+    assert "Reset a VPN password" in mock_gpt.call_args.args[2]
+    assert pending_responses == {}
+
+@pytest.mark.asyncio
+async def test_relay_done_on_last_turn_completes(authenticated_client, mock_sessions):
+    """Test limits above the configured caps are rejected and DONE on the final turn counts as completed"""
+    _, pending_responses = mock_sessions
+
+    async def fake_send(message, session_id, user_id=None):
+        request_id = str(uuid.uuid4())
+        pending_responses[request_id] = [{"uiType": "Picker", "label": "Anything else?", "options": []}]
+        return {"status": "success", "requestId": request_id}
+
+    response = await authenticated_client.post("/relay", json={"goal": "x", "max_turns": chatbot.RELAY_MAX_TURNS + 1})
+    assert response.status_code == 422
+    response = await authenticated_client.post("/relay", json={"goal": "x", "timeout": chatbot.RELAY_TIMEOUT_SECONDS * 2})
+    assert response.status_code == 422
+
+    store = chatbot.MemoryStore(ttl=60)
+    with patch.object(chatbot.servicenow_api, 'send_message_to_va_async', side_effect=fake_send), \
+         patch('chatbot.get_gpt_response', side_effect=["Hi", "Bye", "DONE"]), \
+         patch.object(store, 'set', wraps=store.set) as mock_set:
+        request = chatbot.RelayRequest(goal="x", max_turns=2)
+        relay = await chatbot.BotRelay("r1", request, "test@example.com", store=store).run()
+
+    assert relay["status"] == "completed"
+    assert relay["turns"] == 2
+    # Every turn re-saves the dialogue, refreshing its TTL
+    assert mock_set.call_count == len(relay["transcript"]) + 1
+    assert store.get("r1")["status"] == "completed"
+
+@pytest.mark.asyncio
+async def test_run_batch_streams_results(tmp_path, mock_sessions):
+    """Test scripted conversations are replayed and written out as JSONL"""
+    _, pending_responses = mock_sessions
+    card = {"uiType": "OutputCard", "data": json.dumps({"fields": [{"fieldLabel": "Top Result:", "fieldValue": "Done"}]})}
+
+    async def fake_send(message, session_id, user_id=None):
+        # An immediate reply, stored before send returns
+        request_id = str(uuid.uuid4())
+        pending_responses[request_id] = [card]
+        return {"status": "success", "requestId": request_id}
+
+    input_path = tmp_path / "input.jsonl"
+    input_path.write_text("\n".join([
+        json.dumps({"id": "sn", "turns": ["hello", "thanks"]}),
+        json.dumps({"id": "gpt", "mode": "gpt", "turns": ["one", "two"]}),
+        "not json"
+    ]) + "\n")
+    output_path = tmp_path / "output.jsonl"
+
+    with patch.object(chatbot.servicenow_api, 'send_message_to_va_async', side_effect=fake_send), \
+         patch('chatbot.get_gpt_response', side_effect=["First", "Second"]):
+        totals = await chatbot.run_batch(str(input_path), str(output_path), parallelism=2)
+
+    assert totals == {"ok": 2, "error": 1}
+    results = {result["line"]: result for result in map(json.loads, output_path.read_text().splitlines())}
+    assert [turn["response"] for turn in results[1]["turns"]] == ["Top Result: Done", "Top Result: Done"]
+    assert [turn["response"] for turn in results[2]["turns"]] == ["First", "Second"]
+    assert results[3]["status"] == "error"
+    assert pending_responses == {}
+
+@pytest.mark.asyncio
+async def test_batch_callback_app_serves_only_callbacks(mock_sessions):
+    """Test the batch runner's listener accepts callbacks and exposes nothing else"""
+    _, pending_responses = mock_sessions
+    picker = {"uiType": "Picker", "label": "Which system?", "options": []}
+    async with httpx.AsyncClient(app=chatbot.callback_app(), base_url="http://test") as client:
+        response = await client.post("/servicenow/callback", json={"requestId": "r1", "body": [picker]})
+        assert response.status_code == 200
+        assert "r1" in pending_responses
+        for path in ("/", "/chat", "/debug/pending_responses", "/docs", "/health/ready"):
+            assert (await client.get(path)).status_code == 404
+
+@pytest.mark.asyncio
+async def test_rate_limit_poll(authenticated_client):
+    """Test per-session buckets reject with 429 and Retry-After, and other routes are unaffected"""
+    rules = chatbot.parse_rate_limits("GET /poll/{request_id} session=0.5/2")
+    with patch('chatbot.rate_limits', rules):
+        statuses = [(await authenticated_client.get(f"/poll/{uuid.uuid4()}")).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+        limited = chatbot.HTTP_REQUESTS.get(method="GET", route="/poll/{request_id}", status=429)
+        response = await authenticated_client.get("/poll/other")
+        assert response.headers["Retry-After"] == "2"
+        # Rejected before routing, but still counted under the route template
+        assert chatbot.HTTP_REQUESTS.get(method="GET", route="/poll/{request_id}", status=429) == limited + 1
+        assert (await authenticated_client.get("/servicenow/responses/other")).status_code == 200
+
+def test_token_bucket_refill_and_idle_expiry():
+    """Test buckets refill over time and idle keys are dropped"""
+    limiter = chatbot.TokenBucketLimiter(rate=1, burst=2)
+    assert limiter.acquire("a", now=0) == 0
+    assert limiter.acquire("a", now=0) == 0
+    assert limiter.acquire("a", now=0) == pytest.approx(1)
+    assert limiter.acquire("a", now=1) == 0
+    limiter.acquire("b", now=1)
+    # a has been idle long enough to refill completely
+    limiter.acquire("b", now=3.5)
+    assert list(limiter.buckets) == ["b"]
+
+def test_parse_rate_limits_rejects_bad_rules():
+    """Test invalid rules fail with a ValueError naming the entry"""
+    for spec, error in [
+        ("POST /chat user=0/5", "needs rate > 0"),
+        ("POST /chat user=-1/5", "needs rate > 0"),
+        ("POST /chat user=1/0.5", "burst >= 1"),
+        ("POST /chat user=fast", "is not rate/burst"),
+        ("POST", "needs a method and a path"),
+    ]:
+        with pytest.raises(ValueError, match=error) as excinfo:
+            chatbot.parse_rate_limits(spec)
+        assert spec in str(excinfo.value)
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(authenticated_client, mock_sessions):
+    """Test route, callback delivery and store metrics are exposed"""
+    _, pending_responses = mock_sessions
+    request_id = str(uuid.uuid4())
+    await authenticated_client.post("/servicenow/callback", json={
+        "requestId": request_id,
+        "body": [{"uiType": "OutputCard", "data": "{}"}]
+    })
+    await authenticated_client.get(f"/poll/{request_id}")
+
+    response = await authenticated_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_requests_total{method="POST",route="/servicenow/callback",status="200"}' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/poll/{request_id}"}' in body
+    assert 'servicenow_callback_delivery_seconds_count{channel="poll"} ' in body
+    assert f"pending_responses_entries {len(pending_responses)}" in body
+    with patch('chatbot.callback_stored_at', MemoryStore(max_entries=1)) as stored_at:
+        stored_at["a"], stored_at["b"] = 1.0, 2.0
+        body = (await authenticated_client.get("/metrics")).text
+    assert "# TYPE state_store_evictions_total counter" in body
+    assert 'state_store_evictions_total{store="callback_stored_at"} 1' in body
+    assert 'state_store_expired_total{store="callback_stored_at"} 0' in body
+
+    # Instance names are label values, so any name yields a valid metric name
+    registry = ServiceNowRegistry({"default": ServiceNowAPI("dev", "u", "p", "t"),
+                                   "acme-hr": ServiceNowAPI("acme", "u", "p", "t", name="acme-hr")}, "default")
+    with patch('chatbot.servicenow_instances', registry):
+        body = (await authenticated_client.get("/metrics")).text
+    assert 'backend_circuit_state{backend="servicenow_acme-hr"} 0' in body
+    assert 'backend_circuit_state{backend="openai"} 0' in body
+    assert "acme-hr_circuit_state" not in body
+
+    with patch.dict(os.environ, {"METRICS_TOKEN": "secret"}):
+        assert (await authenticated_client.get("/metrics")).status_code == 401
+        response = await authenticated_client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        assert response.status_code == 200
+
+def test_histogram_buckets_are_cumulative():
+    """Test histogram exposition"""
+    histogram = chatbot.Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    lines = histogram.render().splitlines()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 2' in lines
+    assert 'test_seconds_count{route="/a"} 2' in lines
+
+@pytest.mark.asyncio
+async def test_health_readiness_follows_lifecycle(client):
+    """Test liveness is always up while readiness waits for warm-up and fails during drain"""
+    lifecycle = chatbot.Lifecycle()
+    with patch('chatbot.lifecycle', lifecycle):
+        assert (await client.get("/health/live")).status_code == 200
+        assert (await client.get("/health/ready")).status_code == 503
+
+        lifecycle.ready = True
+        response = await client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.json()["ready"] is True
+
+        lifecycle.draining = True
+        assert (await client.get("/health/ready")).status_code == 503
+
+@pytest.mark.asyncio
+async def test_lifecycle_drain_waits_for_relay_dialogues():
+    """Test drain waits for relay dialogues until the shared deadline"""
+    lifecycle = chatbot.Lifecycle()
+    release = asyncio.Event()
+    tasks = set()
+    task = asyncio.create_task(release.wait())
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    with patch('chatbot.relay_tasks', tasks):
+        assert await lifecycle.drain(0.1) is False
+        assert lifecycle.draining
+
+        # The deadline set when draining began is not extended by later calls
+        release.set()
+        await task
+        assert await lifecycle.drain(60) is True
+    assert lifecycle.remaining() == 0.0
+
+@pytest.mark.asyncio
+async def test_draining_server_fails_readiness_before_stopping():
+    """Test SIGTERM keeps the worker serving, but not ready, for the pre-stop delay"""
+    lifecycle = chatbot.Lifecycle()
+    lifecycle.ready = True
+    server = chatbot.DrainingServer(uvicorn.Config(app))
+    server.should_exit = True  # what uvicorn's signal handler does
+    with patch.object(app.state, 'lifecycle', lifecycle), patch('chatbot.SHUTDOWN_DELAY_SECONDS', 0.05):
+        assert await server.on_tick(1) is False
+        assert lifecycle.status()["ready"] is False
+        await asyncio.sleep(0.06)
+        assert await server.on_tick(2) is True
+
+def test_draining_supervisor_signals_all_workers_before_joining():
+    """Test every worker is sent SIGTERM before the supervisor waits on any of them"""
+    calls = []
+    processes = [MagicMock(), MagicMock()]
+    for i, process in enumerate(processes):
+        process.terminate.side_effect = lambda i=i: calls.append(("terminate", i))
+        process.join.side_effect = lambda i=i: calls.append(("join", i))
+    supervisor = chatbot.DrainingSupervisor(uvicorn.Config(app), target=lambda sockets: None, sockets=[])
+    supervisor.processes = processes
+    supervisor.shutdown()
+    assert calls == [("terminate", 0), ("terminate", 1), ("join", 0), ("join", 1)]
+
+def test_uvicorn_shutdown_hooks_are_still_called():
+    """Test the uvicorn internals DrainingServer and DrainingSupervisor override are still in use"""
+    from uvicorn.supervisors.multiprocess import Multiprocess
+    # Both are private to uvicorn; if an upgrade stops calling them, the drain silently stops working
+    assert asyncio.iscoroutinefunction(uvicorn.Server.on_tick)
+    assert "self.on_tick(" in inspect.getsource(uvicorn.Server.main_loop)
+    assert "self.shutdown()" in inspect.getsource(Multiprocess.run)
+    assert "processes" in inspect.getsource(Multiprocess.startup)
+
+def test_worker_app_path_does_not_reimport_the_script():
+    """Test workers load the app from the module already executed, not a second copy"""
+    assert chatbot.worker_app_path() == "chatbot:app"
+    with patch('chatbot.__name__', "__main__"):
+        assert chatbot.worker_app_path() == "__mp_main__:app"
+
+@pytest.mark.asyncio
+async def test_warm_up_failure_is_best_effort():
+    """Test a failing warm-up step is recorded without failing startup"""
+    lifecycle = chatbot.Lifecycle()
+
+    async def fail():
+        raise ConnectionError("unreachable")
+
+    await lifecycle.warm_up_component("servicenow:default", fail)
+    assert lifecycle.warmup["servicenow:default"] == "error: unreachable"
+
 @pytest.mark.asyncio
 async def test_debug_pending_responses(authenticated_client, mock_sessions):
     """Test debug endpoint for pending responses"""
@@ -415,8 +1523,11 @@ async def test_unauthenticated_access(client):
     """Test that endpoints require authentication"""
     endpoints = [
         ("/chat", "POST"),
+        ("/chat/stream", "POST"),
         ("/servicenow/responses/test-id", "GET"),
         ("/poll/test-id", "GET"),
+        ("/servicenow/events/test-id", "GET"),
+        ("/relay/test-id", "GET"),
         ("/debug/pending_responses", "GET")
     ]
     